@@ -1,10 +1,10 @@
 from flask import Flask
 from flask_marshmallow import Marshmallow
-from flask_sqlalchemy import SQLAlchemy
 from config import config_options
+from .database import RoutingSQLAlchemy
 
 # Initializing imports
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 ma = Marshmallow()
 
 def create_app(config_name):
@@ -19,6 +19,10 @@ def create_app(config_name):
 
     # Initialize the db to the app
     db.init_app(app)
+
+    # Time requests and the SQL they run
+    from .instrumentation import init_instrumentation
+    init_instrumentation(app)
     
     # Initialize the api blueprint
     from .api import api_bp as api_blueprint
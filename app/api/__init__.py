@@ -1,9 +1,50 @@
 from flask import Blueprint
 from flask_restful import Api
+from ..encoding import init_encoding
+from .resources.Batch import BatchResource
 from .resources.Hello import Hello
+from .resources.Profile import ProfileResource
+from .resources.Post import PostResource
+from .resources.Comment import CommentResource
+from .resources.Deletion import DeletionResource
+from .resources.Metrics import MetricsResource
+from .resources.Upload import UploadResource
+from .resources.search.Autocomplete import AutocompleteResource
+from .resources.search.Profile import ProfileSearchResource
+from .resources.search.Post import PostSearchResource
+from .resources.sub.Activate import ActivateResource
+from .resources.sub.Follow import FollowResource, FollowSuggestionResource, MutualFollowResource
+from .resources.sub.Like import LikeResource
+from .resources.sub.Media import MediaResource
+from .resources.sub.Tags import TaggedPostsResource, TagResource
+from .resources.sub.Timeline import TimelineResource
+from .resources.sub.Trending import TrendingResource
+from .resources.sub.Verify import VerifyResource
 
 api_bp = Blueprint('api', __name__)
 api = Api(api_bp)
+init_encoding(api)
 
 # Registering the routes
-api.add_resource(Hello, '/hello')
\ No newline at end of file
+api.add_resource(Hello, '/hello')
+api.add_resource(MetricsResource, '/metrics')
+api.add_resource(BatchResource, '/batch')
+api.add_resource(ProfileResource, '/profiles', '/profiles/<int:profile_id>')
+api.add_resource(PostResource, '/posts', '/posts/<int:post_id>')
+api.add_resource(CommentResource, '/comments', '/posts/<int:post_id>/comments')
+api.add_resource(UploadResource, '/uploads', '/uploads/<string:upload_id>')
+api.add_resource(DeletionResource, '/deletions/<int:job_id>')
+api.add_resource(MediaResource, '/posts/<int:post_id>/media')
+api.add_resource(ProfileSearchResource, '/search/profiles')
+api.add_resource(PostSearchResource, '/search/posts')
+api.add_resource(AutocompleteResource, '/autocomplete')
+api.add_resource(FollowResource, '/follow/<int:profile_id>')
+api.add_resource(MutualFollowResource, '/follow/<int:profile_id>/mutual')
+api.add_resource(FollowSuggestionResource, '/follow/<int:profile_id>/suggestions')
+api.add_resource(LikeResource, '/likes')
+api.add_resource(ActivateResource, '/activate')
+api.add_resource(VerifyResource, '/verify')
+api.add_resource(TagResource, '/tags')
+api.add_resource(TaggedPostsResource, '/tags/<string:tag_text>/posts')
+api.add_resource(TimelineResource, '/timeline/<int:profile_id>')
+api.add_resource(TrendingResource, '/trending')
@@ -0,0 +1,26 @@
+from flask import current_app, request
+from flask_restful import Resource
+from ...batch import InvalidBatch, parse_batch, run_batch
+
+class BatchResource(Resource):
+    '''
+    Defining API endpoints for running several API requests in one round trip
+
+    The body is {"requests": [{"method", "path", "body", "headers"}, ...],
+    "parallel": false}. Results come back in the same order, each with the
+    status, headers and body the request would have had on its own.
+    '''
+    def post(self):
+        json_data = request.get_json(force=True)
+        try:
+            subs = parse_batch(json_data, current_app.config['BATCH_MAX_REQUESTS'])
+        except InvalidBatch as e:
+            return {
+                'success': False,
+                'message': str(e)
+            }, 400
+
+        return {
+            'success': True,
+            'data': run_batch(subs, parallel=bool(json_data.get('parallel')))
+        }, 200
@@ -0,0 +1,85 @@
+from flask import request
+from flask_restful import Resource
+from sqlalchemy import false
+from ...conditional import is_conditional, not_modified, not_modified_response, page_rows, validators, versions
+from ...models import Comment, CommentSchema, Post
+from ...pagination import InvalidCursor, page_args, paginate
+from ...serializers import dump
+
+comments_schema = CommentSchema(many=True)
+comment_schema = CommentSchema()
+
+class CommentResource(Resource):
+    '''
+    Defining API endpoints for the comments
+    '''
+    def get(self, post_id=None):
+        # Comments on posts pending deletion are hidden with their post
+        query = Comment.query.join(Post, Post.id == Comment.post_id).filter(Post.pending_deletion == false())
+        if post_id is not None:
+            if not Post.visible().filter_by(id=post_id).count():
+                return {
+                    'success': False,
+                    'message': 'Post does not exist in the database'
+                }, 404
+        else:
+            post_id = request.args.get('post_id', type=int)
+        if post_id is not None:
+            query = query.filter(Comment.post_id == post_id)
+
+        try:
+            limit, after = page_args()
+        except InvalidCursor:
+            return {
+                'success': False,
+                'message': 'Invalid cursor'
+            }, 400
+
+        params = {'limit': limit, 'after': request.args.get('after'), 'post_id': post_id}
+        if is_conditional():
+            headers = validators('comment', params, versions(page_rows(query, Comment, Comment.timestamp, limit, after)))
+            if not_modified(headers):
+                return not_modified_response(headers)
+
+        comments, next_cursor = paginate(query, Comment.timestamp, Comment.id, limit, after)
+        headers = validators('comment', params, versions(comments))
+        comments = dump(comments_schema, comments)
+        return {
+            'success': True,
+            'data': comments,
+            'next_cursor': next_cursor
+        }, 200, headers
+
+    def post(self, post_id=None):
+        json_data = request.get_json(force=True)
+        if not json_data:
+            return {
+                'success': False,
+                'message': 'No input data provided'
+            }, 400
+        if post_id is not None:
+            json_data['post_id'] = post_id
+
+        # Validate and deserialize data
+        try:
+            data = comment_schema.load(json_data)
+            comment = Comment(**data)
+        except Exception as e:
+            return {
+                'success': False,
+                'message': 'Unable to process data',
+                'error': str(e)
+            }, 422
+
+        if not Post.visible().filter_by(id=comment.post_id).count():
+            return {
+                'success': False,
+                'message': 'Post does not exist in the database'
+            }, 404
+
+        comment.save_comment()
+        return {
+            'success': True,
+            'message': 'Successfully added Comment',
+            'data': comment_schema.dump(comment)
+        }, 201
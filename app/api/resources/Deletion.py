@@ -0,0 +1,27 @@
+from flask_restful import Resource
+from ...deletion import step_names
+from ...models import DeletionJob, DeletionJobSchema
+
+deletion_job_schema = DeletionJobSchema()
+
+class DeletionResource(Resource):
+    '''
+    Defining API endpoints for the progress of background deletions
+
+    step is the step being worked on, out of the ones listed in steps, and
+    rows_deleted how many rows are gone so far.
+    '''
+    def get(self, job_id):
+        job = DeletionJob.query.get(job_id)
+        if job is None:
+            return {
+                'success': False,
+                'message': 'Deletion does not exist in the database'
+            }, 404
+
+        data = deletion_job_schema.dump(job)
+        data['steps'] = step_names(job.entity)
+        return {
+            'success': True,
+            'data': data
+        }, 200
@@ -0,0 +1,10 @@
+from flask import Response
+from flask_restful import Resource
+from ...instrumentation import render_metrics
+
+class MetricsResource(Resource):
+    '''
+    Defining API endpoints for the Prometheus metrics of this worker, or of all of them with METRICS_DIR
+    '''
+    def get(self):
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,244 @@
+from flask import request
+from flask_restful import Resource
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from ... import db
+from ...cache import get_cache
+from ...comments import embed_comments, preview_size
+from ...conditional import (
+    dumped_versions, entity_row, is_conditional, not_modified, not_modified_response, page_rows, validators, versions
+)
+from ...media import InvalidUpload, get_media_pipeline
+from ...models import MediaStatus, Post, PostSchema, Profile, ProfileSchema
+from ...pagination import InvalidCursor, page_args, paginate
+from ...serializers import dump
+from ...sparse import InvalidFields, columns_option, project, sparse_args, sparse_schema
+from ...streaming import stream_ndjson, wants_ndjson
+
+posts_schema = PostSchema(many=True)
+post_schema = PostSchema()
+author_schema = ProfileSchema()
+
+# Relationships a client can ask to be embedded with ?include=
+INCLUDES = {
+    'author': selectinload('post_profile'),
+    'tags': selectinload('tags')
+}
+
+def _load_options(fields, include):
+    options = [INCLUDES[name] for name in include]
+    if fields:
+        # The author is loaded through profile_id, pages are keyed on timestamp
+        required = ('timestamp', 'updated_at', 'profile_id') if 'author' in include else ('timestamp', 'updated_at')
+        options.append(columns_option(Post, fields, *required))
+    return options
+
+def _embed(posts, data, include):
+    for post, item in zip(posts, data):
+        if 'author' in include:
+            item['author'] = dump(author_schema, post.post_profile) if post.post_profile else None
+        if 'tags' in include:
+            item['tags'] = [tag.tag_text for tag in post.tags]
+    return data
+
+def _author_versions(profile_ids):
+    # Embedded authors change the representation without changing the post
+    profile_ids = set(id for id in profile_ids if id is not None)
+    if not profile_ids:
+        return []
+    return versions(db.session.query(Profile.id, Profile.updated_at).filter(
+        Profile.id.in_(profile_ids)
+    ).order_by(Profile.id))
+
+def _loaded_versions(posts, include):
+    if 'author' not in include:
+        return versions(posts)
+    authors = {post.post_profile.id: post.post_profile for post in posts if post.post_profile}
+    return versions(posts) + versions(authors[id] for id in sorted(authors))
+
+def _current_versions(rows, include):
+    if 'author' not in include:
+        return versions(rows)
+    return versions(rows) + _author_versions(row.profile_id for row in rows)
+
+class PostResource(Resource):
+    '''
+    Defining API endpoints for the posts
+    '''
+    def get(self, post_id=None):
+        try:
+            fields, include = sparse_args(PostSchema, INCLUDES)
+        except InvalidFields as e:
+            return {
+                'success': False,
+                'message': str(e)
+            }, 400
+
+        if post_id is not None:
+            return self.get_one(post_id, fields, include)
+
+        schema = sparse_schema(PostSchema, fields, many=True)
+        query = Post.visible()
+        profile_id = request.args.get('profile_id', type=int)
+        if profile_id is not None:
+            query = query.filter_by(profile_id=profile_id)
+
+        # Streamed exports read plain rows, so only ?fields= applies to them
+        if wants_ndjson():
+            return stream_ndjson(query.order_by(Post.id), schema)
+
+        try:
+            limit, after = page_args()
+        except InvalidCursor:
+            return {
+                'success': False,
+                'message': 'Invalid cursor'
+            }, 400
+
+        comments = preview_size()
+        params = {
+            'limit': limit,
+            'after': request.args.get('after'),
+            'profile_id': profile_id,
+            'comments': comments,
+            'fields': fields,
+            'include': include
+        }
+        # Revalidation only reads the ids and versions of the page, comments
+        # and tags changing bump the version of their post
+        if is_conditional():
+            rows = page_rows(query, Post, Post.timestamp, limit, after, Post.profile_id)
+            headers = validators('post', params, _current_versions(rows, include))
+            if not_modified(headers):
+                return not_modified_response(headers)
+
+        query = query.options(*_load_options(fields, include))
+
+        def load_page():
+            posts, next_cursor = paginate(query, Post.timestamp, Post.id, limit, after)
+            data = _embed(posts, dump(schema, posts), include)
+            return {
+                'data': embed_comments(posts, data, comments),
+                'next_cursor': next_cursor,
+                'headers': validators('post', params, _loaded_versions(posts, include))
+            }
+
+        page = get_cache().page('post', params, load_page)
+        return {
+            'success': True,
+            'data': page['data'],
+            'next_cursor': page['next_cursor']
+        }, 200, page['headers']
+
+    def get_one(self, post_id, fields=None, include=()):
+        params = {'fields': fields, 'include': include}
+        if is_conditional():
+            row = entity_row(Post, post_id, Post.profile_id)
+            if row is not None:
+                headers = validators('post', params, _current_versions([row], include))
+                if not_modified(headers):
+                    return not_modified_response(headers)
+
+        if include:
+            post = Post.visible().options(*_load_options(fields, include)).filter_by(id=post_id).first()
+            data = _embed([post], [dump(sparse_schema(PostSchema, fields), post)], include)[0] if post else None
+            current = _loaded_versions([post], include) if post else None
+        else:
+            def load_post():
+                post = Post.visible().filter_by(id=post_id).first()
+                return dump(post_schema, post) if post else None
+
+            # The whole post is cached once and narrowed for each request
+            cached = get_cache().entity('post', post_id, load_post)
+            data = project(cached, fields)
+            current = dumped_versions(post_id, cached) if cached else None
+
+        if data is None:
+            return {
+                'success': False,
+                'message': 'Post does not exist in the database'
+            }, 404
+
+        return {
+            'success': True,
+            'data': data
+        }, 200, validators('post', params, current)
+
+    def post(self):
+        json_data = request.get_json(force=True)
+        if not json_data:
+            return {
+                'success': False,
+                'message': 'No input data provided'
+            }, 400
+
+        # Media sent through /uploads is stored in the background
+        upload_id = json_data.pop('upload_id', None)
+        if upload_id is not None:
+            try:
+                upload = get_media_pipeline().spool.describe(upload_id)
+            except InvalidUpload as e:
+                return {
+                    'success': False,
+                    'message': str(e)
+                }, 404
+            if not upload['complete']:
+                return {
+                    'success': False,
+                    'message': 'Upload is incomplete',
+                    'data': {'offset': upload['offset']}
+                }, 409
+            if Post.query.filter_by(media_upload=upload_id).first() is not None:
+                return {
+                    'success': False,
+                    'message': 'Upload is already attached to a post'
+                }, 409
+            json_data.setdefault('media', Post.media.default.arg)
+
+        # Validate and deserialize data
+        try:
+            data = post_schema.load(json_data)
+            post = Post(**data)
+        except Exception as e:
+            return {
+                'success': False,
+                'message': 'Unable to process data',
+                'error': str(e)
+            }, 422
+
+        # Profiles pending deletion take no new posts
+        if post.profile_id is not None and Profile.visible().filter_by(id=post.profile_id).first() is None:
+            return {
+                'success': False,
+                'message': 'Profile does not exist in the database'
+            }, 404
+
+        if upload_id is not None:
+            post.media_status = MediaStatus.pending.value
+            post.media_upload = upload_id
+        try:
+            post.save_post()
+        except IntegrityError:
+            db.session.rollback()
+            # Another request claimed the upload since it was checked above
+            if upload_id is None or Post.query.filter_by(media_upload=upload_id).first() is None:
+                raise
+            return {
+                'success': False,
+                'message': 'Upload is already attached to a post'
+            }, 409
+
+        result = post_schema.dump(post)
+        if upload_id is not None:
+            get_media_pipeline().submit(post.id, upload_id)
+            return {
+                'success': True,
+                'message': 'Successfully added Post, its media is being processed',
+                'data': result
+            }, 202
+
+        return {
+            'success': True,
+            'message': 'Successfully added Post',
+            'data': result
+        }, 201
@@ -1,22 +1,102 @@
-from flask import request
+from flask import request, url_for
 from flask_restful import Resource
-from ... import db
-from ...models import Profile, ProfileSchema
+from marshmallow import ValidationError
+from ...cache import get_cache
+from ...conditional import (
+    dumped_versions, entity_row, is_conditional, not_modified, not_modified_response, page_rows, validators, versions
+)
+from ...models import DeletionJobSchema, Profile, ProfileSchema
+from ...pagination import InvalidCursor, page_args, paginate
+from ...serializers import dump
+from ...sparse import InvalidFields, columns_option, project, sparse_args, sparse_schema
+from ...streaming import stream_ndjson, wants_ndjson
 
 profiles_schema = ProfileSchema(many=True) 
 profile_schema = ProfileSchema()
+deletion_job_schema = DeletionJobSchema()
 
 class ProfileResource(Resource):
     '''
     Defining API endpoints for the profile
     '''
-    def get(self):
-        profiles = Profile.query.all()
-        profiles = profiles_schema.dump(profiles)
+    def get(self, profile_id=None):
+        try:
+            fields, _ = sparse_args(ProfileSchema)
+        except InvalidFields as e:
+            return {
+                'success': False,
+                'message': str(e)
+            }, 400
+
+        if profile_id is not None:
+            return self.get_one(profile_id, fields)
+
+        schema = sparse_schema(ProfileSchema, fields, many=True)
+        query = Profile.visible()
+
+        if wants_ndjson():
+            if fields:
+                query = query.options(columns_option(Profile, fields, 'join_date'))
+            return stream_ndjson(query.order_by(Profile.id), schema)
+
+        try:
+            limit, after = page_args()
+        except InvalidCursor:
+            return {
+                'success': False,
+                'message': 'Invalid cursor'
+            }, 400
+
+        params = {'limit': limit, 'after': request.args.get('after'), 'fields': fields}
+        # Revalidation only reads the ids and versions of the page
+        if is_conditional():
+            headers = validators('profile', params, versions(page_rows(query, Profile, Profile.join_date, limit, after)))
+            if not_modified(headers):
+                return not_modified_response(headers)
+
+        if fields:
+            query = query.options(columns_option(Profile, fields, 'join_date', 'updated_at'))
+
+        def load_page():
+            profiles, next_cursor = paginate(query, Profile.join_date, Profile.id, limit, after)
+            return {
+                'data': dump(schema, profiles),
+                'next_cursor': next_cursor,
+                'headers': validators('profile', params, versions(profiles))
+            }
+
+        page = get_cache().page('profile', params, load_page)
         return {
             'success': True,
-            'data': profiles
-        }, 200
+            'data': page['data'],
+            'next_cursor': page['next_cursor']
+        }, 200, page['headers']
+
+    def get_one(self, profile_id, fields=None):
+        params = {'fields': fields}
+        if is_conditional():
+            row = entity_row(Profile, profile_id)
+            if row is not None:
+                headers = validators('profile', params, versions([row]))
+                if not_modified(headers):
+                    return not_modified_response(headers)
+
+        def load_profile():
+            profile = Profile.visible().filter_by(id=profile_id).first()
+            return dump(profile_schema, profile) if profile else None
+
+        # The whole profile is cached once and narrowed for each request
+        profile = get_cache().entity('profile', profile_id, load_profile)
+        if profile is None:
+            return {
+                'success': False,
+                'message': 'Profile does not exist in the database'
+            }, 404
+
+        return {
+            'success': True,
+            'data': project(profile, fields)
+        }, 200, validators('profile', params, dumped_versions(profile_id, profile))
     
     def post(self):
         json_data = request.get_json(force=True)
@@ -30,12 +110,12 @@ class ProfileResource(Resource):
         # Validate and deserialize data
         try:
             data = profile_schema.load(json_data)
-        except Exception as e:
+        except ValidationError as e:
             return {
                 'success': False,
                 'message': 'Unable to process data',
-                'error': e
-            }, 422
+                'error': e.messages
+            }, 400
 
         profile = Profile(**data)
         profile.save_profile()
@@ -43,7 +123,7 @@ class ProfileResource(Resource):
         result = profile_schema.dump(profile)
         return {
             'success': True,
-            'message': Successfully added Profile,
+            'message': 'Successfully added Profile',
             'data': result
         }, 201
 
@@ -55,34 +135,36 @@ class ProfileResource(Resource):
                 'message': 'No Input data provided'
             }, 400
 
+        # The id picks the profile, the rest of the json data updates it
+        json_data = dict(json_data)
+        profile_id = json_data.pop('id', None)
+        if profile_id is None:
+            return {
+                'success': False,
+                'message': 'No profile id provided'
+            }, 400
+
         # Validate and deserialze the json data
         try:
             data = profile_schema.load(json_data)
-        except Exception as e:
+        except ValidationError as e:
             return {
                 'success': False,
                 'message': 'Unable to process data',
-                'error' e
-            }, 422
+                'error': e.messages
+            }, 400
 
         # Search for the specific profile in db
-        profile = Profile.query.filter_by(id = data['id']).first()
+        profile = Profile.visible().filter_by(id=profile_id).first()
         if not profile:
             return {
                 'success': False,
                 'message': 'Profile does not exist in the database'
-            }, 400
-        
-        profile.username = profile['username']
-        profile.country = profile['country']
-        profile.facebook = profile['facebook']
-        profile.twitter = profile['twitter']
-        profile.google = profile['google']
-        profile.is_active = profile['is_active']
-        profile.is_verified = profile['is_verified']
-        profile.remember_token = profile['remember_token']
+            }, 404
 
-        db.session.commit()
+        for field, value in data.items():
+            setattr(profile, field, value)
+        profile.save_profile()
 
         result = profile_schema.dump(profile)
         
@@ -93,30 +175,28 @@ class ProfileResource(Resource):
         }, 200
 
 
-    def delete(self):
-        json_data = request.get_json(force=True)
-        if not json_data:
-            return {
-                'success': False,
-                'message': 'No input data provided'
-            }, 400
+    def delete(self, profile_id=None):
+        if profile_id is None:
+            json_data = request.get_json(force=True, silent=True)
+            if not json_data or 'id' not in json_data:
+                return {
+                    'success': False,
+                    'message': 'No input data provided'
+                }, 400
+            profile_id = json_data['id']
 
-        try:
-            data = profile_schema.load(json_data)
-        except Exception as e:
+        profile = Profile.visible().filter_by(id=profile_id).first()
+        if not profile:
             return {
                 'success': False,
-                'message': 'Unable to process data',
-                'error': e
-            }, 422
+                'message': 'Profile does not exist in the database'
+            }, 404
 
-        profile = Profile.query.filter_by(id = data['id']).delete()
-        db.session.commit()
-
-        result = profile_schema.dump(profile)
+        # The profile is hidden at once and its rows removed in the background
+        job = profile.delete_profile()
 
         return {
             'success': True,
-            'message': 'Successfully deleted profile',
-            'data': result
-        }, 200
\ No newline at end of file
+            'message': 'Profile is being deleted',
+            'data': deletion_job_schema.dump(job)
+        }, 202, {'Location': url_for('api.deletionresource', job_id=job.id)}
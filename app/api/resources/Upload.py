@@ -0,0 +1,103 @@
+from flask import request
+from flask_restful import Resource
+from werkzeug.http import parse_content_range_header
+from ...media import InvalidUpload, get_media_pipeline
+
+class UploadResource(Resource):
+    '''
+    Defining API endpoints for chunked, resumable media uploads
+
+    An upload is created with its size, then sent in one or more PUT requests
+    carrying a "Content-Range: bytes <start>-<end>/<size>" header. GET tells
+    how many bytes were received, so an interrupted upload carries on from
+    there. A complete upload is attached to a post by its id.
+    '''
+    def get(self, upload_id):
+        try:
+            upload = get_media_pipeline().spool.describe(upload_id)
+        except InvalidUpload as e:
+            return {
+                'success': False,
+                'message': str(e)
+            }, 404
+
+        return {
+            'success': True,
+            'data': upload
+        }, 200
+
+    def post(self):
+        json_data = request.get_json(force=True)
+        if not json_data or not isinstance(json_data.get('size'), int):
+            return {
+                'success': False,
+                'message': 'No upload size provided'
+            }, 400
+
+        spool = get_media_pipeline().spool
+        try:
+            upload_id = spool.create(json_data['size'], json_data.get('content_type'), json_data.get('filename'))
+        except InvalidUpload as e:
+            return {
+                'success': False,
+                'message': str(e)
+            }, 413
+
+        return {
+            'success': True,
+            'message': 'Upload created',
+            'data': spool.describe(upload_id)
+        }, 201
+
+    def put(self, upload_id):
+        length = request.content_length
+        if not length:
+            return {
+                'success': False,
+                'message': 'No data provided'
+            }, 400
+
+        spool = get_media_pipeline().spool
+        try:
+            upload = spool.describe(upload_id)
+        except InvalidUpload as e:
+            return {
+                'success': False,
+                'message': str(e)
+            }, 404
+
+        start = 0
+        header = request.headers.get('Content-Range')
+        if header:
+            content_range = parse_content_range_header(header)
+            if content_range is None or content_range.stop - content_range.start != length:
+                return {
+                    'success': False,
+                    'message': 'Invalid Content-Range header'
+                }, 400
+            # The total, when given, must be the size the upload was created with
+            if content_range.length is not None and content_range.length != upload['size']:
+                return {
+                    'success': False,
+                    'message': 'Content-Range total does not match the upload size of {} bytes'.format(upload['size'])
+                }, 400
+            start = content_range.start
+
+        try:
+            spool.write(upload_id, request.stream, start, length)
+        except InvalidUpload as e:
+            if e.offset is None:
+                return {
+                    'success': False,
+                    'message': str(e)
+                }, 404
+            return {
+                'success': False,
+                'message': str(e),
+                'data': {'offset': e.offset}
+            }, 409
+
+        return {
+            'success': True,
+            'data': spool.describe(upload_id)
+        }, 200
@@ -0,0 +1,36 @@
+from flask import current_app, request
+from flask_restful import Resource
+from ....autocomplete import complete, indexes
+
+class AutocompleteResource(Resource):
+    '''
+    Defining API endpoints for completing usernames, tags and locations as they are typed
+
+    ?q= is the text typed so far, ?types= a comma separated subset of
+    profiles, tags and locations, all by default. Each type lists its most
+    popular matches: profiles by followers, tags and locations by posts.
+    '''
+    def get(self):
+        prefix = request.args.get('q', '')
+        if not prefix.strip():
+            return {
+                'success': False,
+                'message': 'No search text provided'
+            }, 400
+
+        types = request.args.get('types')
+        names = [name.strip() for name in types.split(',') if name.strip()] if types else list(indexes)
+        unknown = [name for name in names if name not in indexes]
+        if unknown:
+            return {
+                'success': False,
+                'message': 'Unknown types {}'.format(', '.join(unknown))
+            }, 400
+
+        config = current_app.config
+        limit = request.args.get('limit', config['AUTOCOMPLETE_LIMIT'], type=int)
+        limit = max(1, min(limit, config['AUTOCOMPLETE_MAX_LIMIT']))
+        return {
+            'success': True,
+            'data': complete(names, prefix, limit)
+        }, 200
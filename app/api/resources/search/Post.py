@@ -0,0 +1,36 @@
+from flask import request
+from flask_restful import Resource
+from ....models import Post, PostSchema
+from ....pagination import InvalidCursor, decode_offset_cursor, encode_offset_cursor, page_args
+from ....search import search
+from ....serializers import dump
+
+posts_schema = PostSchema(many=True)
+
+class PostSearchResource(Resource):
+    '''
+    Defining API endpoints for searching posts by name, location, category and tags
+    '''
+    def get(self):
+        search_text = request.args.get('q', '').strip()
+        if not search_text:
+            return {
+                'success': False,
+                'message': 'No search text provided'
+            }, 400
+
+        try:
+            limit, offset = page_args(decode_offset_cursor)
+        except InvalidCursor:
+            return {
+                'success': False,
+                'message': 'Invalid cursor'
+            }, 400
+
+        offset = offset or 0
+        posts = search(Post, 'posts', search_text, limit + 1, offset)
+        return {
+            'success': True,
+            'data': dump(posts_schema, posts[:limit]),
+            'next_cursor': encode_offset_cursor(offset + limit) if len(posts) > limit else None
+        }, 200
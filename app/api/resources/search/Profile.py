@@ -0,0 +1,35 @@
+from flask import request
+from flask_restful import Resource
+from ....models import Profile, ProfileSchema
+from ....pagination import InvalidCursor, decode_offset_cursor, encode_offset_cursor, page_args
+from ....serializers import dump
+
+profiles_schema = ProfileSchema(many=True)
+
+class ProfileSearchResource(Resource):
+    '''
+    Defining API endpoints for searching profiles
+    '''
+    def get(self):
+        search_text = request.args.get('q', '').strip()
+        if not search_text:
+            return {
+                'success': False,
+                'message': 'No search text provided'
+            }, 400
+
+        try:
+            limit, offset = page_args(decode_offset_cursor)
+        except InvalidCursor:
+            return {
+                'success': False,
+                'message': 'Invalid cursor'
+            }, 400
+
+        offset = offset or 0
+        profiles = Profile.search_profile_name(search_text, limit + 1, offset)
+        return {
+            'success': True,
+            'data': dump(profiles_schema, profiles[:limit]),
+            'next_cursor': encode_offset_cursor(offset + limit) if len(profiles) > limit else None
+        }, 200
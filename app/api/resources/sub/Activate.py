@@ -0,0 +1,11 @@
+from .Moderation import ModerationResource
+
+class ActivateResource(ModerationResource):
+    '''
+    Defining API endpoints for activating and deactivating profiles in bulk
+    '''
+    def post(self):
+        return self._change('activate', 'Successfully activated profiles')
+
+    def delete(self):
+        return self._change('deactivate', 'Successfully deactivated profiles')
@@ -0,0 +1,108 @@
+from flask import current_app, request
+from flask_restful import Resource
+from .... import db
+from ....graph import get_follower_graph
+from ....models import Profile
+
+def _profile_or_404(profile_id):
+    profile = Profile.visible().filter_by(id=profile_id).first()
+    if not profile:
+        return None, ({
+            'success': False,
+            'message': 'Profile does not exist in the database'
+        }, 404)
+    return profile, None
+
+class FollowResource(Resource):
+    '''
+    Defining API endpoints for following profiles and follow state
+    '''
+    def get(self, profile_id):
+        _, error = _profile_or_404(profile_id)
+        if error:
+            return error
+
+        graph = get_follower_graph()
+        data = {
+            'follower_count': graph.follower_count(profile_id),
+            'following_count': graph.following_count(profile_id)
+        }
+
+        ids = request.args.get('ids')
+        if ids:
+            try:
+                ids = [int(id) for id in ids.split(',')]
+            except ValueError:
+                return {
+                    'success': False,
+                    'message': 'ids must be a comma separated list of profile ids'
+                }, 400
+            following = graph.is_following(profile_id, ids)
+            data['is_following'] = {str(id): state for id, state in following.items()}
+
+        return {
+            'success': True,
+            'data': data
+        }, 200
+
+    def post(self, profile_id):
+        return self._change(profile_id, Profile.follow, 'Successfully followed profile')
+
+    def delete(self, profile_id):
+        return self._change(profile_id, Profile.unfollow, 'Successfully unfollowed profile')
+
+    def _change(self, profile_id, action, message):
+        json_data = request.get_json(force=True)
+        if not json_data or 'followed_id' not in json_data:
+            return {
+                'success': False,
+                'message': 'No followed_id provided'
+            }, 400
+
+        profile, error = _profile_or_404(profile_id)
+        if error:
+            return error
+        followed, error = _profile_or_404(json_data['followed_id'])
+        if error:
+            return error
+
+        action(profile, followed)
+        db.session.commit()
+
+        return {
+            'success': True,
+            'message': message
+        }, 200
+
+class MutualFollowResource(Resource):
+    '''
+    Defining API endpoints for a profile's mutual follows
+    '''
+    def get(self, profile_id):
+        _, error = _profile_or_404(profile_id)
+        if error:
+            return error
+
+        return {
+            'success': True,
+            'data': get_follower_graph().mutual(profile_id)
+        }, 200
+
+class FollowSuggestionResource(Resource):
+    '''
+    Defining API endpoints for "who to follow" suggestions
+    '''
+    def get(self, profile_id):
+        _, error = _profile_or_404(profile_id)
+        if error:
+            return error
+
+        limit = request.args.get('limit', current_app.config['PAGE_SIZE'], type=int)
+        limit = max(1, min(limit, current_app.config['MAX_PAGE_SIZE']))
+        suggestions = get_follower_graph().suggestions(profile_id, limit)
+        return {
+            'success': True,
+            'data': [
+                {'profile_id': id, 'mutual_count': count} for id, count in suggestions
+            ]
+        }, 200
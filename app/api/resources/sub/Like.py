@@ -0,0 +1,37 @@
+from flask import current_app, request
+from flask_restful import Resource
+from ....likes import InvalidLikeOperation, apply_likes
+
+class LikeResource(Resource):
+    '''
+    Defining API endpoints for bulk liking and unliking of posts
+    '''
+    def post(self):
+        json_data = request.get_json(force=True)
+        operations = json_data.get('operations') if isinstance(json_data, dict) else None
+        if not operations or not isinstance(operations, list):
+            return {
+                'success': False,
+                'message': 'No operations provided'
+            }, 400
+
+        if len(operations) > current_app.config['MAX_BULK_LIKES']:
+            return {
+                'success': False,
+                'message': 'At most {} operations per request'.format(current_app.config['MAX_BULK_LIKES'])
+            }, 413
+
+        try:
+            result = apply_likes(operations)
+        except InvalidLikeOperation as e:
+            return {
+                'success': False,
+                'message': 'Unable to process data',
+                'error': str(e)
+            }, 422
+
+        return {
+            'success': True,
+            'message': 'Successfully applied likes',
+            'data': result
+        }, 200
@@ -0,0 +1,25 @@
+from flask_restful import Resource
+from ....models import MediaVariantSchema, Post
+
+variants_schema = MediaVariantSchema(many=True)
+
+class MediaResource(Resource):
+    '''
+    Defining API endpoints for the processing state and variants of a post's media
+    '''
+    def get(self, post_id):
+        post = Post.visible().filter_by(id=post_id).first()
+        if post is None:
+            return {
+                'success': False,
+                'message': 'Post does not exist in the database'
+            }, 404
+
+        return {
+            'success': True,
+            'data': {
+                'media': post.media,
+                'media_status': post.media_status,
+                'variants': variants_schema.dump(post.variants.order_by('name'))
+            }
+        }, 200
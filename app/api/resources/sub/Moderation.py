@@ -0,0 +1,26 @@
+from flask import request
+from flask_restful import Resource
+from ....moderation import InvalidModeration, moderate, selection
+
+class ModerationResource(Resource):
+    '''
+    Base of the API endpoints setting a moderation flag on profiles in bulk
+
+    The body selects profiles with "ids", "usernames" and/or a "filter" on
+    country, joined_after, joined_before, is_active and is_verified.
+    '''
+    def _change(self, action, message):
+        try:
+            criteria = selection(request.get_json(force=True))
+        except InvalidModeration as e:
+            return {
+                'success': False,
+                'message': 'Unable to process data',
+                'error': str(e)
+            }, 422
+
+        return {
+            'success': True,
+            'message': message,
+            'data': moderate(action, criteria)
+        }, 200
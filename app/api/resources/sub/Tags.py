@@ -0,0 +1,97 @@
+from flask import current_app, request
+from flask_restful import Resource
+from ....models import Post, PostSchema, PostTag, PostTagSchema, tags
+from ....pagination import InvalidCursor, page_args, paginate
+from ....serializers import dump
+from ....tags import attach_tags, detach_tags, normalize_tag
+
+tags_schema = PostTagSchema(many=True)
+posts_schema = PostSchema(many=True)
+
+class TagResource(Resource):
+    '''
+    Defining API endpoints for popular tags and batch tagging of posts
+    '''
+    def get(self):
+        limit = request.args.get('limit', current_app.config['PAGE_SIZE'], type=int)
+        limit = max(1, min(limit, current_app.config['MAX_PAGE_SIZE']))
+        popular = PostTag.query.filter(PostTag.post_count > 0).order_by(
+            PostTag.post_count.desc(), PostTag.id
+        ).limit(limit).all()
+        return {
+            'success': True,
+            'data': dump(tags_schema, popular)
+        }, 200
+
+    def post(self):
+        return self._change(attach_tags, 'Successfully tagged posts')
+
+    def delete(self):
+        return self._change(detach_tags, 'Successfully untagged posts')
+
+    def _change(self, action, message):
+        json_data = request.get_json(force=True)
+        post_ids = json_data.get('post_ids') if isinstance(json_data, dict) else None
+        tag_texts = json_data.get('tags') if isinstance(json_data, dict) else None
+        if not post_ids or not tag_texts:
+            return {
+                'success': False,
+                'message': 'Provide post_ids and tags'
+            }, 400
+
+        try:
+            if not isinstance(post_ids, list):
+                raise TypeError
+            post_ids = {int(id) for id in post_ids}
+        except (TypeError, ValueError):
+            return {
+                'success': False,
+                'message': 'post_ids must be a list of post ids'
+            }, 422
+
+        if not isinstance(tag_texts, list) or not all(isinstance(text, str) for text in tag_texts):
+            return {
+                'success': False,
+                'message': 'tags must be a list of tag strings'
+            }, 422
+
+        known = {id for id, in Post.visible().with_entities(Post.id).filter(Post.id.in_(post_ids))}
+        if post_ids - known:
+            return {
+                'success': False,
+                'message': 'Unknown post ids {}'.format(sorted(post_ids - known))
+            }, 422
+
+        action(post_ids, tag_texts)
+        return {
+            'success': True,
+            'message': message
+        }, 200
+
+class TaggedPostsResource(Resource):
+    '''
+    Defining API endpoints for the posts carrying a tag
+    '''
+    def get(self, tag_text):
+        tag = PostTag.query.filter_by(tag_text=normalize_tag(tag_text)).first()
+        if not tag:
+            return {
+                'success': False,
+                'message': 'Tag does not exist in the database'
+            }, 404
+
+        try:
+            limit, after = page_args()
+        except InvalidCursor:
+            return {
+                'success': False,
+                'message': 'Invalid cursor'
+            }, 400
+
+        query = Post.visible().join(tags, tags.c.post_id == Post.id).filter(tags.c.tag_id == tag.id)
+        posts, next_cursor = paginate(query, Post.timestamp, Post.id, limit, after)
+        return {
+            'success': True,
+            'data': dump(posts_schema, posts),
+            'next_cursor': next_cursor
+        }, 200
@@ -0,0 +1,34 @@
+from flask_restful import Resource
+from ....comments import embed_comments, preview_size
+from ....models import Profile, PostSchema
+from ....pagination import InvalidCursor, page_args
+from ....serializers import dump
+
+posts_schema = PostSchema(many=True)
+
+class TimelineResource(Resource):
+    '''
+    Defining API endpoints for a profile's home timeline
+    '''
+    def get(self, profile_id):
+        profile = Profile.visible().filter_by(id=profile_id).first()
+        if not profile:
+            return {
+                'success': False,
+                'message': 'Profile does not exist in the database'
+            }, 404
+
+        try:
+            limit, after = page_args()
+        except InvalidCursor:
+            return {
+                'success': False,
+                'message': 'Invalid cursor'
+            }, 400
+
+        posts, next_cursor = profile.timeline(limit, after)
+        return {
+            'success': True,
+            'data': embed_comments(posts, dump(posts_schema, posts), preview_size()),
+            'next_cursor': next_cursor
+        }, 200
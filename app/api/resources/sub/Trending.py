@@ -0,0 +1,49 @@
+from flask import request
+from flask_restful import Resource
+from ....models import Post, PostSchema
+from ....pagination import InvalidCursor, decode_offset_cursor, encode_offset_cursor, page_args
+from ....serializers import dump
+from ....trending import DIMENSIONS, get_trending
+
+posts_schema = PostSchema(many=True)
+
+class TrendingResource(Resource):
+    '''
+    Defining API endpoints for the trending posts, overall or of one category or media type
+    '''
+    def get(self):
+        dimension = choice = None
+        for name, choices in DIMENSIONS:
+            value = request.args.get(name)
+            if value is None:
+                continue
+            if dimension is not None or value not in choices:
+                return {
+                    'success': False,
+                    'message': 'Filter by one of category {} or media {}'.format(*[list(choices) for _, choices in DIMENSIONS])
+                }, 400
+            dimension, choice = name, value
+
+        try:
+            limit, offset = page_args(decode_offset_cursor)
+        except InvalidCursor:
+            return {
+                'success': False,
+                'message': 'Invalid cursor'
+            }, 400
+
+        offset = offset or 0
+        ranked = get_trending().top(dimension, choice, offset, limit + 1)
+        scores = dict(ranked[:limit])
+        # Posts deleted since the last refresh are left out
+        found = {post.id: post for post in Post.visible().filter(Post.id.in_(scores))} if scores else {}
+        posts = [found[post_id] for post_id in scores if post_id in found]
+        data = dump(posts_schema, posts)
+        for post, item in zip(posts, data):
+            item['trending_score'] = round(scores[post.id], 4)
+
+        return {
+            'success': True,
+            'data': data,
+            'next_cursor': encode_offset_cursor(offset + limit) if len(ranked) > limit else None
+        }, 200
@@ -0,0 +1,11 @@
+from .Moderation import ModerationResource
+
+class VerifyResource(ModerationResource):
+    '''
+    Defining API endpoints for verifying and unverifying profiles in bulk
+    '''
+    def post(self):
+        return self._change('verify', 'Successfully verified profiles')
+
+    def delete(self):
+        return self._change('deverify', 'Successfully unverified profiles')
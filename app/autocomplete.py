@@ -0,0 +1,314 @@
+import heapq
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+from flask import current_app
+from . import db
+from .refresh import Refresher
+from .search import tokenize
+
+# Prefixes matching at most this many keys are ranked by scanning them,
+# larger ones keep their best entries memoized
+SCAN_LIMIT = 1000
+
+
+def normalize(text):
+    '''
+    Function to bring text to the form prefixes are matched on: "Lamu-Town" -> "lamu town"
+    '''
+    return ' '.join(tokenize(text))
+
+
+def _successor(prefix):
+    # Smallest string sorting after every string starting with prefix
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class PrefixIndex:
+    '''
+    In-process index answering prefix lookups with the most popular matches
+
+    Entries are (ident, text, score) and kept in a sorted array of their
+    normalized text, so the keys starting with a prefix are one contiguous
+    range found by binary search. Ranges of up to SCAN_LIMIT keys are ranked
+    by scanning them; for every larger prefix the best keep entries are
+    memoized, built from the best entries of its one character longer
+    prefixes. Updates keep those memoized lists exact, and a list that
+    shrinks too far is rebuilt when next read.
+    '''
+    def __init__(self, entries, keep, drop_empty=False):
+        self.keep = keep
+        self.drop_empty = drop_empty
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._by_ident = {}
+        for ident, text, score in entries:
+            sort_key = self._sort_key(ident, text)
+            self._entries[sort_key] = (ident, text, score)
+            self._by_ident[ident] = sort_key
+        self._keys = sorted(self._entries)
+        self._best = {}
+        self._memoize('', 0, len(self._keys))
+
+    @staticmethod
+    def _sort_key(ident, text):
+        # The ident keeps keys unique, \x00 sorts it before any longer text
+        return '{}\x00{}'.format(normalize(text), ident)
+
+    def _rank(self, sort_key):
+        return (-self._entries[sort_key][2], sort_key)
+
+    def _scan(self, lo, hi, count):
+        return heapq.nsmallest(count, map(self._rank, self._keys[lo:hi]))
+
+    def _memoize(self, prefix, lo, hi):
+        if hi - lo <= SCAN_LIMIT:
+            return self._scan(lo, hi, self.keep)
+        best = self._best.get(prefix)
+        if best is not None and len(best) >= self.keep:
+            return best
+
+        depth = len(prefix)
+        ranked = []
+        i = lo
+        while i < hi:
+            key = self._keys[i]
+            if len(key) == depth:
+                ranked.append(self._rank(key))
+                i += 1
+                continue
+            child = key[:depth + 1]
+            j = bisect_left(self._keys, _successor(child), i, hi)
+            ranked.extend(self._memoize(child, i, j))
+            i = j
+        best = self._best[prefix] = heapq.nsmallest(self.keep, ranked)
+        return best
+
+    def _place(self, sort_key, old, new):
+        # Each memoized list stays the exact best of its prefix: an entry is
+        # only added when it beats the last one listed, as the entries
+        # ranked after that are not known
+        for end in range(len(sort_key) + 1):
+            best = self._best.get(sort_key[:end])
+            if best is None:
+                continue
+            if old is not None:
+                position = bisect_left(best, (-old, sort_key))
+                if position < len(best) and best[position][1] == sort_key:
+                    del best[position]
+            if new is not None and best and (-new, sort_key) < best[-1]:
+                insort(best, (-new, sort_key))
+                if len(best) > self.keep:
+                    best.pop()
+
+    def set(self, ident, text, score):
+        with self._lock:
+            self._remove(ident)
+            if self.drop_empty and score <= 0:
+                return
+            sort_key = self._sort_key(ident, text)
+            self._entries[sort_key] = (ident, text, score)
+            self._by_ident[ident] = sort_key
+            insort(self._keys, sort_key)
+            self._place(sort_key, None, score)
+
+    def adjust(self, ident, delta, text=None):
+        '''
+        Adds delta to the score of an entry, creating it when text is given
+        '''
+        with self._lock:
+            sort_key = self._by_ident.get(ident)
+            if sort_key is None:
+                if text is None or delta <= 0:
+                    return
+                sort_key = self._sort_key(ident, text)
+                self._entries[sort_key] = (ident, text, delta)
+                self._by_ident[ident] = sort_key
+                insort(self._keys, sort_key)
+                self._place(sort_key, None, delta)
+                return
+
+            ident, text, old = self._entries[sort_key]
+            if self.drop_empty and old + delta <= 0:
+                self._remove(ident)
+                return
+            self._entries[sort_key] = (ident, text, old + delta)
+            self._place(sort_key, old, old + delta)
+
+    def remove(self, ident):
+        with self._lock:
+            self._remove(ident)
+
+    def _remove(self, ident):
+        sort_key = self._by_ident.pop(ident, None)
+        if sort_key is None:
+            return
+        _, _, score = self._entries.pop(sort_key)
+        del self._keys[bisect_left(self._keys, sort_key)]
+        self._place(sort_key, score, None)
+
+    def complete(self, prefix, limit):
+        '''
+        Returns the (ident, text, score) of the best entries whose text starts with prefix
+        '''
+        key = normalize(prefix)
+        if not key:
+            return []
+        limit = min(limit, self.keep)
+        with self._lock:
+            lo = bisect_left(self._keys, key)
+            hi = bisect_left(self._keys, _successor(key), lo)
+            if hi - lo <= SCAN_LIMIT:
+                best = self._scan(lo, hi, limit)
+            else:
+                best = self._best.get(key)
+                if best is None or len(best) < limit:
+                    best = self._memoize(key, lo, hi)
+            return [self._entries[sort_key] for _, sort_key in best[:limit]]
+
+
+def _build_profiles():
+    from .models import Profile
+    return Profile.visible().filter_by(is_active=True).with_entities(
+        Profile.id, Profile.username, Profile.follower_count
+    ).yield_per(10000)
+
+
+def _build_tags():
+    from .models import PostTag
+    return PostTag.query.with_entities(PostTag.id, PostTag.tag_text, PostTag.post_count).filter(
+        PostTag.post_count > 0
+    ).yield_per(10000)
+
+
+def _build_locations():
+    # Spellings of a location are counted together under the most used one
+    from .models import Post
+    counts = Counter()
+    spellings = {}
+    rows = Post.visible().with_entities(Post.post_location, db.func.count()).filter(
+        Post.post_location.isnot(None)
+    ).group_by(Post.post_location)
+    for location, count in rows:
+        key = normalize(location)
+        if key:
+            counts[key] += count
+            if count > spellings.get(key, (None, 0))[1]:
+                spellings[key] = (location, count)
+    return [(key, spellings[key][0], count) for key, count in counts.items()]
+
+
+# Name of each index, how to build it, the names its (ident, text, score)
+# are returned under and whether entries scoring 0 are dropped
+indexes = {
+    'profiles': (_build_profiles, ('id', 'username', 'follower_count'), False),
+    'tags': (_build_tags, ('id', 'tag_text', 'post_count'), True),
+    'locations': (_build_locations, (None, 'post_location', 'post_count'), True)
+}
+
+
+def get_autocomplete(name):
+    '''
+    Function to get one of the application's prefix indexes, building it when needed
+
+    Indexes are rebuilt from the database in the background every
+    AUTOCOMPLETE_REFRESH seconds so changes made through other worker
+    processes or in bulk show up too. Counts adjusted during a rebuild may be
+    off by those adjustments until the next one.
+    '''
+    state = current_app.extensions.setdefault('autocomplete', {})
+    refresher = state.get(name)
+    if refresher is None:
+        build, _, drop_empty = indexes[name]
+        keep = current_app.config['AUTOCOMPLETE_MAX_LIMIT']
+        refresher = state.setdefault(name, Refresher(
+            current_app._get_current_object(), lambda: PrefixIndex(build(), keep, drop_empty),
+            current_app.config['AUTOCOMPLETE_REFRESH'], 'autocomplete-' + name
+        ))
+    return refresher.get()
+
+
+def _loaded_index(name):
+    return current_app.extensions.get('autocomplete', {}).get(name)
+
+
+def complete(names, prefix, limit):
+    '''
+    Function to look up the best completions of a prefix in each named index
+    '''
+    results = {}
+    for name in names:
+        _, fields, _ = indexes[name]
+        results[name] = [
+            {field: value for field, value in zip(fields, entry) if field is not None}
+            for entry in get_autocomplete(name).complete(prefix, limit)
+        ]
+    return results
+
+
+def autocomplete_profile(profile):
+    refresher = _loaded_index('profiles')
+    if refresher is not None:
+        id, username, follower_count = profile.id, profile.username, profile.follower_count
+        if profile.is_active and not profile.pending_deletion:
+            refresher.apply(lambda index: index.set(id, username, follower_count))
+        else:
+            refresher.apply(lambda index: index.remove(id))
+
+
+def autocomplete_profiles(profile_ids):
+    '''
+    Function to bring many profiles up to date in the profiles index at once
+    '''
+    from .models import Profile
+    refresher = _loaded_index('profiles')
+    if refresher is not None and profile_ids:
+        rows = Profile.query.with_entities(
+            Profile.id, Profile.username, Profile.follower_count, Profile.is_active, Profile.pending_deletion
+        ).filter(
+            Profile.id.in_(list(profile_ids))
+        )
+        for profile in rows:
+            autocomplete_profile(profile)
+
+
+def autocomplete_tags(tag_ids):
+    '''
+    Function to bring the post counts of tags up to date in the tags index
+    '''
+    from .models import PostTag
+    refresher = _loaded_index('tags')
+    if refresher is not None and tag_ids:
+        rows = PostTag.query.with_entities(PostTag.id, PostTag.tag_text, PostTag.post_count).filter(
+            PostTag.id.in_(list(tag_ids))
+        ).all()
+
+        def update(index):
+            for tag_id, tag_text, post_count in rows:
+                index.set(tag_id, tag_text, post_count)
+        refresher.apply(update)
+
+
+def count_followers(profile_id, delta):
+    refresher = _loaded_index('profiles')
+    if refresher is not None:
+        refresher.apply(lambda index: index.adjust(profile_id, delta))
+
+
+def count_tag(tag_id, delta):
+    refresher = _loaded_index('tags')
+    if refresher is not None:
+        refresher.apply(lambda index: index.adjust(tag_id, delta))
+
+
+def count_location(location, delta):
+    refresher = _loaded_index('locations')
+    key = normalize(location) if location else None
+    if refresher is not None and key:
+        refresher.apply(lambda index: index.adjust(key, delta, location))
+
+
+def forget(name, ident):
+    refresher = _loaded_index(name)
+    if refresher is not None:
+        refresher.apply(lambda index: index.remove(ident))
@@ -0,0 +1,156 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, request
+from werkzeug.exceptions import HTTPException, NotFound
+from . import db
+from .database import use_primary
+
+# Methods of sub-requests, only GETs are deduplicated and run in parallel
+METHODS = ('GET', 'POST', 'PUT', 'DELETE')
+
+# Response headers left out of sub-request results
+_SKIPPED_HEADERS = ('Content-Length', 'Content-Type', 'Vary')
+
+# Request headers of sub-requests ignored, results are always plain JSON
+_NEGOTIATED_HEADERS = ('accept', 'accept-encoding')
+
+
+class InvalidBatch(ValueError):
+    '''
+    Raised when the body of a batch request is malformed
+    '''
+    pass
+
+
+def parse_batch(data, max_requests):
+    '''
+    Function to validate a batch body into a list of sub-requests
+
+    Each one is {"method", "path", "body", "headers"}, only path is required
+    and it is the full path, such as /api/v1/posts/1?include=author.
+    '''
+    requests = data.get('requests') if isinstance(data, dict) else None
+    if not isinstance(requests, list) or not requests:
+        raise InvalidBatch('Provide a list of requests')
+    if len(requests) > max_requests:
+        raise InvalidBatch('At most {} requests can be batched'.format(max_requests))
+
+    parsed = []
+    for index, sub in enumerate(requests):
+        if not isinstance(sub, dict) or not isinstance(sub.get('path'), str) or not sub['path'].startswith('/'):
+            raise InvalidBatch('Request {} needs an absolute path'.format(index))
+        method = str(sub.get('method', 'GET')).upper()
+        if method not in METHODS:
+            raise InvalidBatch('Request {} has an unsupported method {}'.format(index, method))
+        headers = sub.get('headers') or {}
+        if not isinstance(headers, dict):
+            raise InvalidBatch('Request {} headers must be an object'.format(index))
+        parsed.append({
+            'method': method,
+            'path': sub['path'],
+            'body': sub.get('body'),
+            'headers': {str(key): str(value) for key, value in headers.items()}
+        })
+    return parsed
+
+
+def _result(response):
+    if response.status_code == 304:
+        body = None
+    elif response.is_json:
+        body = response.get_json()
+    else:
+        body = response.get_data(as_text=True)
+    return {
+        'status': response.status_code,
+        'headers': {key: value for key, value in response.headers.items() if key not in _SKIPPED_HEADERS},
+        'body': body
+    }
+
+
+def _error(code, message):
+    return {'status': code, 'headers': {}, 'body': {'success': False, 'message': message}}
+
+
+def dispatch(app, sub, exclude):
+    '''
+    Function to run one sub-request through the url map and its resource
+
+    Runs in a request context of its own inside the current app context, so
+    it shares the database session and identity map of the batch.
+    '''
+    # The batch response is encoded and compressed as a whole
+    headers = {key: value for key, value in sub['headers'].items() if key.lower() not in _NEGOTIATED_HEADERS}
+    with app.test_request_context(sub['path'], method=sub['method'], json=sub['body'], headers=headers):
+        try:
+            if request.routing_exception is not None:
+                raise request.routing_exception
+            endpoint = request.url_rule.endpoint
+            if endpoint == exclude or not endpoint.startswith('api.'):
+                raise NotFound()
+            response = app.make_response(app.view_functions[endpoint](**request.view_args))
+            return _result(response)
+        except HTTPException as e:
+            return _error(e.code, e.description)
+        except Exception:
+            app.logger.exception('Batched %s %s failed', sub['method'], sub['path'])
+            db.session.rollback()
+            return _error(500, 'Internal server error')
+
+
+def _dispatch_in_context(app, sub, exclude, primary):
+    # Worker threads get their own app context and so their own session,
+    # which reads from the primary once the batch has written
+    with app.app_context():
+        if primary:
+            use_primary(db.session)
+        return dispatch(app, sub, exclude)
+
+
+def get_batch_executor():
+    executor = current_app.extensions.get('batch_executor')
+    if executor is None and current_app.config['BATCH_WORKERS']:
+        executor = current_app.extensions.setdefault('batch_executor', ThreadPoolExecutor(
+            current_app.config['BATCH_WORKERS'], thread_name_prefix='batch'
+        ))
+    return executor
+
+
+def run_batch(subs, parallel=False):
+    '''
+    Function to run sub-requests in order and collect their results
+
+    Identical GETs between two writes are run once. With parallel, those
+    GETs are run concurrently, each in its own session; writes always run
+    alone in the batch's own session, after every request before them.
+    Once a write has run, every read of the batch goes to the primary
+    database, so it sees what the batch wrote.
+    '''
+    app = current_app._get_current_object()
+    exclude = request.url_rule.endpoint
+    executor = get_batch_executor() if parallel else None
+    results = [None] * len(subs)
+    reads = {}
+
+    def run_reads():
+        unique = list(reads.values())
+        if executor is not None and len(unique) > 1:
+            primary = bool(db.session.info.get('primary'))
+            done = executor.map(lambda indexes: _dispatch_in_context(app, subs[indexes[0]], exclude, primary), unique)
+        else:
+            done = (dispatch(app, subs[indexes[0]], exclude) for indexes in unique)
+        for indexes, result in zip(unique, done):
+            for index in indexes:
+                results[index] = result
+        reads.clear()
+
+    for index, sub in enumerate(subs):
+        if sub['method'] == 'GET':
+            key = json.dumps([sub['path'], sub['headers']], sort_keys=True)
+            reads.setdefault(key, []).append(index)
+            continue
+        run_reads()
+        results[index] = dispatch(app, sub, exclude)
+        use_primary(db.session)
+    run_reads()
+    return results
@@ -0,0 +1,204 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from werkzeug.utils import import_string
+
+MISSING = object()
+
+
+class CacheBackend:
+    '''
+    Interface every cache backend implements
+
+    Values are JSON-serializable structures. A shared backend (Redis,
+    memcached) makes invalidations visible to every worker process at once;
+    the in-process default relies on its TTL for that.
+    '''
+    def get(self, key):
+        '''
+        Returns the cached value, or MISSING
+        '''
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def delete(self, *keys):
+        raise NotImplementedError
+
+    def counter(self, key):
+        '''
+        Returns the value of an integer counter, 0 when it was never incremented
+        '''
+        raise NotImplementedError
+
+    def incr(self, key):
+        '''
+        Atomically increments an integer counter and returns its new value
+        '''
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    '''
+    In-process least recently used cache with per-entry expiry
+    '''
+    def __init__(self, max_entries=10000, **options):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._counts = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counts['misses'] += 1
+                return MISSING
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                self._counts['expirations'] += 1
+                self._counts['misses'] += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self._counts['hits'] += 1
+            return value
+
+    def set(self, key, value, ttl):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counts['evictions'] += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def counter(self, key):
+        return self._counters.get(key, 0)
+
+    def incr(self, key):
+        # Counters live outside the LRU so they are never evicted
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, entries=len(self._entries), max_entries=self.max_entries)
+
+
+class RedisCache(CacheBackend):
+    '''
+    Cache shared by every worker process, kept in Redis
+
+    Needs the redis package, which is not installed by default.
+    '''
+    def __init__(self, url=None, prefix='huc:', **options):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self._counts = {'hits': 0, 'misses': 0}
+
+    def get(self, key):
+        raw = self._client.get(self._prefix + key)
+        if raw is None:
+            self._counts['misses'] += 1
+            return MISSING
+        self._counts['hits'] += 1
+        return json.loads(raw)
+
+    def set(self, key, value, ttl):
+        self._client.set(self._prefix + key, json.dumps(value), ex=ttl or None)
+
+    def delete(self, *keys):
+        if keys:
+            self._client.delete(*[self._prefix + key for key in keys])
+
+    def counter(self, key):
+        return int(self._client.get(self._prefix + key) or 0)
+
+    def incr(self, key):
+        return self._client.incr(self._prefix + key)
+
+    def clear(self):
+        for key in self._client.scan_iter(self._prefix + '*'):
+            self._client.delete(key)
+
+    def stats(self):
+        info = self._client.info('stats')
+        return dict(self._counts, evictions=info.get('evicted_keys', 0), expirations=info.get('expired_keys', 0))
+
+
+class ResponseCache:
+    '''
+    Read-through cache of serialized entities and list pages
+
+    Entities are cached under "<kind>:<id>". List pages are cached under a
+    per-kind generation number that every write to that kind bumps, so all
+    cached pages of the kind are dropped at once.
+    '''
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+
+    def entity(self, kind, id, loader):
+        key = '{}:{}'.format(kind, id)
+        value = self.backend.get(key)
+        if value is MISSING:
+            value = loader()
+            if value is not None:
+                self.backend.set(key, value, self.ttl)
+        return value
+
+    def page(self, kind, params, loader):
+        generation = self.backend.counter('{}:generation'.format(kind))
+        key = '{}:page:{}:{}'.format(kind, generation, json.dumps(params, sort_keys=True))
+        value = self.backend.get(key)
+        if value is MISSING:
+            value = loader()
+            self.backend.set(key, value, self.ttl)
+        return value
+
+    def invalidate(self, kind, *ids):
+        self.backend.delete(*['{}:{}'.format(kind, id) for id in ids])
+        self.backend.incr('{}:generation'.format(kind))
+
+    def stats(self):
+        return self.backend.stats()
+
+
+def get_cache():
+    cache = current_app.extensions.get('response_cache')
+    if cache is None:
+        backend = import_string(current_app.config['CACHE_BACKEND'])(
+            max_entries=current_app.config['CACHE_MAX_ENTRIES'],
+            url=current_app.config['CACHE_URL']
+        )
+        cache = current_app.extensions.setdefault('response_cache', ResponseCache(backend, current_app.config['CACHE_TTL']))
+    return cache
+
+
+def invalidate(kind, *ids):
+    '''
+    Function to drop cached entities of a kind and every cached page listing them
+    '''
+    get_cache().invalidate(kind, *ids)
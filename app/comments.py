@@ -0,0 +1,62 @@
+from flask import current_app, request
+from sqlalchemy import func
+from . import db
+from .models import Comment, CommentSchema
+from .serializers import dump
+
+comments_schema = CommentSchema(many=True)
+
+
+def preview_size():
+    '''
+    Function to read how many comments to embed under each post from ?comments=
+    '''
+    size = request.args.get('comments', 0, type=int)
+    return max(0, min(size, current_app.config['MAX_COMMENT_PREVIEWS']))
+
+
+def latest_comments(post_ids, per_post):
+    '''
+    Function to fetch the newest comments and comment count of many posts in one query
+
+    Returns {post_id: (comments, count)}, with posts without comments left out.
+    '''
+    post_ids = sorted(set(post_ids))
+    if not post_ids:
+        return {}
+
+    ranked = db.session.query(
+        Comment.id,
+        Comment.comment,
+        Comment.timestamp,
+        Comment.post_id,
+        func.row_number().over(
+            partition_by=Comment.post_id, order_by=(Comment.timestamp.desc(), Comment.id.desc())
+        ).label('rank'),
+        func.count().over(partition_by=Comment.post_id).label('total')
+    ).filter(Comment.post_id.in_(post_ids)).subquery()
+    rows = db.session.query(ranked).filter(ranked.c.rank <= max(per_post, 1)).order_by(
+        ranked.c.post_id, ranked.c.rank
+    ).all()
+
+    latest = {}
+    for row in rows:
+        comments, _ = latest.get(row.post_id, ([], 0))
+        if row.rank <= per_post:
+            comments.append(row)
+        latest[row.post_id] = (comments, row.total)
+    return {post_id: (dump(comments_schema, comments), total) for post_id, (comments, total) in latest.items()}
+
+
+def embed_comments(posts, data, per_post):
+    '''
+    Function to add comment previews to dumped posts, in the order of posts
+    '''
+    if not per_post:
+        return data
+    latest = latest_comments([post.id for post in posts], per_post)
+    for post, item in zip(posts, data):
+        comments, total = latest.get(post.id, ([], 0))
+        item['comments'] = comments
+        item['comment_count'] = total
+    return data
@@ -0,0 +1,91 @@
+import hashlib
+import json
+from datetime import datetime
+from flask import Response, request
+from werkzeug.http import http_date, parse_date, quote_etag, unquote_etag
+from . import db
+
+
+def versions(rows):
+    '''
+    Function to list the (id, updated_at) pairs of loaded objects or rows
+    '''
+    return [(row.id, row.updated_at) for row in rows]
+
+
+def dumped_versions(id, data):
+    '''
+    Function to read the version back off an already dumped object
+    '''
+    return [(id, datetime.fromisoformat(data['updated_at']))]
+
+
+def make_etag(kind, params, versions):
+    '''
+    Function to derive an ETag from the (id, updated_at) pairs a response is built from
+
+    params holds whatever else shapes the representation, such as ?fields=,
+    so every variant of a resource gets its own tag.
+    '''
+    raw = json.dumps([
+        kind, params, [[id, updated_at.isoformat()] for id, updated_at in versions]
+    ], sort_keys=True)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def validators(kind, params, versions):
+    '''
+    Function to build the ETag and Last-Modified headers of a response
+
+    The ETag is weak as equal data may be encoded to different bytes.
+    '''
+    headers = {'ETag': quote_etag(make_etag(kind, params, versions), weak=True)}
+    if versions:
+        headers['Last-Modified'] = http_date(max(updated_at for _, updated_at in versions))
+    return headers
+
+
+def is_conditional():
+    '''
+    Function to check whether a request carries If-None-Match or If-Modified-Since
+    '''
+    return bool(request.if_none_match) or request.if_modified_since is not None
+
+
+def not_modified(headers):
+    '''
+    Function to check the request's validators against the current ones
+
+    If-None-Match takes precedence, If-Modified-Since is only used without it.
+    '''
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(unquote_etag(headers['ETag'])[0])
+    if request.if_modified_since is None or 'Last-Modified' not in headers:
+        return False
+    return parse_date(headers['Last-Modified']) <= request.if_modified_since
+
+
+def not_modified_response(headers):
+    return Response(status=304, headers=headers)
+
+
+def entity_row(model, id, *columns):
+    '''
+    Function to look up just the version of one row, None when it does not exist
+    '''
+    return model.visible().with_entities(model.id, model.updated_at, *columns).filter(model.id == id).first()
+
+
+def page_rows(query, model, timestamp_column, limit, after, *columns):
+    '''
+    Function to look up just the versions of one page of a list
+
+    Runs the page query on the id and updated_at columns alone, so a list
+    can be validated without loading or dumping its rows.
+    '''
+    from .pagination import paginate
+    rows, _ = paginate(
+        query.with_entities(model.id, model.updated_at, timestamp_column, *columns),
+        timestamp_column, model.id, limit, after
+    )
+    return rows
@@ -0,0 +1,125 @@
+import random
+import threading
+import time
+from flask import has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.selectable import Select
+
+# Pool arguments only queue pools accept, dropped for SQLite
+POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+# Requests with these methods may read from a replica until they write
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# SQLALCHEMY_BINDS keys holding the replica URLs, see config.py
+REPLICA_PREFIX = 'replica'
+
+
+class TimedQueuePool(QueuePool):
+    '''
+    Queue pool recording how long checkouts wait for a free connection
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._waits = {'checkouts': 0, 'wait_total': 0.0, 'wait_max': 0.0, 'timeouts': 0}
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            with self._stats_lock:
+                self._waits['timeouts'] += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self._waits['checkouts'] += 1
+                self._waits['wait_total'] += waited
+                self._waits['wait_max'] = max(self._waits['wait_max'], waited)
+
+    def stats(self):
+        capacity = self.size() + max(self._max_overflow, 0)
+        with self._stats_lock:
+            stats = dict(self._waits)
+        stats.update(
+            size=self.size(),
+            checked_out=self.checkedout(),
+            overflow=max(self.overflow(), 0),
+            saturation=self.checkedout() / capacity if capacity else 0.0
+        )
+        return stats
+
+
+class RoutingSession(SignallingSession):
+    '''
+    Session sending reads of read-only requests to a replica
+
+    Everything else goes to the primary: writes, raw SQL, work outside a
+    request, and every statement of a request after its first write, so a
+    request always reads what it just wrote.
+    '''
+    def get_bind(self, mapper=None, clause=None):
+        if mapper is not None and getattr(mapper.persist_selectable, 'info', {}).get('bind_key'):
+            return super().get_bind(mapper, clause)
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info['primary'] = True
+        elif self._reads_from_replica(clause):
+            replica = self.info.get('replica')
+            if replica is None:
+                replica = self.info['replica'] = random.choice(self._replicas())
+            return get_state(self.app).db.get_engine(self.app, bind=replica)
+        return super().get_bind(mapper, clause)
+
+    def _replicas(self):
+        return [bind for bind in self.app.config.get('SQLALCHEMY_BINDS') or () if bind.startswith(REPLICA_PREFIX)]
+
+    def _reads_from_replica(self, clause):
+        if self.info.get('primary') or not has_request_context() or request.method not in READ_METHODS:
+            return False
+        # Raw SQL may write, so only plain selects are routed
+        return (clause is None or isinstance(clause, Select)) and bool(self._replicas())
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    '''
+    SQLAlchemy extension with read replica routing and a timed queue pool
+    '''
+    def create_session(self, options):
+        from sqlalchemy.orm import sessionmaker
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        if sa_url.drivername.startswith('sqlite'):
+            for option in POOL_OPTIONS:
+                engine_opts.pop(option, None)
+        else:
+            engine_opts.setdefault('poolclass', TimedQueuePool)
+        return create_engine(sa_url, **engine_opts)
+
+
+def use_primary(session):
+    '''
+    Function to keep every following read of the request on the primary
+    '''
+    session.info['primary'] = True
+
+
+def pool_stats(app):
+    '''
+    Function to report the connection pool of the primary and of each replica
+    '''
+    state = get_state(app)
+    stats = {}
+    for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or ()):
+        pool = state.db.get_engine(app, bind=bind).pool
+        name = bind or 'primary'
+        if isinstance(pool, TimedQueuePool):
+            stats[name] = pool.stats()
+        else:
+            stats[name] = {'pool': type(pool).__name__, 'checked_out': getattr(pool, 'checkedout', lambda: 0)()}
+    return stats
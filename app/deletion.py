@@ -0,0 +1,262 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import and_, func, select
+from . import db
+from .cache import invalidate
+from .events import on_commit
+from .models import (
+    Comment, DeletionJob, DeletionStatus, Like, MediaVariant, Post, PostTag, Profile, TimelineEntry, followers, tags
+)
+from .sql import increment
+
+
+def _unlike(clause):
+    # Likes given by a deleted profile stop counting on the posts they liked
+    liked = select([Like.post_id]).where(clause)
+    given = select([func.count()]).where(and_(clause, Like.post_id == Post.id)).as_scalar()
+    post_ids = [id for id, in db.session.query(Post.id).filter(Post.id.in_(liked))]
+    Post.query.filter(Post.id.in_(post_ids)).update(
+        {Post.like_count: Post.like_count - given}, synchronize_session=False
+    )
+    on_commit(invalidate, 'post', *post_ids)
+
+
+def _unfollow(counter, other):
+    # The other side of each follow edge loses a follower or a follow
+    def hook(clause):
+        from .autocomplete import count_followers
+        from .graph import record_unfollow
+        edges = db.session.query(followers.c.follower_id, followers.c.followed_id).filter(clause).all()
+        profile_ids = [id for id, in db.session.query(other).filter(clause)]
+        Profile.query.filter(Profile.id.in_(profile_ids)).update(
+            {counter: counter - 1}, synchronize_session=False
+        )
+        for follower_id, followed_id in edges:
+            on_commit(record_unfollow, follower_id, followed_id)
+        if counter is Profile.follower_count:
+            for profile_id in profile_ids:
+                on_commit(count_followers, profile_id, -1)
+        on_commit(invalidate, 'profile', *profile_ids)
+    return hook
+
+
+def _untag(clause):
+    from .autocomplete import count_tag
+    counts = db.session.query(tags.c.tag_id, func.count()).filter(clause).group_by(tags.c.tag_id).all()
+    for tag_id, count in counts:
+        on_commit(count_tag, tag_id, -count)
+
+    def uncount():
+        for tag_id, count in counts:
+            increment(PostTag, tag_id, post_count=-count)
+    return uncount
+
+
+def plan(entity, entity_id):
+    '''
+    Function to list the steps deleting an entity, children first
+
+    Each step is (name, table, condition, key, hook): the rows matching
+    condition are deleted a batch of distinct key values at a time, and
+    hook, when given, runs on each batch's clause before its DELETE and may
+    return a function to run after it.
+    '''
+    scope = Post.profile_id == entity_id if entity == 'profile' else Post.id == entity_id
+    post_ids = select([Post.id]).where(scope)
+
+    steps = []
+    if entity == 'profile':
+        steps += [
+            ('home timeline', TimelineEntry.__table__, TimelineEntry.profile_id == entity_id, TimelineEntry.post_id, None),
+            ('timeline entries', TimelineEntry.__table__, TimelineEntry.author_id == entity_id, TimelineEntry.post_id, None),
+            ('likes given', Like.__table__, Like.profile_id == entity_id, Like.id, _unlike),
+            ('following', followers, followers.c.follower_id == entity_id, followers.c.followed_id,
+             _unfollow(Profile.follower_count, followers.c.followed_id)),
+            ('followers', followers, followers.c.followed_id == entity_id, followers.c.follower_id,
+             _unfollow(Profile.following_count, followers.c.follower_id))
+        ]
+    else:
+        steps.append(('timeline entries', TimelineEntry.__table__, TimelineEntry.post_id == entity_id, TimelineEntry.profile_id, None))
+
+    steps += [
+        ('media variants', MediaVariant.__table__, MediaVariant.post_id.in_(post_ids), MediaVariant.id, None),
+        ('tags', tags, tags.c.post_id.in_(post_ids), tags.c.post_id, _untag),
+        ('likes', Like.__table__, Like.post_id.in_(post_ids), Like.id, None),
+        ('comments', Comment.__table__, Comment.post_id.in_(post_ids), Comment.id, None),
+        ('posts', Post.__table__, scope, Post.id, None)
+    ]
+    if entity == 'profile':
+        steps.append(('profile', Profile.__table__, Profile.id == entity_id, Profile.id, None))
+    return steps
+
+
+def step_names(entity):
+    return [name for name, _, _, _, _ in plan(entity, 0)]
+
+
+def delete_batch(table, condition, key, size, hook=None):
+    '''
+    Function to delete the rows of up to size key values, None when none are left
+    '''
+    keys = [value for value, in db.session.query(key).filter(condition).distinct().order_by(key).limit(size)]
+    if not keys:
+        return None
+    clause = and_(condition, key.in_(keys))
+    after = hook(clause) if hook is not None else None
+    deleted = db.session.execute(table.delete().where(clause)).rowcount
+    if after is not None:
+        after()
+    return deleted
+
+
+def run_job(job_id):
+    '''
+    Function to carry out a deletion job from the step it got to
+
+    Every batch commits together with the job's progress, so an interrupted
+    job resumes where it stopped; steps only delete what is left, so
+    running one again is harmless.
+    '''
+    config = current_app.config
+    job = DeletionJob.query.get(job_id)
+    if job is None or job.status == DeletionStatus.done.value:
+        return
+
+    steps = plan(job.entity, job.entity_id)
+    names = [name for name, _, _, _, _ in steps]
+    start = names.index(job.step) if job.step in names else 0
+    job.status = DeletionStatus.running.value
+    job.error = None
+    db.session.commit()
+
+    progress = DeletionJob.query.filter(DeletionJob.id == job_id)
+    try:
+        for name, table, condition, key, hook in steps[start:]:
+            while True:
+                deleted = delete_batch(table, condition, key, config['DELETION_BATCH_SIZE'], hook)
+                if deleted is None:
+                    break
+                progress.update({
+                    DeletionJob.step: name,
+                    DeletionJob.rows_deleted: DeletionJob.rows_deleted + deleted
+                }, synchronize_session=False)
+                db.session.commit()
+                # Leave room for other writers between batches
+                if config['DELETION_PAUSE']:
+                    time.sleep(config['DELETION_PAUSE'])
+        progress.update({
+            DeletionJob.status: DeletionStatus.done.value,
+            DeletionJob.finished_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        progress.update({
+            DeletionJob.status: DeletionStatus.failed.value,
+            DeletionJob.error: str(e)
+        }, synchronize_session=False)
+        db.session.commit()
+        raise
+
+
+class DeletionWorker:
+    '''
+    Runs deletion jobs in the background
+
+    With DELETION_WORKERS set to 0 jobs run inline, which keeps tests
+    deterministic.
+    '''
+    def __init__(self, app):
+        self.app = app
+        self.workers = app.config['DELETION_WORKERS']
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='deletion') if self.workers else None
+        self._lock = threading.Lock()
+        self._queued = set()
+
+    def submit(self, job_id):
+        with self._lock:
+            if job_id in self._queued:
+                return
+            self._queued.add(job_id)
+        if self._executor is None:
+            self._run(run_job, job_id)
+        else:
+            self._executor.submit(self._run, self._run_in_context, job_id)
+
+    def _run_in_context(self, job_id):
+        with self.app.app_context():
+            run_job(job_id)
+
+    def _run(self, run, job_id):
+        try:
+            run(job_id)
+        except Exception:
+            self.app.logger.exception('Deletion job %s failed', job_id)
+        finally:
+            with self._lock:
+                self._queued.discard(job_id)
+
+
+def get_deletion_worker():
+    worker = current_app.extensions.get('deletion_worker')
+    if worker is None:
+        worker = current_app.extensions.setdefault('deletion_worker', DeletionWorker(current_app._get_current_object()))
+    return worker
+
+
+def schedule(entity, entity_id):
+    '''
+    Function to hide a profile or post at once and queue the deletion of it and its rows
+
+    Deleting a profile hides its posts too. Returns the DeletionJob.
+    '''
+    from .autocomplete import count_location, forget
+    from .search import unindex
+    from .trending import forget_post
+
+    scope = Post.profile_id == entity_id if entity == 'profile' else Post.id == entity_id
+    post_ids = [id for id, in db.session.query(Post.id).filter(scope)]
+    locations = Post.visible().with_entities(Post.post_location, func.count()).filter(scope).group_by(Post.post_location).all()
+    if entity == 'profile':
+        Profile.query.filter(Profile.id == entity_id).update({Profile.pending_deletion: True}, synchronize_session=False)
+    Post.query.filter(scope).update({Post.pending_deletion: True}, synchronize_session=False)
+
+    job = DeletionJob.query.filter_by(entity=entity, entity_id=entity_id).first()
+    if job is None:
+        job = DeletionJob(entity, entity_id)
+        db.session.add(job)
+    elif job.status == DeletionStatus.done.value:
+        # Ids can be reused once a row is gone
+        job.status = DeletionStatus.pending.value
+        job.step = None
+        job.rows_deleted = 0
+        job.finished_at = None
+    db.session.commit()
+
+    invalidate(entity, entity_id)
+    invalidate('post', *post_ids)
+    if entity == 'profile':
+        unindex('profiles', entity_id)
+        forget('profiles', entity_id)
+    for location, count in locations:
+        count_location(location, -count)
+    for post_id in post_ids:
+        unindex('posts', post_id)
+        forget_post(post_id)
+
+    get_deletion_worker().submit(job.id)
+    return job
+
+
+def requeue_deletions():
+    '''
+    Function to queue again the deletion jobs a restart or an error left unfinished
+    '''
+    worker = get_deletion_worker()
+    jobs = [id for id, in db.session.query(DeletionJob.id).filter(DeletionJob.status != DeletionStatus.done.value)]
+    for job_id in jobs:
+        worker.submit(job_id)
+    return len(jobs)
@@ -0,0 +1,118 @@
+import enum
+import gzip
+import json
+import uuid
+from datetime import date, datetime, time
+from flask import current_app, make_response, request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+# Statuses whose responses have no body worth compressing
+_BODILESS = (204, 304)
+
+
+def _json_default(value):
+    # Encodes the values orjson supports natively the way orjson does
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, enum.Enum):
+        return value.value
+    raise TypeError('Type is not JSON serializable: {}'.format(type(value).__name__))
+
+
+def dumps_json(data):
+    '''
+    Function to encode data as compact JSON bytes, with orjson when it is installed
+
+    The json module fallback gives the same output for dates, times, UUIDs
+    and enums.
+    '''
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # Values orjson refuses, such as integers over 64 bits
+            pass
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False, default=_json_default).encode('utf-8')
+
+
+def dumps_msgpack(data):
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def content_codings():
+    '''
+    Function to list the content codings the server can produce, preferred first
+    '''
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def compress(body):
+    '''
+    Function to compress a body with the best coding the client accepts
+
+    Returns the coding and the compressed body, or None and the body when
+    compression is off, the body is under COMPRESSION_MIN_SIZE bytes or the
+    client accepts no coding we produce.
+    '''
+    config = current_app.config
+    if not config['COMPRESSION'] or len(body) < config['COMPRESSION_MIN_SIZE']:
+        return None, body
+    coding = request.accept_encodings.best_match(content_codings())
+    if coding == 'br':
+        return coding, brotli.compress(body, quality=config['BROTLI_QUALITY'])
+    if coding == 'gzip':
+        return coding, gzip.compress(body, compresslevel=config['COMPRESSION_LEVEL'])
+    return None, body
+
+
+def encoded_response(body, code, headers=None):
+    '''
+    Function to make a response of an encoded body, compressing it when worthwhile
+    '''
+    coding, body = compress(body) if code not in _BODILESS else (None, body)
+    response = make_response(body, code)
+    response.headers.extend(headers or {})
+    if coding is not None:
+        response.headers['Content-Encoding'] = coding
+    # Caches must key the response on the representation and coding asked for
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response
+
+
+def output_json(data, code, headers=None):
+    return encoded_response(dumps_json(data), code, headers)
+
+
+def output_msgpack(data, code, headers=None):
+    return encoded_response(dumps_msgpack(data), code, headers)
+
+
+def init_encoding(api):
+    '''
+    Function to register the API's representations
+
+    JSON stays the default, MessagePack is offered to clients asking for
+    application/msgpack when msgpack is installed. Both are compressed
+    according to Accept-Encoding.
+    '''
+    api.representation('application/json')(output_json)
+    if msgpack is not None:
+        api.representation(MSGPACK_MIMETYPE)(output_msgpack)
@@ -0,0 +1,25 @@
+from sqlalchemy import event
+from . import db
+
+
+def on_commit(callback, *args):
+    '''
+    Function to run a callback once the current transaction commits
+
+    Callbacks queued in a transaction that rolls back are dropped. They run
+    after the database work is done and must not use the session themselves.
+    '''
+    db.session().info.setdefault('on_commit', []).append((callback, args))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _run_on_commit(session):
+    callbacks = session.info.pop('on_commit', [])
+    for callback, args in callbacks:
+        callback(*args)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _drop_on_commit(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('on_commit', None)
@@ -0,0 +1,134 @@
+import heapq
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from flask import current_app
+from . import db
+from .models import followers
+from .refresh import Refresher
+
+
+def _contains(ids, id):
+    index = bisect_left(ids, id)
+    return index < len(ids) and ids[index] == id
+
+
+def _intersect(left, right):
+    if len(left) > len(right):
+        left, right = right, left
+    return [id for id in left if _contains(right, id)]
+
+
+class FollowerGraph:
+    '''
+    In-memory index of the followers table
+
+    Every profile id maps to sorted integer arrays of the profiles it follows
+    and the profiles following it, so membership checks are binary searches.
+    '''
+    def __init__(self):
+        self._following = {}
+        self._followers = {}
+        self._lock = threading.RLock()
+
+    def load(self, edges):
+        following = {}
+        followed_by = {}
+        for follower_id, followed_id in edges:
+            if follower_id is None or followed_id is None:
+                continue
+            following.setdefault(follower_id, []).append(followed_id)
+            followed_by.setdefault(followed_id, []).append(follower_id)
+
+        following = {id: array('l', sorted(set(ids))) for id, ids in following.items()}
+        followed_by = {id: array('l', sorted(set(ids))) for id, ids in followed_by.items()}
+        with self._lock:
+            self._following = following
+            self._followers = followed_by
+
+    def add(self, follower_id, followed_id):
+        with self._lock:
+            ids = self._following.setdefault(follower_id, array('l'))
+            if not _contains(ids, followed_id):
+                insort(ids, followed_id)
+                insort(self._followers.setdefault(followed_id, array('l')), follower_id)
+
+    def remove(self, follower_id, followed_id):
+        with self._lock:
+            ids = self._following.get(follower_id)
+            if ids is not None and _contains(ids, followed_id):
+                ids.pop(bisect_left(ids, followed_id))
+                others = self._followers[followed_id]
+                others.pop(bisect_left(others, follower_id))
+
+    def is_following(self, viewer_id, ids):
+        following = self._following.get(viewer_id, ())
+        return {id: _contains(following, id) for id in ids}
+
+    def following(self, profile_id):
+        return list(self._following.get(profile_id, ()))
+
+    def followers(self, profile_id):
+        return list(self._followers.get(profile_id, ()))
+
+    def follower_count(self, profile_id):
+        return len(self._followers.get(profile_id, ()))
+
+    def following_count(self, profile_id):
+        return len(self._following.get(profile_id, ()))
+
+    def mutual(self, profile_id):
+        '''
+        Profiles that both follow and are followed by the given profile
+        '''
+        with self._lock:
+            return _intersect(self._following.get(profile_id, ()), self._followers.get(profile_id, ()))
+
+    def suggestions(self, profile_id, limit):
+        '''
+        Friends of friends not yet followed, ranked by how many of the
+        profile's follows also follow them
+        '''
+        with self._lock:
+            following = self._following.get(profile_id, ())
+            scores = Counter()
+            for friend_id in following:
+                for candidate_id in self._following.get(friend_id, ()):
+                    if candidate_id != profile_id and not _contains(following, candidate_id):
+                        scores[candidate_id] += 1
+        return heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+def _load_graph():
+    graph = FollowerGraph()
+    graph.load(db.session.query(followers.c.follower_id, followers.c.followed_id).yield_per(10000))
+    return graph
+
+
+def get_follower_graph():
+    '''
+    Function to get the application's follower graph, loading it when needed
+
+    The graph is reloaded from the followers table in the background every
+    FOLLOW_GRAPH_REFRESH seconds so follows made through other worker
+    processes show up too.
+    '''
+    refresher = current_app.extensions.get('follower_graph')
+    if refresher is None:
+        refresher = current_app.extensions.setdefault('follower_graph', Refresher(
+            current_app._get_current_object(), _load_graph, current_app.config['FOLLOW_GRAPH_REFRESH'], 'follower-graph'
+        ))
+    return refresher.get()
+
+
+def record_follow(follower_id, followed_id):
+    refresher = current_app.extensions.get('follower_graph')
+    if refresher is not None:
+        refresher.apply(lambda graph: graph.add(follower_id, followed_id))
+
+
+def record_unfollow(follower_id, followed_id):
+    refresher = current_app.extensions.get('follower_graph')
+    if refresher is not None:
+        refresher.apply(lambda graph: graph.remove(follower_id, followed_id))
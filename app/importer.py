@@ -0,0 +1,308 @@
+import csv
+import io
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import and_, exists, select, true
+from . import db
+from .models import Comment, ImportCheckpoint, Like, Post, PostTag, Profile, TimelineEntry, followers, tags
+from .sql import insert_ignore
+from .tags import get_tag_dictionary, link
+
+
+class InvalidRecord(ValueError):
+    '''
+    Raised when an import file holds a record that cannot be loaded
+    '''
+    pass
+
+
+def _boolean(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 't', 'y')
+
+
+def _datetime(value):
+    if value in (None, '') or isinstance(value, datetime):
+        return value or None
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00')).replace(tzinfo=None)
+
+
+def _text(value):
+    return None if value in (None, '') else str(value)
+
+
+class _KeyCache:
+    '''
+    Bounded cache of natural keys (username, post_name, tag_text) to row ids
+    '''
+    def __init__(self, column, id_column, size=500000):
+        self.column = column
+        self.id_column = id_column
+        self.size = size
+        self._ids = OrderedDict()
+
+    def resolve(self, keys):
+        missing = {key for key in keys if key is not None and key not in self._ids}
+        missing = list(missing)
+        for start in range(0, len(missing), 1000):
+            chunk = missing[start:start + 1000]
+            for key, id in db.session.query(self.column, self.id_column).filter(self.column.in_(chunk)):
+                self._ids.setdefault(key, id)
+        # Read before evicting so a batch with more keys than fit still resolves
+        ids = {key: self._ids.get(key) for key in keys}
+        while len(self._ids) > self.size:
+            self._ids.popitem(last=False)
+        return ids
+
+
+class Importer:
+    '''
+    Streams NDJSON or CSV files into the database in large batches
+
+    Foreign keys are given by natural key: profiles by username, posts by
+    post_name and tags by tag_text. Progress is checkpointed in the same
+    transaction as each batch, so a failed import resumes after the last
+    batch that was committed.
+    '''
+    entities = ('profiles', 'posts', 'tags', 'comments', 'likes', 'follows')
+
+    def __init__(self, batch_size=5000, resume=True, echo=print):
+        self.batch_size = batch_size
+        self.resume = resume
+        self.echo = echo
+        self.profiles = _KeyCache(Profile.username, Profile.id)
+        self.posts = _KeyCache(Post.post_name, Post.id)
+
+    def run(self, entity, path, fmt=None):
+        if entity not in self.entities:
+            raise InvalidRecord('Unknown entity {}, expected one of {}'.format(entity, ', '.join(self.entities)))
+
+        source = os.path.abspath(path)
+        checkpoint = ImportCheckpoint.query.get(source)
+        if checkpoint is None or not self.resume:
+            checkpoint = checkpoint or ImportCheckpoint(source=source, entity=entity)
+            checkpoint.rows_done = 0
+            db.session.add(checkpoint)
+            db.session.commit()
+        skip = checkpoint.rows_done
+
+        convert = getattr(self, '_' + entity)
+        started = time.monotonic()
+        done = 0
+        batch = []
+        for number, record in enumerate(self._records(path, fmt), 1):
+            if number <= skip:
+                continue
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                done += self._commit(convert, batch, checkpoint)
+                batch = []
+                self._report(entity, skip + done, done, started)
+        if batch:
+            done += self._commit(convert, batch, checkpoint)
+        self._report(entity, skip + done, done, started)
+        return done
+
+    def _report(self, entity, total, done, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.echo('{}: {} rows loaded ({:.0f} rows/s)'.format(entity, total, done / elapsed))
+
+    def _records(self, path, fmt):
+        fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+        with open(path, newline='', encoding='utf-8') as handle:
+            if fmt in ('ndjson', 'jsonl', 'json'):
+                for line in handle:
+                    if line.strip():
+                        yield json.loads(line)
+            elif fmt == 'csv':
+                for record in csv.DictReader(handle):
+                    yield record
+            else:
+                raise InvalidRecord('Unknown format {}, expected ndjson or csv'.format(fmt))
+
+    def _commit(self, convert, batch, checkpoint):
+        try:
+            convert(batch)
+            checkpoint.rows_done += len(batch)
+            checkpoint.updated_at = datetime.utcnow()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return len(batch)
+
+    def _write(self, table, rows, columns):
+        '''
+        Insert rows with COPY on PostgreSQL and a Core executemany elsewhere
+        '''
+        if not rows:
+            return
+        connection = db.session.connection()
+        if connection.dialect.name == 'postgresql':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in rows:
+                writer.writerow(['\\N' if row[column] is None else row[column] for column in columns])
+            buffer.seek(0)
+            cursor = connection.connection.cursor()
+            cursor.copy_expert(
+                "COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')".format(table.name, ', '.join(columns)),
+                buffer
+            )
+        else:
+            connection.execute(table.insert(), rows)
+
+    def _require(self, ids, key, kind):
+        id = ids.get(key)
+        if id is None:
+            raise InvalidRecord('Unknown {} {!r}'.format(kind, key))
+        return id
+
+    def _profiles(self, batch):
+        now = datetime.utcnow()
+        rows = [{
+            'username': record['username'],
+            'country': record['country'],
+            'facebook': _text(record.get('facebook')),
+            'twitter': _text(record.get('twitter')),
+            'google': _text(record.get('google')),
+            'is_active': _boolean(record.get('is_active', True)),
+            'is_verified': _boolean(record.get('is_verified', False)),
+            'remember_token': _boolean(record.get('remember_token', False)),
+            'join_date': _datetime(record.get('join_date')) or now,
+            'follower_count': 0,
+            'following_count': 0,
+            'updated_at': now
+        } for record in batch]
+        self._write(Profile.__table__, rows, list(rows[0]))
+
+    def _posts(self, batch):
+        now = datetime.utcnow()
+        authors = self.profiles.resolve([record['username'] for record in batch])
+        rows = [{
+            'media': record.get('media') or Post.media.default.arg,
+            'post_name': record['post_name'],
+            'post_type': record.get('post_type') or 'photo',
+            'post_location': record['post_location'],
+            'post_category': record.get('post_category') or 'africanhistory',
+            'post_licensing': record.get('post_licensing') or 'creativecommons',
+            'timestamp': _datetime(record.get('timestamp')) or now,
+            'profile_id': self._require(authors, record['username'], 'username'),
+            'like_count': 0,
+            'comment_count': 0,
+            'updated_at': now
+        } for record in batch]
+        self._write(Post.__table__, rows, list(rows[0]))
+
+    def _tags(self, batch):
+        known = get_tag_dictionary().intern({record['tag_text'] for record in batch})
+        posts = self.posts.resolve([record['post_name'] for record in batch])
+        link(
+            (self._require(posts, record['post_name'], 'post_name'),
+             self._require(known, record['tag_text'], 'tag_text'))
+            for record in batch
+        )
+
+    def _comments(self, batch):
+        now = datetime.utcnow()
+        posts = self.posts.resolve([record['post_name'] for record in batch])
+        rows = [{
+            'comment': record['comment'],
+            'timestamp': _datetime(record.get('timestamp')) or now,
+            'post_id': self._require(posts, record['post_name'], 'post_name'),
+            'updated_at': now
+        } for record in batch]
+        self._write(Comment.__table__, rows, list(rows[0]))
+
+    def _likes(self, batch):
+        profiles = self.profiles.resolve([record['username'] for record in batch])
+        posts = self.posts.resolve([record['post_name'] for record in batch])
+        pairs = {
+            (self._require(profiles, record['username'], 'username'),
+             self._require(posts, record['post_name'], 'post_name'))
+            for record in batch
+        }
+        db.session.execute(insert_ignore(Like.__table__), [
+            {'profile_id': profile_id, 'post_id': post_id} for profile_id, post_id in pairs
+        ])
+
+    def _follows(self, batch):
+        profiles = self.profiles.resolve(
+            [record['follower'] for record in batch] + [record['followed'] for record in batch]
+        )
+        pairs = {
+            (self._require(profiles, record['follower'], 'username'),
+             self._require(profiles, record['followed'], 'username'))
+            for record in batch
+        }
+        db.session.execute(insert_ignore(followers), [
+            {'follower_id': follower_id, 'followed_id': followed_id} for follower_id, followed_id in pairs
+        ])
+
+
+def rebuild_counters():
+    '''
+    Function to recompute every counter column after rows were bulk loaded
+    '''
+    posts = Post.__table__
+    profiles = Profile.__table__
+    posttags = PostTag.__table__
+    count = db.func.count()
+    db.session.execute(posts.update().values(
+        like_count=select([count]).where(Like.post_id == posts.c.id).as_scalar(),
+        comment_count=select([count]).where(Comment.post_id == posts.c.id).as_scalar()
+    ))
+    db.session.execute(profiles.update().values(
+        follower_count=select([count]).where(followers.c.followed_id == profiles.c.id).as_scalar(),
+        following_count=select([count]).where(followers.c.follower_id == profiles.c.id).as_scalar()
+    ))
+    db.session.execute(posttags.update().values(
+        post_count=select([count]).where(tags.c.tag_id == posttags.c.id).as_scalar()
+    ))
+    db.session.commit()
+
+
+def rebuild_timelines():
+    '''
+    Function to materialize home timelines for bulk loaded posts and follows
+    '''
+    entries = TimelineEntry.__table__
+    columns = ['profile_id', 'post_id', 'author_id', 'timestamp']
+    missing = ~exists().where(and_(
+        entries.c.profile_id == followers.c.follower_id,
+        entries.c.post_id == Post.id
+    ))
+    own_missing = ~exists().where(and_(
+        entries.c.profile_id == Post.profile_id,
+        entries.c.post_id == Post.id
+    ))
+    db.session.execute(entries.insert().from_select(columns, select([
+        Post.profile_id, Post.id, Post.profile_id.label('author_id'), Post.timestamp
+    ]).where(and_(Post.profile_id.isnot(None), own_missing))))
+    # Posts of celebrities not in any follower's timeline yet are merged in
+    # at read time, like the ones they post from now on
+    celebrities = select([Profile.id]).where(Profile.follower_count >= current_app.config['TIMELINE_FANOUT_LIMIT'])
+    fanned = exists().where(and_(
+        entries.c.post_id == Post.id,
+        entries.c.profile_id != Post.profile_id
+    ))
+    db.session.execute(Post.__table__.update().where(and_(
+        Post.fanned_out == true(),
+        Post.profile_id.in_(celebrities),
+        ~fanned
+    )).values(fanned_out=False))
+    db.session.execute(entries.insert().from_select(columns, select([
+        followers.c.follower_id, Post.id, Post.profile_id, Post.timestamp
+    ]).select_from(
+        followers.join(Post.__table__, Post.profile_id == followers.c.followed_id)
+    ).where(and_(
+        followers.c.follower_id != Post.profile_id,
+        Post.fanned_out == true(),
+        missing
+    ))))
+    db.session.commit()
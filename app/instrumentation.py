@@ -0,0 +1,280 @@
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds of the request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started or not has_request_context():
+        return
+    elapsed = time.perf_counter() - started.pop()
+    queries = g.get('queries')
+    if queries is not None:
+        queries['count'] += 1
+        queries['time'] += elapsed
+        queries['statements'][statement] += 1
+
+
+def _handle_error(context):
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+# Engine events are listened to once for every engine, replicas included
+event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+event.listen(Engine, 'handle_error', _handle_error)
+
+
+class Metrics:
+    '''
+    Per-endpoint request counters and latency histograms of a worker process
+
+    Without a directory every series is labelled with the pid of the worker
+    answering the scrape, which only sees its own requests. With one, each
+    worker writes its counters there at most every flush_interval seconds
+    and renders the sum of every worker's, like the multiprocess mode of
+    the Prometheus client.
+    '''
+    def __init__(self, directory=None, flush_interval=5):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._requests = defaultdict(lambda: {
+            'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+            'sum': 0.0,
+            'queries': 0,
+            'db_time': 0.0,
+            'n_plus_one': 0
+        })
+        self._statuses = Counter()
+
+    def observe(self, endpoint, method, status, duration, queries, db_time, n_plus_one):
+        with self._lock:
+            series = self._requests[(endpoint, method)]
+            series['buckets'][bisect_left(LATENCY_BUCKETS, duration)] += 1
+            series['sum'] += duration
+            series['queries'] += queries
+            series['db_time'] += db_time
+            series['n_plus_one'] += n_plus_one
+            self._statuses[(endpoint, method, status)] += 1
+        if self.directory and time.monotonic() - self._flushed_at > self.flush_interval:
+            self.flush()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': [
+                    [endpoint, method, dict(series, buckets=list(series['buckets']))]
+                    for (endpoint, method), series in self._requests.items()
+                ],
+                'statuses': [[endpoint, method, status, count] for (endpoint, method, status), count in self._statuses.items()]
+            }
+
+    def flush(self):
+        '''
+        Writes this worker's counters to the metrics directory
+        '''
+        self._flushed_at = time.monotonic()
+        os.makedirs(self.directory, exist_ok=True)
+        descriptor, path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(descriptor, 'w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(path, os.path.join(self.directory, '{}.json'.format(os.getpid())))
+
+    def _snapshots(self):
+        if not self.directory:
+            return [self.snapshot()]
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path) as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self, gauges=()):
+        '''
+        Returns the metrics in the Prometheus text exposition format
+
+        gauges is a list of (name, help, type, [(labels, value)]) families
+        of this worker appended as they are, labelled with its pid.
+        '''
+        requests = {}
+        statuses = Counter()
+        for snapshot in self._snapshots():
+            for endpoint, method, series in snapshot['requests']:
+                total = requests.get((endpoint, method))
+                if total is None:
+                    requests[(endpoint, method)] = series
+                    continue
+                total['buckets'] = [left + right for left, right in zip(total['buckets'], series['buckets'])]
+                for key in ('sum', 'queries', 'db_time', 'n_plus_one'):
+                    total[key] += series[key]
+            for endpoint, method, status, count in snapshot['statuses']:
+                statuses[(endpoint, method, status)] += count
+
+        pid = {'pid': str(os.getpid())}
+        series_pid = {} if self.directory else pid
+        lines = []
+
+        def family(name, help, type):
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} {}'.format(name, type))
+
+        family('huc_request_duration_seconds', 'Request latency by endpoint', 'histogram')
+        for (endpoint, method), series in sorted(requests.items()):
+            labels = dict({'endpoint': endpoint, 'method': method}, **series_pid)
+            count = 0
+            for bound, observed in zip(LATENCY_BUCKETS + ('+Inf',), series['buckets']):
+                count += observed
+                lines.append(_sample('huc_request_duration_seconds_bucket', dict(labels, le=str(bound)), count))
+            lines.append(_sample('huc_request_duration_seconds_sum', labels, series['sum']))
+            lines.append(_sample('huc_request_duration_seconds_count', labels, count))
+
+        family('huc_requests_total', 'Requests by endpoint and status', 'counter')
+        for (endpoint, method, status), count in sorted(statuses.items()):
+            labels = dict({'endpoint': endpoint, 'method': method, 'status': str(status)}, **series_pid)
+            lines.append(_sample('huc_requests_total', labels, count))
+
+        for name, help, key in (
+            ('huc_db_queries_total', 'SQL statements run by endpoint', 'queries'),
+            ('huc_db_duration_seconds_total', 'Time spent in SQL statements by endpoint', 'db_time'),
+            ('huc_n_plus_one_total', 'Requests repeating an identical statement, probable N+1 queries', 'n_plus_one')
+        ):
+            family(name, help, 'counter')
+            for (endpoint, method), series in sorted(requests.items()):
+                lines.append(_sample(name, dict({'endpoint': endpoint, 'method': method}, **series_pid), series[key]))
+
+        for name, help, type, samples in gauges:
+            family(name, help, type)
+            for labels, value in samples:
+                lines.append(_sample(name, dict(labels, **pid), value))
+        return '\n'.join(lines) + '\n'
+
+
+def _sample(name, labels, value):
+    if labels:
+        name = '{}{{{}}}'.format(name, ','.join(
+            '{}="{}"'.format(key, str(label).replace('\\', '\\\\').replace('"', '\\"')) for key, label in labels.items()
+        ))
+    return '{} {}'.format(name, float(value) if isinstance(value, float) else value)
+
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.request_recorded = False
+    g.queries = {'count': 0, 'time': 0.0, 'statements': Counter()}
+
+
+def _record_request(status):
+    '''
+    Records the request once, returning its duration and queries
+    '''
+    started = g.get('request_started')
+    queries = g.get('queries')
+    if started is None or queries is None or g.get('request_recorded'):
+        return None, None
+    g.request_recorded = True
+
+    duration = time.perf_counter() - started
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    threshold = current_app.config['N_PLUS_ONE_THRESHOLD']
+    repeated = [(statement, count) for statement, count in queries['statements'].items() if count >= threshold]
+    for statement, count in repeated:
+        current_app.logger.warning(
+            'Probable N+1 query on %s %s, run %s times: %s', request.method, endpoint, count, ' '.join(statement.split())
+        )
+
+    current_app.extensions['metrics'].observe(
+        endpoint, request.method, status, duration, queries['count'], queries['time'], bool(repeated)
+    )
+    return duration, queries
+
+
+def _finish_request(response):
+    duration, queries = _record_request(response.status_code)
+    if duration is not None and current_app.config['SERVER_TIMING']:
+        response.headers.add('Server-Timing', 'db;dur={:.2f};desc="{} queries"'.format(queries['time'] * 1000, queries['count']))
+        response.headers.add('Server-Timing', 'app;dur={:.2f}'.format(duration * 1000))
+    return response
+
+
+def _teardown_request(error):
+    # Requests failing with an unhandled exception never reach after_request
+    if error is not None:
+        _record_request(500)
+
+
+def init_instrumentation(app):
+    '''
+    Function to time every request and the SQL it runs
+
+    Streamed responses are recorded when their headers are sent, so the
+    statements run while their body is generated are not counted.
+    '''
+    app.extensions['metrics'] = Metrics(app.config['METRICS_DIR'] or None, app.config['METRICS_FLUSH_INTERVAL'])
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_teardown_request)
+
+
+def clear_metrics(directory):
+    '''
+    Function to drop the counters earlier runs of the server left behind
+    '''
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        os.remove(path)
+
+
+def render_metrics():
+    '''
+    Function to render the request metrics along with cache and pool statistics
+    '''
+    from .cache import get_cache
+    from .database import pool_stats
+
+    cache = get_cache().stats()
+    pools = pool_stats(current_app._get_current_object())
+    gauges = [
+        ('huc_cache_{}_total'.format(key), 'Response cache {}'.format(key), 'counter', [({}, cache[key])])
+        for key in ('hits', 'misses', 'evictions', 'expirations') if key in cache
+    ]
+    if 'entries' in cache:
+        gauges.append(('huc_cache_entries', 'Entries held by the response cache', 'gauge', [({}, cache['entries'])]))
+
+    for name, help, type, key in (
+        ('huc_db_pool_checked_out', 'Connections in use', 'gauge', 'checked_out'),
+        ('huc_db_pool_size', 'Connections kept open by the pool', 'gauge', 'size'),
+        ('huc_db_pool_overflow', 'Connections opened past the pool size', 'gauge', 'overflow'),
+        ('huc_db_pool_saturation', 'Share of the pool capacity in use', 'gauge', 'saturation'),
+        ('huc_db_pool_checkouts_total', 'Connection checkouts', 'counter', 'checkouts'),
+        ('huc_db_pool_checkout_wait_seconds_total', 'Time spent waiting for a connection', 'counter', 'wait_total'),
+        ('huc_db_pool_checkout_wait_max_seconds', 'Longest wait for a connection', 'gauge', 'wait_max'),
+        ('huc_db_pool_timeouts_total', 'Checkouts that gave up waiting', 'counter', 'timeouts')
+    ):
+        samples = [({'pool': pool}, stats[key]) for pool, stats in sorted(pools.items()) if key in stats]
+        if samples:
+            gauges.append((name, help, type, samples))
+
+    return current_app.extensions['metrics'].render(gauges)
@@ -0,0 +1,75 @@
+from collections import defaultdict
+from . import db
+from .models import Like, Post, Profile
+from .sql import increment, insert_ignore
+from .trending import record_activity
+
+LIKE = 'like'
+UNLIKE = 'unlike'
+
+
+class InvalidLikeOperation(ValueError):
+    '''
+    Raised when a bulk like operation is malformed or refers to missing rows
+    '''
+    pass
+
+
+def apply_likes(operations):
+    '''
+    Function to apply many like/unlike operations in a single transaction
+
+    Operations on the same (profile_id, post_id) pair collapse to the last one,
+    since liking and unliking are idempotent. Post like counters are adjusted
+    only by the rows actually inserted or deleted, so the counts stay correct
+    when other requests like the same posts concurrently.
+    '''
+    final = {}
+    for operation in operations:
+        try:
+            pair = (int(operation['profile_id']), int(operation['post_id']))
+            action = operation.get('action', LIKE)
+        except (KeyError, TypeError, ValueError):
+            raise InvalidLikeOperation('Each operation needs a profile_id and a post_id')
+        if action not in (LIKE, UNLIKE):
+            raise InvalidLikeOperation('Unknown action: {}'.format(action))
+        final[pair] = action
+
+    if not final:
+        return {'liked': 0, 'unliked': 0, 'unchanged': 0}
+
+    profile_ids = {profile_id for profile_id, _ in final}
+    post_ids = {post_id for _, post_id in final}
+    known_profiles = {id for id, in Profile.visible().with_entities(Profile.id).filter(Profile.id.in_(profile_ids))}
+    known_posts = {id for id, in Post.visible().with_entities(Post.id).filter(Post.id.in_(post_ids))}
+    if profile_ids - known_profiles or post_ids - known_posts:
+        raise InvalidLikeOperation('Unknown profile ids {} or post ids {}'.format(
+            sorted(profile_ids - known_profiles), sorted(post_ids - known_posts)
+        ))
+
+    insert = insert_ignore(Like.__table__)
+    deltas = defaultdict(int)
+    liked = unliked = 0
+    try:
+        # A fixed row order keeps concurrent bulk requests from deadlocking
+        for (profile_id, post_id), action in sorted(final.items()):
+            if action == LIKE:
+                changed = db.session.execute(insert.values(profile_id=profile_id, post_id=post_id)).rowcount
+                liked += changed
+                deltas[post_id] += changed
+            else:
+                changed = Like.query.filter_by(
+                    profile_id=profile_id, post_id=post_id
+                ).delete(synchronize_session=False)
+                unliked += changed
+                deltas[post_id] -= changed
+
+        for post_id, delta in sorted(deltas.items()):
+            increment(Post, post_id, like_count=delta)
+            record_activity(post_id, delta)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return {'liked': liked, 'unliked': unliked, 'unchanged': len(final) - liked - unliked}
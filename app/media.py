@@ -0,0 +1,340 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.utils import import_string
+from . import db
+
+
+class InvalidUpload(ValueError):
+    '''
+    Raised when an upload chunk does not fit the upload it is sent to
+    '''
+    def __init__(self, message, offset=None):
+        super().__init__(message)
+        self.offset = offset
+
+
+class StorageBackend:
+    '''
+    Interface every media storage backend implements
+
+    Files are stored under keys like "posts/12/original" and are read from
+    the spool on disk, so large files are never held in memory.
+    '''
+    def save(self, key, path, content_type):
+        '''
+        Stores the file at path and returns its public URL
+        '''
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def posters(self, key, content_type, sizes):
+        '''
+        Makes poster images of the stored video or audio at key for every variant size
+
+        Returns (name, url, width, height, size) tuples. Backends that
+        cannot decode video or audio make none.
+        '''
+        return []
+
+
+class LocalStorage(StorageBackend):
+    '''
+    Stores media in a local directory, for development and tests
+    '''
+    def __init__(self, root=None, base_url=None, **options):
+        self.root = os.path.abspath(root or 'media')
+        self.base_url = base_url or 'file://{}/'.format(self.root)
+
+    def save(self, key, path, content_type):
+        target = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(path, target)
+        return self.base_url + key
+
+    def delete(self, key):
+        try:
+            os.remove(os.path.join(self.root, key))
+        except FileNotFoundError:
+            pass
+
+
+class CloudinaryStorage(StorageBackend):
+    '''
+    Stores media on Cloudinary, configured through CLOUDINARY_URL
+    '''
+    resource_types = {'image': 'image', 'video': 'video', 'audio': 'video'}
+
+    def __init__(self, chunk_size=None, **options):
+        self.chunk_size = chunk_size or 20 * 1024 * 1024
+
+    def save(self, key, path, content_type):
+        import cloudinary.uploader
+        resource_type = self.resource_types.get((content_type or '').split('/')[0], 'raw')
+        result = cloudinary.uploader.upload_large(
+            path, public_id=key, resource_type=resource_type, chunk_size=self.chunk_size, overwrite=True
+        )
+        return result['secure_url']
+
+    def delete(self, key):
+        import cloudinary.uploader
+        cloudinary.uploader.destroy(key)
+
+    def posters(self, key, content_type, sizes):
+        # Eager transformations of the stored file: a frame Cloudinary picks
+        # for video, the waveform for audio
+        import cloudinary.uploader
+        if content_type.startswith('audio/'):
+            transformations = [
+                {'width': size, 'height': size // 4, 'crop': 'fit', 'flags': 'waveform', 'format': 'png'}
+                for _, size in sizes
+            ]
+        else:
+            transformations = [
+                {'width': size, 'height': size, 'crop': 'limit', 'start_offset': 'auto', 'format': 'jpg'}
+                for _, size in sizes
+            ]
+        result = cloudinary.uploader.explicit(key, type='upload', resource_type='video', eager=transformations)
+        return [
+            (name, eager['secure_url'], eager.get('width'), eager.get('height'), eager.get('bytes'))
+            for (name, _), eager in zip(sizes, result.get('eager', []))
+        ]
+
+
+class Spool:
+    '''
+    Local directory holding uploads while they are received and processed
+
+    Each upload is a "<id>.part" file growing chunk by chunk next to a
+    "<id>.json" file describing it, so an interrupted upload resumes at the
+    size of its part file, even from another worker process.
+    '''
+    def __init__(self, root, max_size, chunk_size):
+        self.root = root
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, upload_id, extension):
+        # Ids are generated here, anything else is rejected to keep paths inside the spool
+        if not upload_id or len(upload_id) != 32 or not upload_id.isalnum():
+            raise InvalidUpload('Unknown upload')
+        return os.path.join(self.root, '{}.{}'.format(upload_id, extension))
+
+    def create(self, size, content_type, filename=None):
+        if size <= 0 or size > self.max_size:
+            raise InvalidUpload('Uploads must be between 1 and {} bytes'.format(self.max_size))
+        upload_id = uuid.uuid4().hex
+        with open(self._path(upload_id, 'json'), 'w') as handle:
+            json.dump({'size': size, 'content_type': content_type, 'filename': filename}, handle)
+        open(self._path(upload_id, 'part'), 'wb').close()
+        return upload_id
+
+    def describe(self, upload_id):
+        try:
+            with open(self._path(upload_id, 'json')) as handle:
+                upload = json.load(handle)
+            upload['offset'] = os.path.getsize(self._path(upload_id, 'part'))
+        except FileNotFoundError:
+            raise InvalidUpload('Unknown upload')
+        upload['id'] = upload_id
+        upload['complete'] = upload['offset'] == upload['size']
+        return upload
+
+    def write(self, upload_id, stream, start, length):
+        '''
+        Appends a chunk read from stream at start, returning the new offset
+        '''
+        upload = self.describe(upload_id)
+        if start != upload['offset']:
+            raise InvalidUpload('Expected the chunk starting at byte {}'.format(upload['offset']), upload['offset'])
+        if start + length > upload['size']:
+            raise InvalidUpload('Chunk runs past the end of the upload', upload['offset'])
+
+        remaining = length
+        with open(self._path(upload_id, 'part'), 'r+b') as handle:
+            handle.seek(start)
+            while remaining:
+                data = stream.read(min(self.chunk_size, remaining))
+                if not data:
+                    break
+                handle.write(data)
+                remaining -= len(data)
+            # Drop whatever a broken chunk wrote so the client resends it whole
+            if remaining:
+                handle.truncate(start)
+        if remaining:
+            raise InvalidUpload('Chunk ended early', start)
+        return start + length
+
+    def path(self, upload_id):
+        return self._path(upload_id, 'part')
+
+    def discard(self, upload_id):
+        for extension in ('part', 'json'):
+            try:
+                os.remove(self._path(upload_id, extension))
+            except FileNotFoundError:
+                pass
+
+
+def variant_sizes(spec):
+    '''
+    Function to parse MEDIA_VARIANTS, "thumbnail:320,medium:1080"
+    '''
+    sizes = []
+    for item in spec.split(','):
+        if item.strip():
+            name, size = item.split(':')
+            sizes.append((name.strip(), int(size)))
+    return sizes
+
+
+def image_variants(path, sizes, directory):
+    '''
+    Function to write a resized JPEG of an image for every variant size
+
+    Needs Pillow, listed in requirements.txt; without it no variants are
+    made and only the original is stored.
+    '''
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return []
+
+    variants = []
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        for name, size in sizes:
+            variant = image.copy()
+            variant.thumbnail((size, size))
+            target = os.path.join(directory, '{}.jpg'.format(name))
+            variant.save(target, 'JPEG', quality=85, optimize=True, progressive=True)
+            variants.append((name, target, variant.width, variant.height))
+    return variants
+
+
+class MediaPipeline:
+    '''
+    Stores spooled uploads and their variants in the background
+
+    With MEDIA_WORKERS set to 0 uploads are processed inline, which keeps
+    tests deterministic.
+    '''
+    def __init__(self, app):
+        config = app.config
+        self.app = app
+        self.spool = Spool(config['MEDIA_SPOOL_DIR'], config['MEDIA_MAX_UPLOAD'], config['MEDIA_CHUNK_SIZE'])
+        self.storage = import_string(config['MEDIA_STORAGE'])(root=config['MEDIA_ROOT'], base_url=config['MEDIA_URL'])
+        self.sizes = variant_sizes(config['MEDIA_VARIANTS'])
+        self.workers = config['MEDIA_WORKERS']
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='media') if self.workers else None
+        self._lock = threading.Lock()
+        self._queued = set()
+
+    def submit(self, post_id, upload_id):
+        with self._lock:
+            if post_id in self._queued:
+                return
+            self._queued.add(post_id)
+        if self._executor is None:
+            # Already inside the caller's app context and database session
+            self._run(self.process, post_id, upload_id)
+        else:
+            self._executor.submit(self._run, self._process_in_context, post_id, upload_id)
+
+    def _process_in_context(self, post_id, upload_id):
+        with self.app.app_context():
+            self.process(post_id, upload_id)
+
+    def _run(self, process, post_id, upload_id):
+        try:
+            process(post_id, upload_id)
+        except Exception:
+            self.app.logger.exception('Processing media of post %s failed', post_id)
+        finally:
+            with self._lock:
+                self._queued.discard(post_id)
+
+    def process(self, post_id, upload_id):
+        from .cache import invalidate
+        from .models import MediaStatus, MediaVariant, Post
+        post = Post.query.get(post_id)
+        if post is None:
+            self.spool.discard(upload_id)
+            return
+
+        upload = self.spool.describe(upload_id)
+        path = self.spool.path(upload_id)
+        workdir = '{}.variants'.format(path)
+        os.makedirs(workdir, exist_ok=True)
+        try:
+            prefix = 'posts/{}/'.format(post_id)
+            media = self.storage.save(prefix + 'original', path, upload['content_type'])
+            content_type = upload['content_type'] or ''
+            rows = []
+            if content_type.startswith('image/'):
+                for name, variant_path, width, height in image_variants(path, self.sizes, workdir):
+                    rows.append({
+                        'post_id': post_id,
+                        'name': name,
+                        'url': self.storage.save(prefix + name, variant_path, 'image/jpeg'),
+                        'width': width,
+                        'height': height,
+                        'size': os.path.getsize(variant_path)
+                    })
+            elif content_type.startswith(('video/', 'audio/')):
+                for name, url, width, height, size in self.storage.posters(prefix + 'original', content_type, self.sizes):
+                    rows.append({
+                        'post_id': post_id,
+                        'name': name,
+                        'url': url,
+                        'width': width,
+                        'height': height,
+                        'size': size
+                    })
+
+            MediaVariant.query.filter_by(post_id=post_id).delete(synchronize_session=False)
+            if rows:
+                db.session.execute(MediaVariant.__table__.insert(), rows)
+            post.media = media
+            post.media_status = MediaStatus.ready.value
+            post.media_upload = None
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            Post.query.filter_by(id=post_id).update({'media_status': MediaStatus.failed.value})
+            db.session.commit()
+            raise
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+            invalidate('post', post_id)
+        self.spool.discard(upload_id)
+
+
+def requeue_pending():
+    '''
+    Function to queue again the uploads of posts whose media was never stored
+    '''
+    from .models import MediaStatus, Post
+    pipeline = get_media_pipeline()
+    posts = Post.query.with_entities(Post.id, Post.media_upload).filter(
+        Post.media_status.in_([MediaStatus.pending.value, MediaStatus.failed.value]),
+        Post.media_upload.isnot(None)
+    ).all()
+    for post_id, upload_id in posts:
+        pipeline.submit(post_id, upload_id)
+    return len(posts)
+
+
+def get_media_pipeline():
+    pipeline = current_app.extensions.get('media_pipeline')
+    if pipeline is None:
+        pipeline = current_app.extensions.setdefault('media_pipeline', MediaPipeline(current_app._get_current_object()))
+    return pipeline
@@ -1,4 +1,6 @@
 from . import db, ma
+from .events import on_commit
+from .sql import increment, insert_ignore, touch
 from datetime import datetime
 import enum
 from marshmallow import fields as MarshmallowFields
@@ -19,6 +21,23 @@ class CategoryList(enum.Enum):
     contemporaryafrican = "contemporaryafrican"
     neoafrican = "neoafrican"
 
+class MediaStatus(enum.Enum):
+    '''
+    Model choices for the processing state of a post's media
+    '''
+    pending = "pending"
+    ready = "ready"
+    failed = "failed"
+
+class DeletionStatus(enum.Enum):
+    '''
+    Model choices for the progress of a background deletion
+    '''
+    pending = "pending"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
 class LicensingList(enum.Enum):
     '''
     Model choices for the post licensing
@@ -27,8 +46,10 @@ class LicensingList(enum.Enum):
 
 # Association Table for a Profile and its followers
 followers = db.Table('followers',
-    db.Column('follower_id', db.Integer, db.ForeignKey('profiles.id')),
-    db.Column('followed_id', db.Integer, db.ForeignKey('profiles.id'))
+    db.Column('follower_id', db.Integer, db.ForeignKey('profiles.id'), nullable=False),
+    db.Column('followed_id', db.Integer, db.ForeignKey('profiles.id'), nullable=False),
+    db.PrimaryKeyConstraint('follower_id', 'followed_id', name='pk_followers'),
+    db.Index('ix_followers_followed', 'followed_id', 'follower_id')
 )
 
 class Profile(db.Model):
@@ -47,6 +68,10 @@ class Profile(db.Model):
     is_verified = db.Column(db.Boolean, default=False, nullable=False)
     remember_token = db.Column(db.Boolean, default=False, nullable=False)
     join_date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    follower_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    following_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    pending_deletion = db.Column(db.Boolean, default=False, server_default=db.false(), nullable=False)
     posts = db.relationship('Post', backref='post_profile', lazy='dynamic')
     liker = db.relationship('Like', backref='liked_profile', lazy='dynamic')
     followed = db.relationship('Profile', secondary=followers, primaryjoin=(followers.c.follower_id == id), secondaryjoin=(followers.c.followed_id == id), backref=db.backref('followers', lazy='dynamic'), lazy='dynamic')
@@ -62,84 +87,148 @@ class Profile(db.Model):
         self.remember_token = remember_token
 
     def follow(self, profile):
+        from .autocomplete import count_followers
+        from .graph import record_follow
+        from .timeline import backfill
         if not self.is_following(profile):
             self.followed.append(profile)
+            db.session.flush()
+            increment(Profile, self.id, following_count=1)
+            increment(Profile, profile.id, follower_count=1)
+            backfill(self.id, profile.id)
+            on_commit(record_follow, self.id, profile.id)
+            on_commit(count_followers, profile.id, 1)
     
     def unfollow(self, profile):
+        from .autocomplete import count_followers
+        from .graph import record_unfollow
+        from .timeline import remove_author
         if self.is_following(profile):
             self.followed.remove(profile)
+            db.session.flush()
+            increment(Profile, self.id, following_count=-1)
+            increment(Profile, profile.id, follower_count=-1)
+            remove_author(self.id, profile.id)
+            on_commit(record_unfollow, self.id, profile.id)
+            on_commit(count_followers, profile.id, -1)
 
     def is_following(self, profile):
-        return self.followed.filter(
+        return db.session.query(self.followed.filter(
             followers.c.followed_id == profile.id
-        ).count() > 0
+        ).exists()).scalar()
 
     def like_post(self, post):
-        if not self.has_liked(post):
-            like = Like(profile_id=self.id, post_id=post.id)
-            db.session.add(like)
-            db.session.commit()
+        # The unique (profile_id, post_id) key makes a repeated like a no-op
+        inserted = db.session.execute(
+            insert_ignore(Like.__table__).values(profile_id=self.id, post_id=post.id)
+        ).rowcount
+        if inserted:
+            from .trending import record_activity
+            increment(Post, post.id, like_count=1)
+            record_activity(post.id, 1)
+        db.session.commit()
     
     def unlike_post(self, post):
-        if self.has_liked(post):
-            Like.query.filter_by(profile_id=self.id, post_id=post.id).delete()
-            db.session.commit()
+        deleted = Like.query.filter_by(
+            profile_id=self.id, post_id=post.id
+        ).delete(synchronize_session=False)
+        if deleted:
+            from .trending import record_activity
+            increment(Post, post.id, like_count=-1)
+            record_activity(post.id, -1)
+        db.session.commit()
     
     def has_liked(self, post):
-        return Like.query.filter(
+        return db.session.query(Like.query.filter(
             Like.profile_id == self.id,
             Like.post_id == post.id
-        ).count() > 0
+        ).exists()).scalar()
     
     def my_posts(self):
-        return Post.query.filter_by(profile_id == self.id).order_by(Post.timestamp.desc())
+        return Post.query.filter_by(profile_id=self.id).order_by(Post.timestamp.desc())
 
-    def timeline(self):
+    def timeline(self, limit, after=None):
         ''' My posts and others based on timestamps'''
-        followed = Post.query.join(
-            followers, (followers.c.followed_id == Post.profile_id).filter(
-                followers.c.follower_id == self.id
-            )
-        )
-        own = Post.query.filter_by(profile_id == self.id)
-        return followed.union(own).order_by(Post.timestamp.desc())
+        from .timeline import read_timeline
+        return read_timeline(self.id, limit, after)
 
     def save_profile(self):
+        from .autocomplete import autocomplete_profile
+        from .cache import invalidate
+        from .search import index_profile
+        created = self.id is None
+        self.updated_at = datetime.utcnow()
         db.session.add(self)
         db.session.commit()
+        invalidate('profile', self.id)
+        if not created:
+            # Posts embedding their author are cached with the profile in them
+            invalidate('post')
+        index_profile(self)
+        autocomplete_profile(self)
     
     def delete_profile(self):
-        db.session.delete(self)
-        db.session.commit()
+        '''
+        Hides the profile and its posts and queues their removal, returning the DeletionJob
+        '''
+        from .deletion import schedule
+        return schedule('profile', self.id)
 
-    def search_profile_name(self, search_text):
-        return Profile.query.filter(Profile.query.contains(search_text)).all()
+    @staticmethod
+    def visible():
+        return Profile.query.filter_by(pending_deletion=False)
+
+    @staticmethod
+    def search_profile_name(search_text, limit, offset=0):
+        from .search import search
+        return search(Profile, 'profiles', search_text, limit, offset)
 
     def reactivate_profile(self):
+        from .autocomplete import autocomplete_profile
+        from .cache import invalidate
+        from .search import index_profile
         self.is_active = True
         db.session.add(self)
         db.session.commit()
+        invalidate('profile', self.id)
+        invalidate('post')
+        index_profile(self)
+        autocomplete_profile(self)
     
-    def deactivate_profile():
+    def deactivate_profile(self):
+        from .autocomplete import autocomplete_profile
+        from .cache import invalidate
+        from .search import index_profile
         self.is_active = False
         db.session.add(self)
         db.session.commit()
+        invalidate('profile', self.id)
+        invalidate('post')
+        index_profile(self)
+        autocomplete_profile(self)
     
-    def verify_profile():
+    def verify_profile(self):
+        from .cache import invalidate
         self.is_verified = True
         db.session.add(self)
         db.session.commit()
+        invalidate('profile', self.id)
+        invalidate('post')
 
     def deverify_profile(self):
+        from .cache import invalidate
         self.is_verified = False
         db.session.add(self)
         db.session.commit()
+        invalidate('profile', self.id)
+        invalidate('post')
 
 
 # Schema definition for the Profile Model
 class ProfileSchema(ma.Schema):
     class Meta:
-        fields = ('username', 'country', 'facebook', 'twitter', 'google', 'is_active', 'is_verified', 'remember_token')
+        fields = ('username', 'country', 'facebook', 'twitter', 'google', 'is_active', 'is_verified', 'remember_token', 'follower_count', 'following_count', 'updated_at')
+        dump_only = ('follower_count', 'following_count', 'updated_at')
 
         id = MarshmallowFields.Integer(dump_only=True)
         join_date = MarshmallowFields.DateTime(dump_only=True)
@@ -148,7 +237,8 @@ class ProfileSchema(ma.Schema):
 # Association Table for posts and tags
 tags = db.Table('tags', 
     db.Column('tag_id', db.Integer, db.ForeignKey('posttags.id'), primary_key=True),
-    db.Column('post_id', db.Integer, db.ForeignKey('posts.id'), primary_key=True)
+    db.Column('post_id', db.Integer, db.ForeignKey('posts.id'), primary_key=True),
+    db.Index('ix_tags_post_id', 'post_id')
 )
 
 class Post(db.Model):
@@ -156,6 +246,16 @@ class Post(db.Model):
     Database model for posts
     '''
     __tablename__ = 'posts'
+    __table_args__ = (
+        db.Index('ix_posts_profile_timestamp', 'profile_id', 'timestamp', 'id'),
+        db.Index('ix_posts_timestamp', 'timestamp', 'id'),
+        db.Index('ix_posts_media_upload', 'media_upload', unique=True),
+        # Posts merged into timelines at read time, see app/timeline.py
+        db.Index(
+            'ix_posts_profile_unfanned', 'profile_id', 'timestamp', 'id',
+            sqlite_where=db.text('fanned_out = 0'), postgresql_where=db.text('fanned_out = false')
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     media = db.Column(db.String(), default='https://res.cloudinary.com/mutugiii/image/upload/v1602581553/headshot-silhouette-19_eresev.jpg', nullable=False)
@@ -166,9 +266,17 @@ class Post(db.Model):
     post_licensing = db.Column(db.String(255), default=LicensingList.creativecommons, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False) 
     profile_id = db.Column(db.Integer, db.ForeignKey('profiles.id'))
+    like_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    comment_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    media_status = db.Column(db.String(20), default=MediaStatus.ready.value, server_default=MediaStatus.ready.value, nullable=False)
+    media_upload = db.Column(db.String(32))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    pending_deletion = db.Column(db.Boolean, default=False, server_default=db.false(), nullable=False)
+    fanned_out = db.Column(db.Boolean, default=True, server_default=db.true(), nullable=False)
     comments = db.relationship('Comment', backref='comment_post', lazy='dynamic')
+    variants = db.relationship('MediaVariant', backref='variant_post', lazy='dynamic')
     liked = db.relationship('Like', backref='liked_post', lazy='dynamic')
-    tags = db.relationship('PostTag', secondary=tags, lazy='subquery', backref=db.backref('tagged_post', lazy=True))
+    tags = db.relationship('PostTag', secondary=tags, lazy='select', backref=db.backref('tagged_post', lazy=True))
 
     def __init__(self, media, post_name, post_type, post_location, post_category, post_licensing, profile_id):
         self.media = media
@@ -180,73 +288,169 @@ class Post(db.Model):
         self.profile_id = profile_id
 
     def save_post(self):
+        from .autocomplete import count_location
+        from .cache import invalidate
+        from .search import index_post
+        from .timeline import fan_out
+        from .trending import record_post
+        is_new = self.id is None
+        # Post counts of the locations moved from and to
+        history = db.inspect(self).attrs.post_location.history
+        for location in history.deleted:
+            on_commit(count_location, location, -1)
+        for location in history.added:
+            on_commit(count_location, location, 1)
+        self.updated_at = datetime.utcnow()
         db.session.add(self)
+        db.session.flush()
+        if is_new:
+            fan_out(self)
+        on_commit(record_post, self.id, self.post_category, self.post_type)
         db.session.commit()
+        invalidate('post', self.id)
+        index_post(self)
     
     def delete_post(self):
-        db.session.delete(self)
-        db.session.commit()
-
-    def search_by_post_name(self, search_text):
-        return Post.query.filter_by(post_name == search_text).all()
+        '''
+        Hides the post and queues its removal, returning the DeletionJob
+        '''
+        from .deletion import schedule
+        return schedule('post', self.id)
+
+    @staticmethod
+    def visible():
+        return Post.query.filter_by(pending_deletion=False)
+
+    @staticmethod
+    def search_by_post_name(search_text):
+        return Post.query.filter_by(post_name=search_text)
     
-    def search_by_post_type(self, search_text):
-        return Post.query.filter_by(post_type == search_text).all()
+    @staticmethod
+    def search_by_post_type(search_text):
+        return Post.query.filter_by(post_type=search_text)
 
-    def search_by_post_category(self, search_text):
-        return Post.query.filter_by(post_category == search_text).all()
+    @staticmethod
+    def search_by_post_category(search_text):
+        return Post.query.filter_by(post_category=search_text)
 
-    def search_by_post_location(self, search_text):
-        return Post.query.filter_by(post_location == search_text).all()
+    @staticmethod
+    def search_by_post_location(search_text):
+        return Post.query.filter_by(post_location=search_text)
 
-    def search_by_post_licensing(self, search_text):
-        return Post.query.filter_by(post_licensing == search_text).all()
+    @staticmethod
+    def search_by_post_licensing(search_text):
+        return Post.query.filter_by(post_licensing=search_text)
     
     def add_post_tag(self, tag):
+        from .autocomplete import count_tag
         if not self.has_tag(tag):
             self.tags.append(tag)
+            if tag.id is None:
+                tag.post_count = (tag.post_count or 0) + 1
+            else:
+                increment(PostTag, tag.id, post_count=1)
+                on_commit(count_tag, tag.id, 1)
+            self.updated_at = datetime.utcnow()
     
     def remove_post_tag(self, tag):
+        from .autocomplete import count_tag
         if self.has_tag(tag):
             self.tags.remove(tag)
+            increment(PostTag, tag.id, post_count=-1)
+            on_commit(count_tag, tag.id, -1)
+            self.updated_at = datetime.utcnow()
     
     def has_tag(self, tag):
-        return PostTag.query.filter(
-            PostTag.id == tag.id
-        )
+        return tag in self.tags
 
  # Schema definition for the Post Model
 class PostSchema(ma.Schema):
     class Meta:
-        fields = ('media', 'post_name', 'post_type', 'post_location', 'post_category', 'post_licensing', 'profile_id')
+        fields = ('media', 'post_name', 'post_type', 'post_location', 'post_category', 'post_licensing', 'profile_id', 'like_count', 'comment_count', 'media_status', 'updated_at')
+        dump_only = ('like_count', 'comment_count', 'media_status', 'updated_at')
 
         id = MarshmallowFields.Integer(dump_only=True)
         timestamp = MarshmallowFields.DateTime()
 
+class MediaVariant(db.Model):
+    '''
+    Database model for the resized copies of a post's media
+    '''
+    __tablename__ = 'media_variants'
+    __table_args__ = (
+        db.UniqueConstraint('post_id', 'name', name='uq_media_variants_post_name'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
+    name = db.Column(db.String(50), nullable=False)
+    url = db.Column(db.String(), nullable=False)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    size = db.Column(db.Integer)
+
+# Schema definition for the MediaVariant Model
+class MediaVariantSchema(ma.Schema):
+    class Meta:
+        fields = ('name', 'url', 'width', 'height', 'size')
+
+class TimelineEntry(db.Model):
+    '''
+    Database model for materialized home timeline entries
+    '''
+    __tablename__ = 'timeline_entries'
+    __table_args__ = (
+        db.Index('ix_timeline_entries_profile_timestamp', 'profile_id', 'timestamp', 'post_id'),
+        db.Index('ix_timeline_entries_profile_author', 'profile_id', 'author_id'),
+        db.Index('ix_timeline_entries_post_id', 'post_id'),
+    )
+
+    profile_id = db.Column(db.Integer, db.ForeignKey('profiles.id'), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), primary_key=True)
+    author_id = db.Column(db.Integer, db.ForeignKey('profiles.id'), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+
 class PostTag(db.Model):
     '''
     Database model for tags belonging to posts
     '''
     __tablename__ = 'posttags'
+    __table_args__ = (
+        db.UniqueConstraint('tag_text', name='uq_posttags_tag_text'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     tag_text = db.Column(db.String(255), nullable=False)
+    post_count = db.Column(db.Integer, default=0, server_default='0', nullable=False, index=True)
 
     def __init__(self, tag_text):
-        self.tag_text = tag_text
+        from .tags import normalize_tag
+        self.tag_text = normalize_tag(tag_text)
 
     def save_tag(self):
         db.session.add(self)
         db.session.commit()
 
     def delete_tag(self):
+        from .autocomplete import forget
+        from .cache import invalidate
+        from .search import index_posts
+        from .tags import forget_tags
+        post_ids = [id for id, in db.session.query(tags.c.post_id).filter(tags.c.tag_id == self.id)]
+        db.session.execute(tags.delete().where(tags.c.tag_id == self.id))
+        touch(Post, post_ids)
         db.session.delete(self)
+        on_commit(forget_tags, [self.tag_text])
+        on_commit(forget, 'tags', self.id)
         db.session.commit()
+        invalidate('post', *post_ids)
+        index_posts(post_ids)
 
 # Schema definition for the PostTag Model
 class PostTagSchema(ma.Schema):
     id = MarshmallowFields.Integer(dump_only=True)
     tag_text = MarshmallowFields.String(required=True)
+    post_count = MarshmallowFields.Integer(dump_only=True)
 
 
 class Comment(db.Model):
@@ -254,23 +458,41 @@ class Comment(db.Model):
     Database model for comments
     '''
     __tablename__ = 'comments'
+    __table_args__ = (
+        db.Index('ix_comments_post_timestamp', 'post_id', 'timestamp', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     comment = db.Column(db.String(255), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False) 
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
     def __init__(self, comment, post_id):
         self.comment = comment
         self.post_id = post_id
 
     def save_comment(self):
+        from .cache import invalidate
+        from .trending import record_activity
+        if self.id is None and self.post_id is not None:
+            increment(Post, self.post_id, comment_count=1)
+            record_activity(self.post_id, 0, 1)
+        self.updated_at = datetime.utcnow()
         db.session.add(self)
         db.session.commit()
+        invalidate('post', self.post_id)
     
     def delete_comment(self):
+        from .cache import invalidate
+        from .trending import record_activity
+        post_id = self.post_id
+        if post_id is not None:
+            increment(Post, post_id, comment_count=-1)
+            record_activity(post_id, 0, -1)
         db.session.delete(self)
         db.session.commit()
+        invalidate('post', post_id)
 
 
 # Schema definition for the Comment Model
@@ -286,6 +508,10 @@ class Like(db.Model):
     Database model for likes
     '''
     __tablename__ = 'likes'
+    __table_args__ = (
+        db.UniqueConstraint('profile_id', 'post_id', name='uq_likes_profile_post'),
+        db.Index('ix_likes_post_id', 'post_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     profile_id = db.Column(db.Integer, db.ForeignKey('profiles.id'))
@@ -293,4 +519,59 @@ class Like(db.Model):
 
     def __init__(self, profile_id, post_id):
         self.profile_id = profile_id
-        self.post_id = post_id
\ No newline at end of file
+        self.post_id = post_id
+
+class DeletionJob(db.Model):
+    '''
+    Database model for the progress of background cascade deletions
+    '''
+    __tablename__ = 'deletion_jobs'
+    __table_args__ = (
+        db.UniqueConstraint('entity', 'entity_id', name='uq_deletion_jobs_entity'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), default=DeletionStatus.pending.value, nullable=False)
+    step = db.Column(db.String(50))
+    rows_deleted = db.Column(db.Integer, default=0, nullable=False)
+    error = db.Column(db.String())
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime)
+
+    def __init__(self, entity, entity_id):
+        self.entity = entity
+        self.entity_id = entity_id
+
+# Schema definition for the DeletionJob Model
+class DeletionJobSchema(ma.Schema):
+    class Meta:
+        fields = ('id', 'entity', 'entity_id', 'status', 'step', 'rows_deleted', 'error', 'created_at', 'updated_at', 'finished_at')
+
+class TrendingActivity(db.Model):
+    '''
+    Database model for the likes and comments trending scores are derived from
+
+    Rows are written with the likes and comments themselves and replayed by
+    every worker process. They have no foreign key as they are pruned by
+    age, deleted posts included.
+    '''
+    __tablename__ = 'trending_activity'
+
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, nullable=False)
+    weight = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+class ImportCheckpoint(db.Model):
+    '''
+    Database model for the progress of bulk imports, used to resume them
+    '''
+    __tablename__ = 'import_checkpoints'
+
+    source = db.Column(db.String(1024), primary_key=True)
+    entity = db.Column(db.String(64), nullable=False)
+    rows_done = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
@@ -0,0 +1,120 @@
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import or_
+from . import db
+from .autocomplete import autocomplete_profiles
+from .cache import invalidate
+from .models import Profile
+from .search import index_profiles
+
+# Profile flag and value set by each moderation action
+ACTIONS = {
+    'activate': ('is_active', True),
+    'deactivate': ('is_active', False),
+    'verify': ('is_verified', True),
+    'deverify': ('is_verified', False)
+}
+
+
+class InvalidModeration(ValueError):
+    '''
+    Raised when a bulk moderation request selects no profiles or is malformed
+    '''
+    pass
+
+
+def _date(value, name):
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        raise InvalidModeration('{} must be an ISO 8601 date'.format(name))
+
+
+def selection(data):
+    '''
+    Function to turn the ids, usernames and filter of a request into query criteria
+
+    ids and usernames select profiles directly, either one matching is
+    enough. filter narrows on country, joined_after, joined_before,
+    is_active and is_verified; every filter given must match.
+    '''
+    if not isinstance(data, dict):
+        raise InvalidModeration('No input data provided')
+
+    chosen = []
+    ids = data.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list) or any(isinstance(id, bool) for id in ids):
+            raise InvalidModeration('ids must be a list of profile ids')
+        try:
+            chosen.append(Profile.id.in_({int(id) for id in ids}))
+        except (TypeError, ValueError):
+            raise InvalidModeration('ids must be a list of profile ids')
+    usernames = data.get('usernames')
+    if usernames is not None:
+        if not isinstance(usernames, list):
+            raise InvalidModeration('usernames must be a list')
+        chosen.append(Profile.username.in_({str(username) for username in usernames}))
+    criteria = [or_(*chosen)] if chosen else []
+
+    filter = data.get('filter') or {}
+    if not isinstance(filter, dict):
+        raise InvalidModeration('filter must be an object')
+    for key, value in filter.items():
+        if key == 'country':
+            criteria.append(Profile.country == value)
+        elif key == 'joined_after':
+            criteria.append(Profile.join_date >= _date(value, key))
+        elif key == 'joined_before':
+            criteria.append(Profile.join_date < _date(value, key))
+        elif key in ('is_active', 'is_verified'):
+            if not isinstance(value, bool):
+                raise InvalidModeration('{} must be true or false'.format(key))
+            criteria.append(getattr(Profile, key) == value)
+        else:
+            raise InvalidModeration('Unknown filter {}'.format(key))
+
+    # An empty selection would change every profile
+    if not criteria:
+        raise InvalidModeration('Provide ids, usernames or a filter')
+    return criteria
+
+
+def moderate(action, criteria):
+    '''
+    Function to set a moderation flag on every selected profile
+
+    The profiles needing the change are updated MODERATION_CHUNK_SIZE at a
+    time, each chunk in one UPDATE and its own short transaction, so a large
+    selection never holds many row locks for long. Returns how many
+    profiles were selected and how many of them changed.
+    '''
+    column, value = ACTIONS[action]
+    flag = getattr(Profile, column)
+    matched = db.session.query(db.func.count(Profile.id)).filter(*criteria).scalar()
+
+    size = current_app.config['MODERATION_CHUNK_SIZE']
+    updated = 0
+    last_id = 0
+    while True:
+        # Each chunk starts after the last id of the previous one
+        chunk = [id for id, in db.session.query(Profile.id).filter(
+            Profile.id > last_id, flag != value, *criteria
+        ).order_by(Profile.id).limit(size)]
+        if not chunk:
+            break
+        last_id = chunk[-1]
+        # Rows changed by someone else meanwhile are skipped by the flag check
+        updated += Profile.query.filter(Profile.id.in_(chunk), flag != value).update(
+            {flag: value, Profile.updated_at: datetime.utcnow()}, synchronize_session=False
+        )
+        db.session.commit()
+        invalidate('profile', *chunk)
+        if column == 'is_active':
+            index_profiles(chunk)
+            autocomplete_profiles(chunk)
+
+    if updated:
+        # Posts embedding their author are cached with the profile in them
+        invalidate('post')
+    return {'matched': matched, 'updated': updated}
@@ -0,0 +1,101 @@
+import base64
+import json
+from datetime import datetime
+from flask import current_app, request
+from sqlalchemy import and_, or_, true
+
+
+class InvalidCursor(ValueError):
+    '''
+    Raised when a client supplies a cursor that cannot be decoded
+    '''
+    pass
+
+
+def _encode(value):
+    raw = json.dumps(value, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+
+
+def encode_cursor(timestamp, id):
+    '''
+    Function to build an opaque cursor from a (timestamp, id) sort key
+    '''
+    return _encode([timestamp.isoformat(), id])
+
+
+def decode_cursor(cursor):
+    '''
+    Function to turn an opaque cursor back into its (timestamp, id) sort key
+    '''
+    try:
+        timestamp, id = _decode(cursor)
+        return datetime.fromisoformat(timestamp), int(id)
+    except (TypeError, ValueError, UnicodeError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def encode_offset_cursor(offset):
+    '''
+    Function to build an opaque cursor for lists that are ranked, not sorted
+    '''
+    return _encode({'offset': offset})
+
+
+def decode_offset_cursor(cursor):
+    '''
+    Function to turn an opaque ranked-list cursor back into its offset
+    '''
+    try:
+        offset = int(_decode(cursor)['offset'])
+    except (KeyError, TypeError, ValueError, UnicodeError):
+        raise InvalidCursor('Invalid cursor')
+    if offset < 0:
+        raise InvalidCursor('Invalid cursor')
+    return offset
+
+
+def page_args(decode=decode_cursor):
+    '''
+    Function to read the limit/after query params of a list request
+    '''
+    limit = request.args.get('limit', current_app.config['PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['MAX_PAGE_SIZE']))
+    after = request.args.get('after')
+    return limit, decode(after) if after else None
+
+
+def keyset_filter(timestamp_column, id_column, after):
+    '''
+    Function to build the clause selecting rows that sort after a cursor key
+    '''
+    if after is None:
+        return true()
+    timestamp, id = after
+    return or_(
+        timestamp_column < timestamp,
+        and_(timestamp_column == timestamp, id_column < id)
+    )
+
+
+def paginate(query, timestamp_column, id_column, limit, after=None):
+    '''
+    Function to fetch one page of a query ordered newest first on (timestamp, id)
+
+    Returns the page of rows and the cursor for the next page, or None when
+    this is the last page.
+    '''
+    rows = query.filter(
+        keyset_filter(timestamp_column, id_column, after)
+    ).order_by(timestamp_column.desc(), id_column.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(getattr(last, timestamp_column.key), getattr(last, id_column.key))
+    return rows[:limit], next_cursor
@@ -0,0 +1,74 @@
+import threading
+import time
+
+
+class Refresher:
+    '''
+    Keeps an in-process index built from the database fresh without stalling requests
+
+    The first get() builds the index, concurrent callers waiting for that one
+    build. Once it is older than interval seconds (0 never refreshes), the
+    next get() starts a rebuild in a background thread and every caller
+    keeps the old index until the new one is swapped in.
+
+    Edits made through apply() reach the current index at once and are
+    replayed on an index being built, as the rows it reads may predate them.
+    '''
+    def __init__(self, app, build, interval, name='refresh'):
+        self.app = app
+        self.build = build
+        self.interval = interval
+        self.name = name
+        self.current = None
+        self.built_at = None
+        self._building = threading.Lock()
+        self._edits = threading.Lock()
+        self._journal = None
+
+    def get(self):
+        if self.current is None:
+            with self._building:
+                if self.current is None:
+                    self._rebuild()
+        elif self.interval and time.monotonic() - self.built_at > self.interval:
+            # Only one thread refreshes, the others carry on with the old index
+            if self._building.acquire(blocking=False):
+                threading.Thread(target=self._refresh, name=self.name, daemon=True).start()
+        return self.current
+
+    def apply(self, edit):
+        '''
+        Runs edit on the current index and on any index being built
+        '''
+        with self._edits:
+            if self.current is not None:
+                edit(self.current)
+            if self._journal is not None:
+                self._journal.append(edit)
+
+    def _rebuild(self):
+        with self._edits:
+            self._journal = []
+        try:
+            index = self.build()
+        except Exception:
+            with self._edits:
+                self._journal = None
+            raise
+        with self._edits:
+            for edit in self._journal:
+                edit(index)
+            self._journal = None
+            self.current = index
+            self.built_at = time.monotonic()
+
+    def _refresh(self):
+        try:
+            with self.app.app_context():
+                self._rebuild()
+        except Exception:
+            self.app.logger.exception('Refreshing %s failed', self.name)
+            # Keep serving the old index and try again after another interval
+            self.built_at = time.monotonic()
+        finally:
+            self._building.release()
@@ -0,0 +1,350 @@
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter
+from flask import current_app
+from sqlalchemy.orm import selectinload
+from werkzeug.utils import import_string
+from .refresh import Refresher
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+# Weight of a query term matched exactly, as a prefix, or within a typo
+EXACT_MATCH = 1.0
+PREFIX_MATCH = 0.6
+FUZZY_MATCH = 0.4
+
+# Bounds on how many index terms a single query term may expand to
+MAX_EXPANSIONS = 50
+
+
+def tokenize(text):
+    '''
+    Function to split text into lowercase, accent-free search terms
+    '''
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return _WORD.findall(text.lower())
+
+
+def edit_distance(left, right, limit):
+    '''
+    Function to compute the Levenshtein distance, giving up past a limit
+    '''
+    if abs(len(left) - len(right)) > limit:
+        return limit + 1
+    previous = list(range(len(right) + 1))
+    for i, left_char in enumerate(left, 1):
+        current = [i]
+        for j, right_char in enumerate(right, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (left_char != right_char)
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class SearchBackend:
+    '''
+    Interface every search backend implements
+
+    Documents are identified by integer ids and made of named text fields,
+    each carrying a relevance weight given when the backend is created.
+    '''
+    def __init__(self, field_weights):
+        self.field_weights = field_weights
+
+    def index(self, doc_id, fields):
+        raise NotImplementedError
+
+    def remove(self, doc_id):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def search(self, query, limit, offset=0):
+        '''
+        Returns up to limit (doc_id, score) pairs best first, skipping offset
+        '''
+        raise NotImplementedError
+
+
+class MemoryBackend(SearchBackend):
+    '''
+    Pure-Python in-process inverted index ranked with BM25
+    '''
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, field_weights):
+        super().__init__(field_weights)
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._postings = {}
+            self._terms = []
+            self._documents = {}
+            self._total_length = 0.0
+
+    def index(self, doc_id, fields):
+        frequencies = Counter()
+        for field, text in fields.items():
+            weight = self.field_weights.get(field, 1.0)
+            for term in tokenize(text):
+                frequencies[term] += weight
+
+        with self._lock:
+            self._remove(doc_id)
+            for term, frequency in frequencies.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                    insort(self._terms, term)
+                postings[doc_id] = frequency
+            length = sum(frequencies.values())
+            self._documents[doc_id] = (frequencies, length)
+            self._total_length += length
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        document = self._documents.pop(doc_id, None)
+        if document is None:
+            return
+        frequencies, length = document
+        self._total_length -= length
+        for term in frequencies:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+                del self._terms[bisect_left(self._terms, term)]
+
+    def _expand(self, token):
+        '''
+        Index terms matching a query token, with the weight of each match
+        '''
+        matches = {}
+        if token in self._postings:
+            matches[token] = EXACT_MATCH
+
+        start = bisect_left(self._terms, token)
+        for term in self._terms[start:start + MAX_EXPANSIONS]:
+            if not term.startswith(token):
+                break
+            matches.setdefault(term, PREFIX_MATCH)
+
+        # Typos are only looked for among terms sharing the first letter
+        limit = 1 if len(token) < 8 else 2
+        if len(token) >= 4:
+            start = bisect_left(self._terms, token[0])
+            end = bisect_left(self._terms, chr(ord(token[0]) + 1))
+            fuzzy = 0
+            for term in self._terms[start:end]:
+                if term not in matches and edit_distance(token, term, limit) <= limit:
+                    matches[term] = FUZZY_MATCH
+                    fuzzy += 1
+                    if fuzzy >= MAX_EXPANSIONS:
+                        break
+        return matches
+
+    def search(self, query, limit, offset=0):
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+
+        with self._lock:
+            total = len(self._documents)
+            if not total:
+                return []
+            average_length = self._total_length / total
+
+            scores = None
+            for token in tokens:
+                expansions = self._expand(token)
+                # One idf for everything the token matched, so a rare
+                # prefix or typo match can't outrank the exact term
+                matched = len(set().union(*(self._postings[term] for term in expansions)))
+                idf = math.log(1 + (total - matched + 0.5) / (matched + 0.5))
+
+                token_scores = {}
+                for term, match_weight in expansions.items():
+                    postings = self._postings[term]
+                    for doc_id, frequency in postings.items():
+                        length = self._documents[doc_id][1]
+                        bm25 = idf * frequency * (self.k1 + 1) / (
+                            frequency + self.k1 * (1 - self.b + self.b * length / average_length)
+                        )
+                        token_scores[doc_id] = max(token_scores.get(doc_id, 0), match_weight * bm25)
+
+                # Every query token has to match the document
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {
+                        doc_id: score + token_scores[doc_id]
+                        for doc_id, score in scores.items() if doc_id in token_scores
+                    }
+                if not scores:
+                    return []
+
+        ranked = heapq.nsmallest(offset + limit, scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[offset:]
+
+
+def post_document(post):
+    return {
+        'post_name': post.post_name,
+        'post_location': post.post_location,
+        'post_category': post.post_category,
+        'tags': ' '.join(tag.tag_text for tag in post.tags)
+    }
+
+
+def profile_document(profile):
+    return {
+        'username': profile.username,
+        'country': profile.country
+    }
+
+
+def _in_batches(query, model, batch_size=1000):
+    last_id = 0
+    while True:
+        rows = query.filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+        if not rows:
+            return
+        for row in rows:
+            yield row
+        last_id = rows[-1].id
+
+
+def _build_posts(backend):
+    from .models import Post
+    for post in _in_batches(Post.visible().options(selectinload(Post.tags)), Post):
+        backend.index(post.id, post_document(post))
+
+
+def _build_profiles(backend):
+    from .models import Profile
+    for profile in _in_batches(Profile.visible().filter_by(is_active=True), Profile):
+        backend.index(profile.id, profile_document(profile))
+
+
+# Name of each index, the weights of its fields and how to build it
+indexes = {
+    'posts': ({'post_name': 3.0, 'tags': 2.0, 'post_location': 1.5, 'post_category': 1.0}, _build_posts),
+    'profiles': ({'username': 3.0, 'country': 1.0}, _build_profiles)
+}
+
+
+def _builder(name, backend_class):
+    field_weights, build = indexes[name]
+
+    def build_index():
+        backend = backend_class(field_weights)
+        build(backend)
+        return backend
+    return build_index
+
+
+def get_search_index(name):
+    '''
+    Function to get one of the application's search indexes, building it when needed
+
+    Indexes are rebuilt from the database in the background every
+    SEARCH_REFRESH seconds so changes made through other worker processes
+    show up too.
+    '''
+    state = current_app.extensions.setdefault('search', {})
+    refresher = state.get(name)
+    if refresher is None:
+        build = _builder(name, import_string(current_app.config['SEARCH_BACKEND']))
+        refresher = state.setdefault(name, Refresher(
+            current_app._get_current_object(), build, current_app.config['SEARCH_REFRESH'], 'search-' + name
+        ))
+    return refresher.get()
+
+
+def _loaded_index(name):
+    return current_app.extensions.get('search', {}).get(name)
+
+
+def _index(refresher, doc_id, document):
+    refresher.apply(lambda backend: backend.index(doc_id, document))
+
+
+def _remove(refresher, doc_id):
+    refresher.apply(lambda backend: backend.remove(doc_id))
+
+
+def index_post(post):
+    refresher = _loaded_index('posts')
+    if refresher is not None:
+        _index(refresher, post.id, post_document(post))
+
+
+def index_posts(post_ids):
+    from .models import Post
+    refresher = _loaded_index('posts')
+    if refresher is not None and post_ids:
+        for post in Post.visible().options(selectinload(Post.tags)).filter(Post.id.in_(list(post_ids))):
+            _index(refresher, post.id, post_document(post))
+
+
+def index_profile(profile):
+    refresher = _loaded_index('profiles')
+    if refresher is not None:
+        if profile.is_active and not profile.pending_deletion:
+            _index(refresher, profile.id, profile_document(profile))
+        else:
+            _remove(refresher, profile.id)
+
+
+def index_profiles(profile_ids):
+    '''
+    Function to bring many profiles up to date in the search index at once
+    '''
+    from .models import Profile
+    refresher = _loaded_index('profiles')
+    if refresher is not None and profile_ids:
+        rows = Profile.query.with_entities(
+            Profile.id, Profile.username, Profile.country, Profile.is_active, Profile.pending_deletion
+        ).filter(
+            Profile.id.in_(list(profile_ids))
+        )
+        for profile in rows:
+            if profile.is_active and not profile.pending_deletion:
+                _index(refresher, profile.id, profile_document(profile))
+            else:
+                _remove(refresher, profile.id)
+
+
+def unindex(name, doc_id):
+    refresher = _loaded_index(name)
+    if refresher is not None:
+        _remove(refresher, doc_id)
+
+
+def search(model, name, query, limit, offset=0):
+    '''
+    Function to run a ranked search and load the matching rows in rank order
+    '''
+    ranked = get_search_index(name).search(query, limit, offset)
+    ids = [doc_id for doc_id, _ in ranked]
+    rows = {row.id: row for row in model.visible().filter(model.id.in_(ids))} if ids else {}
+    return [rows[id] for id in ids if id in rows]
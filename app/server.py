@@ -0,0 +1,70 @@
+import runpy
+from sqlalchemy.pool import QueuePool
+from . import db
+
+
+def _engines(app):
+    return [db.get_engine(app, bind) for bind in [None] + list(app.config['SQLALCHEMY_BINDS'])]
+
+
+def dispose_engines(app):
+    '''
+    Function to drop every pooled connection of the app's engines
+
+    Called after a fork so workers never share the sockets of the connections
+    their parent opened.
+    '''
+    with app.app_context():
+        for engine in _engines(app):
+            engine.dispose()
+
+
+def warm_up(app, connections=0):
+    '''
+    Function to fill the in-process caches and open pool connections before serving
+
+    The follower graph, search and autocomplete indexes and trending scores are built once
+    in the preloaded parent and shared with the workers forked from it;
+    connections are only opened by the workers themselves.
+    '''
+    from .autocomplete import get_autocomplete, indexes as autocomplete_indexes
+    from .graph import get_follower_graph
+    from .search import get_search_index, indexes
+    from .trending import load_trending
+
+    with app.app_context():
+        get_follower_graph()
+        for name in indexes:
+            get_search_index(name)
+        for name in autocomplete_indexes:
+            get_autocomplete(name)
+        load_trending()
+        for engine in _engines(app):
+            if not isinstance(engine.pool, QueuePool):
+                continue
+            opened = [engine.connect() for _ in range(min(connections, engine.pool.size()))]
+            for connection in opened:
+                connection.close()
+
+
+def serve(config_file='gunicorn.conf.py', **overrides):
+    '''
+    Function to run the production app under gunicorn with the settings of config_file
+
+    overrides take precedence over the file, None values are ignored.
+    '''
+    from gunicorn.app.base import BaseApplication
+
+    class ProductionServer(BaseApplication):
+        def load_config(self):
+            settings = runpy.run_path(config_file)
+            settings.update((key, value) for key, value in overrides.items() if value is not None)
+            for key, value in settings.items():
+                if key in self.cfg.settings and value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            from wsgi import app
+            return app
+
+    ProductionServer().run()
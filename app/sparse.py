@@ -0,0 +1,61 @@
+from functools import lru_cache
+from flask import request
+from sqlalchemy.orm import load_only
+
+
+class InvalidFields(ValueError):
+    '''
+    Raised when ?fields= or ?include= names something a resource does not have
+    '''
+    pass
+
+
+def _names(param):
+    return [name.strip() for name in request.args.get(param, '').split(',') if name.strip()]
+
+
+def sparse_args(schema_class, includes=()):
+    '''
+    Function to read the ?fields= and ?include= params of a request
+
+    Returns the requested fields, or None for all of them, and the requested
+    relationships, both as sorted tuples so they can key caches.
+    '''
+    fields = _names('fields')
+    include = _names('include')
+    known = schema_class.Meta.fields
+    unknown = [name for name in fields if name not in known] + [name for name in include if name not in includes]
+    if unknown:
+        raise InvalidFields('Unknown fields: {}'.format(', '.join(unknown)))
+    return (tuple(sorted(set(fields))) or None), tuple(sorted(set(include)))
+
+
+@lru_cache(maxsize=256)
+def sparse_schema(schema_class, fields=None, many=False):
+    '''
+    Function to get a schema dumping only the given fields
+
+    Instances are shared so each field set is compiled for fast dumps once.
+    '''
+    return schema_class(only=fields, many=many)
+
+
+def project(data, fields):
+    '''
+    Function to narrow an already dumped object to the given fields
+    '''
+    if data is None or not fields:
+        return data
+    return {name: value for name, value in data.items() if name in fields}
+
+
+def columns_option(model, fields, *required):
+    '''
+    Function to build a load_only option selecting just the fields dumped
+
+    required lists columns the query needs besides them, such as the ones
+    it is paginated on. The primary key is always loaded.
+    '''
+    if not fields:
+        return None
+    return load_only(*[getattr(model, name) for name in dict.fromkeys(fields + required)])
@@ -0,0 +1,41 @@
+from datetime import datetime
+from . import db
+
+
+def insert_ignore(table):
+    '''
+    Function to build an INSERT that silently skips rows violating a unique key
+
+    Its rowcount is the number of rows actually inserted, so 1 or 0 for a
+    single row depending on whether it already existed.
+    '''
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    if dialect == 'mysql':
+        return table.insert().prefix_with('IGNORE')
+    raise NotImplementedError('insert_ignore is not supported on ' + dialect)
+
+
+def increment(model, id, **deltas):
+    '''
+    Function to atomically add to counter columns of one row
+
+    The addition happens in the UPDATE itself so concurrent writers never
+    overwrite each other's changes.
+    '''
+    deltas = {getattr(model, name): getattr(model, name) + delta for name, delta in deltas.items() if delta}
+    if deltas:
+        model.query.filter(model.id == id).update(deltas, synchronize_session=False)
+
+
+def touch(model, ids):
+    '''
+    Function to bump updated_at on rows changed without writing any of their columns
+    '''
+    ids = sorted(set(ids))
+    if ids:
+        model.query.filter(model.id.in_(ids)).update({model.updated_at: datetime.utcnow()}, synchronize_session=False)
@@ -0,0 +1,49 @@
+import json
+from flask import Response, current_app, request, stream_with_context
+from .serializers import columns_for, dump
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def wants_ndjson():
+    '''
+    Function to check whether the client asked for a streamed NDJSON export
+    '''
+    best = request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def stream_ndjson(query, schema, batch_size=None):
+    '''
+    Function to stream every row of a query as newline delimited JSON
+
+    Rows are read in batches through a server-side cursor where the driver
+    supports one, so only a single batch is held in memory at a time. Only
+    the columns the schema dumps are selected, as plain rows rather than ORM
+    objects.
+    '''
+    batch_size = batch_size or current_app.config['STREAM_BATCH_SIZE']
+    model = query.column_descriptions[0]['entity']
+    rows = query.with_entities(*columns_for(schema, model)).execution_options(
+        stream_results=True
+    ).yield_per(batch_size)
+
+    def encode(batch):
+        return ''.join(
+            json.dumps(item, separators=(',', ':')) + '\n' for item in dump(schema, batch)
+        )
+
+    def generate():
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield encode(batch)
+                batch = []
+        if batch:
+            yield encode(batch)
+
+    response = Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+    # Ask proxies to pass each batch straight through instead of buffering
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,164 @@
+import threading
+import time
+import unicodedata
+from flask import current_app
+from sqlalchemy import and_, func, select
+from . import db
+from .autocomplete import autocomplete_tags
+from .cache import invalidate
+from .events import on_commit
+from .search import index_posts
+from .models import Post, PostTag, tags
+from .sql import increment, insert_ignore, touch
+
+# Rows per multi-row INSERT, kept under the bound parameter limits of SQLite
+INSERT_CHUNK = 400
+
+
+def normalize_tag(text):
+    '''
+    Function to bring a tag to its canonical form: "#Lamu  Town " -> "lamu town"
+    '''
+    text = unicodedata.normalize('NFKC', str(text)).strip().lstrip('#')
+    return ' '.join(text.lower().split())
+
+
+class TagDictionary:
+    '''
+    In-process cache of interned tag strings to their posttags ids
+
+    The whole cache is dropped every TAG_CACHE_TTL seconds so tags deleted
+    through other worker processes are forgotten too.
+    '''
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._ids = {}
+        self._lock = threading.Lock()
+        self._cleared_at = time.monotonic()
+
+    def _expire(self):
+        if time.monotonic() - self._cleared_at > self.ttl:
+            self._ids = {}
+            self._cleared_at = time.monotonic()
+
+    def intern(self, texts):
+        '''
+        Returns the id of each tag text, creating the rows that are missing
+        '''
+        texts = {text: normalize_tag(text) for text in texts}
+        with self._lock:
+            self._expire()
+            missing = {tag for tag in texts.values() if tag and tag not in self._ids}
+            ids = {tag: self._ids[tag] for tag in texts.values() if tag in self._ids}
+
+        if missing:
+            missing = sorted(missing)
+            table = PostTag.__table__
+            for start in range(0, len(missing), INSERT_CHUNK):
+                chunk = missing[start:start + INSERT_CHUNK]
+                db.session.execute(insert_ignore(table).values([{'tag_text': tag, 'post_count': 0} for tag in chunk]))
+                found = dict(db.session.query(PostTag.tag_text, PostTag.id).filter(PostTag.tag_text.in_(chunk)))
+                ids.update(found)
+                # Rows created in this transaction are only cached once it commits
+                on_commit(self.remember, found)
+
+        return {text: ids[tag] for text, tag in texts.items() if tag}
+
+    def remember(self, ids):
+        with self._lock:
+            self._ids.update(ids)
+
+    def forget(self, tag_texts):
+        with self._lock:
+            for text in tag_texts:
+                self._ids.pop(text, None)
+
+
+def get_tag_dictionary():
+    return current_app.extensions.setdefault(
+        'tag_dictionary', TagDictionary(current_app.config['TAG_CACHE_TTL'])
+    )
+
+
+def forget_tags(tag_texts):
+    dictionary = current_app.extensions.get('tag_dictionary')
+    if dictionary is not None:
+        dictionary.forget(tag_texts)
+
+
+def recount(tag_ids):
+    '''
+    Function to recompute the post counts of the given tags from their links
+
+    Links are counted with one subquery per tag, so this is kept for
+    repairing counts that drifted; link and unlink keep them up to date.
+    '''
+    posttags = PostTag.__table__
+    tag_ids = sorted(set(tag_ids))
+    for start in range(0, len(tag_ids), INSERT_CHUNK):
+        db.session.execute(posttags.update().where(
+            posttags.c.id.in_(tag_ids[start:start + INSERT_CHUNK])
+        ).values(
+            post_count=select([func.count()]).where(tags.c.tag_id == posttags.c.id).as_scalar()
+        ))
+
+
+def link(pairs):
+    '''
+    Function to link (post_id, tag_id) pairs, skipping ones already linked
+    '''
+    post_ids = {}
+    for post_id, tag_id in pairs:
+        post_ids.setdefault(tag_id, set()).add(post_id)
+
+    # One INSERT per tag so its rowcount is the number of posts newly tagged
+    for tag_id in sorted(post_ids):
+        tagged = sorted(post_ids[tag_id])
+        for start in range(0, len(tagged), INSERT_CHUNK):
+            added = db.session.execute(insert_ignore(tags).values([
+                {'post_id': post_id, 'tag_id': tag_id} for post_id in tagged[start:start + INSERT_CHUNK]
+            ])).rowcount
+            increment(PostTag, tag_id, post_count=added)
+
+
+def unlink(post_ids, tag_ids):
+    '''
+    Function to remove every link between the given posts and tags
+    '''
+    post_ids = sorted(set(post_ids))
+    for tag_id in sorted(set(tag_ids)):
+        for start in range(0, len(post_ids), INSERT_CHUNK):
+            removed = db.session.execute(tags.delete().where(and_(
+                tags.c.tag_id == tag_id,
+                tags.c.post_id.in_(post_ids[start:start + INSERT_CHUNK])
+            ))).rowcount
+            increment(PostTag, tag_id, post_count=-removed)
+
+
+def attach_tags(post_ids, tag_texts):
+    '''
+    Function to tag many posts with many tags at once
+    '''
+    tag_ids = set(get_tag_dictionary().intern(tag_texts).values())
+    link((post_id, tag_id) for post_id in post_ids for tag_id in tag_ids)
+    touch(Post, post_ids)
+    db.session.commit()
+    invalidate('post', *post_ids)
+    index_posts(post_ids)
+    autocomplete_tags(tag_ids)
+
+
+def detach_tags(post_ids, tag_texts):
+    '''
+    Function to remove many tags from many posts at once
+    '''
+    tag_ids = [id for id, in db.session.query(PostTag.id).filter(
+        PostTag.tag_text.in_({normalize_tag(text) for text in tag_texts})
+    )]
+    if tag_ids and post_ids:
+        unlink(post_ids, tag_ids)
+        touch(Post, post_ids)
+    db.session.commit()
+    invalidate('post', *post_ids)
+    index_posts(post_ids)
+    autocomplete_tags(tag_ids)
@@ -0,0 +1,120 @@
+import heapq
+from flask import current_app
+from sqlalchemy import and_, exists, false, literal, select, true
+from . import db
+from .models import Post, Profile, TimelineEntry, followers
+from .pagination import encode_cursor, keyset_filter
+
+
+def is_celebrity(profile_id):
+    '''
+    Function to check whether a profile has too many followers to fan out to
+    '''
+    count = db.session.query(Profile.follower_count).filter(Profile.id == profile_id).scalar()
+    return (count or 0) >= current_app.config['TIMELINE_FANOUT_LIMIT']
+
+
+def fan_out(post):
+    '''
+    Function to push a new post into its author's and its followers' timelines
+    '''
+    if post.profile_id is None:
+        return
+
+    entries = TimelineEntry.__table__
+    db.session.execute(entries.insert().values(
+        profile_id=post.profile_id,
+        post_id=post.id,
+        author_id=post.profile_id,
+        timestamp=post.timestamp
+    ))
+
+    # Celebrity posts are merged in at read time instead, for good: the flag
+    # and not the author's current follower count decides where a post is read
+    if is_celebrity(post.profile_id):
+        post.fanned_out = False
+        return
+
+    fan_out_rows = select([
+        followers.c.follower_id,
+        literal(post.id),
+        literal(post.profile_id),
+        literal(post.timestamp, db.DateTime)
+    ]).where(and_(
+        followers.c.followed_id == post.profile_id,
+        followers.c.follower_id != post.profile_id
+    ))
+    db.session.execute(entries.insert().from_select(
+        ['profile_id', 'post_id', 'author_id', 'timestamp'], fan_out_rows
+    ))
+
+
+def backfill(follower_id, followed_id):
+    '''
+    Function to copy a newly followed profile's recent posts into a timeline
+
+    Only posts that were fanned out are copied, the others are merged in
+    when the timeline is read.
+    '''
+    entries = TimelineEntry.__table__
+    recent = select([
+        literal(follower_id),
+        Post.id,
+        Post.profile_id,
+        Post.timestamp
+    ]).where(and_(
+        Post.profile_id == followed_id,
+        Post.fanned_out == true(),
+        ~exists().where(and_(
+            entries.c.profile_id == follower_id,
+            entries.c.post_id == Post.id
+        ))
+    )).order_by(Post.timestamp.desc()).limit(current_app.config['TIMELINE_BACKFILL_SIZE'])
+    db.session.execute(entries.insert().from_select(
+        ['profile_id', 'post_id', 'author_id', 'timestamp'], recent.alias('recent').select()
+    ))
+
+
+def remove_author(follower_id, followed_id):
+    '''
+    Function to drop an unfollowed profile's posts from a timeline
+    '''
+    TimelineEntry.query.filter_by(
+        profile_id=follower_id, author_id=followed_id
+    ).delete(synchronize_session=False)
+
+
+def read_timeline(profile_id, limit, after=None):
+    '''
+    Function to read one page of a home timeline, newest first
+
+    Materialized entries are merged with the posts of followed profiles
+    that were not fanned out. Returns the page of posts and the cursor for
+    the next page, or None when this is the last page.
+    '''
+    materialized = db.session.query(TimelineEntry.timestamp, TimelineEntry.post_id).filter(
+        TimelineEntry.profile_id == profile_id,
+        keyset_filter(TimelineEntry.timestamp, TimelineEntry.post_id, after)
+    ).order_by(TimelineEntry.timestamp.desc(), TimelineEntry.post_id.desc()).limit(limit + 1)
+
+    celebrity_posts = db.session.query(Post.timestamp, Post.id).join(
+        followers, followers.c.followed_id == Post.profile_id
+    ).filter(
+        followers.c.follower_id == profile_id,
+        Post.fanned_out == false(),
+        keyset_filter(Post.timestamp, Post.id, after)
+    ).order_by(Post.timestamp.desc(), Post.id.desc()).limit(limit + 1)
+
+    keys = []
+    seen = set()
+    for key in heapq.merge(map(tuple, materialized), map(tuple, celebrity_posts), reverse=True):
+        if key[1] not in seen:
+            seen.add(key[1])
+            keys.append(key)
+        if len(keys) > limit:
+            break
+
+    next_cursor = encode_cursor(*keys[limit - 1]) if len(keys) > limit else None
+    ids = [id for _, id in keys[:limit]]
+    posts = {post.id: post for post in Post.visible().filter(Post.id.in_(ids))} if ids else {}
+    return [posts[id] for id in ids if id in posts], next_cursor
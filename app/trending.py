@@ -0,0 +1,388 @@
+import heapq
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from flask import current_app
+from . import db
+from .models import CategoryList, MediaList, Post, TrendingActivity
+
+# Rankings kept besides the overall one, by post_category and post_type
+DIMENSIONS = (
+    ('category', tuple(category.value for category in CategoryList)),
+    ('media', tuple(media.value for media in MediaList))
+)
+
+# Scores are stored growing with time since the epoch instead of decaying,
+# and rebased when the growth factor gets this large
+_REBASE_AFTER = 50.0
+
+# Activity rows are read this many at a time, and taken to be committed
+# once they are this many seconds old
+_REPLAY_SIZE = 5000
+_SETTLE = 60
+
+_start_lock = threading.Lock()
+
+
+def _choice(value):
+    # Enum defaults end up stored as their name, such as CategoryList.neoafrican
+    value = getattr(value, 'value', value)
+    return str(value).rpartition('.')[2] if value is not None else None
+
+
+class TrendingEngine:
+    '''
+    In-process time-decayed activity scores of posts, and their best ranked posts
+
+    A like or comment adds its weight to a post's score, which then halves
+    every half_life seconds. As every score decays at the same rate, they are
+    stored scaled by exp(t / tau) from a shared epoch: an event only adds to
+    one number and the order of untouched scores never changes. refresh()
+    rebuilds the bounded top lists of each category and media type, which
+    reads then page through.
+
+    Activity comes from the trending_activity table through replay(), so
+    every worker process holding an engine ranks the same likes and
+    comments. last_activity is the id up to which every row was applied.
+    '''
+    def __init__(self, half_life, size, min_score=0.01):
+        self.tau = half_life / math.log(2)
+        self.size = size
+        self.min_score = min_score
+        self._lock = threading.Lock()
+        self._epoch = time.time()
+        self._scores = {}
+        self._meta = {}
+        self._unknown = set()
+        self._top = {}
+        self._applied = set()
+        self.last_activity = 0
+        self.dirty = True
+        self.loaded = False
+
+    def _growth(self, now):
+        return math.exp((now - self._epoch) / self.tau)
+
+    def _add(self, post_id, weight, now):
+        scaled = self._scores.get(post_id, 0.0) + weight * self._growth(now)
+        self._scores[post_id] = max(scaled, 0.0)
+        if post_id not in self._meta:
+            self._unknown.add(post_id)
+        self.dirty = True
+
+    def record(self, post_id, weight, now=None):
+        with self._lock:
+            self._add(post_id, weight, time.time() if now is None else now)
+
+    def replay(self, rows, settled):
+        '''
+        Adds (id, post_id, weight, timestamp) activity rows, ordered by id, not added yet
+
+        Ids are handed out before rows commit, so a row may show up after
+        rows with larger ids. last_activity only moves past rows created
+        before settled, the ids applied above it are remembered instead.
+        '''
+        with self._lock:
+            moving = True
+            for id, post_id, weight, at in rows:
+                if id > self.last_activity and id not in self._applied:
+                    self._add(post_id, weight, at)
+                    self._applied.add(id)
+                moving = moving and at < settled
+                if moving:
+                    self.last_activity = max(self.last_activity, id)
+            self._applied = {id for id in self._applied if id > self.last_activity}
+
+    def describe(self, post_id, category, media):
+        with self._lock:
+            if post_id in self._scores:
+                self._meta[post_id] = (_choice(category), _choice(media))
+                self._unknown.discard(post_id)
+                self.dirty = True
+
+    def discard(self, post_id):
+        with self._lock:
+            self._scores.pop(post_id, None)
+            self._meta.pop(post_id, None)
+            self._unknown.discard(post_id)
+            self.dirty = True
+
+    def unknown(self):
+        with self._lock:
+            return list(self._unknown)
+
+    def load(self, scores, epoch, last_activity, applied=()):
+        '''
+        Replaces every score with (post_id, scaled score, category, media) rows
+
+        The scores hold the activity rows up to last_activity and the ones
+        with the applied ids above it.
+        '''
+        with self._lock:
+            self._epoch = epoch
+            self.last_activity = last_activity
+            self._applied = set(applied)
+            self._scores = {post_id: score for post_id, score, _, _ in scores}
+            self._meta = {
+                post_id: (_choice(category), _choice(media))
+                for post_id, _, category, media in scores if category is not None
+            }
+            self._unknown = set(self._scores) - set(self._meta)
+            self.dirty = True
+            self.loaded = True
+
+    def refresh(self, now=None):
+        '''
+        Drops scores that decayed away and rebuilds every top list
+        '''
+        now = time.time() if now is None else now
+        with self._lock:
+            growth = self._growth(now)
+            if math.log(growth) > _REBASE_AFTER:
+                self._scores = {post_id: score / growth for post_id, score in self._scores.items()}
+                self._epoch = now
+                growth = 1.0
+            floor = self.min_score * growth
+            self._scores = {post_id: score for post_id, score in self._scores.items() if score >= floor}
+            self._meta = {post_id: meta for post_id, meta in self._meta.items() if post_id in self._scores}
+            scores = dict(self._scores)
+            meta = dict(self._meta)
+            self.dirty = False
+
+        rank = lambda ids: tuple(
+            (post_id, scores[post_id] / growth)
+            for post_id in heapq.nlargest(self.size, ids, key=lambda post_id: (scores[post_id], -post_id))
+        )
+        top = {(None, None): rank(scores)}
+        for index, (name, choices) in enumerate(DIMENSIONS):
+            for choice in choices:
+                top[(name, choice)] = rank(post_id for post_id, values in meta.items() if values[index] == choice)
+        self._top = top
+
+    def top(self, dimension=None, choice=None, offset=0, limit=20):
+        '''
+        Returns a page of (post_id, score) pairs of a top list, best first
+
+        Scores are as of the last refresh.
+        '''
+        return list(self._top.get((dimension, choice), ())[offset:offset + limit])
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'epoch': self._epoch,
+                'last_activity': self.last_activity,
+                'applied': sorted(self._applied),
+                'scores': [
+                    [post_id, score] + list(self._meta.get(post_id, (None, None)))
+                    for post_id, score in self._scores.items()
+                ]
+            }
+
+
+def _horizon(engine):
+    # Seconds after which activity scores too little to keep, twice as long
+    # as a single event takes to decay away
+    return engine.tau * math.log(1 / engine.min_score) * 2
+
+
+def _timestamp(at):
+    return at.replace(tzinfo=timezone.utc).timestamp()
+
+
+def replay(engine):
+    '''
+    Function to add the likes and comments recorded since the engine last read them
+    '''
+    settled = time.time() - _SETTLE
+    after = engine.last_activity
+    while True:
+        rows = db.session.query(
+            TrendingActivity.id, TrendingActivity.post_id, TrendingActivity.weight, TrendingActivity.created_at
+        ).filter(TrendingActivity.id > after).order_by(TrendingActivity.id).limit(_REPLAY_SIZE).all()
+        engine.replay([(id, post_id, weight, _timestamp(at)) for id, post_id, weight, at in rows], settled)
+        if len(rows) < _REPLAY_SIZE:
+            return
+        after = rows[-1][0]
+
+
+def prune_activity(engine):
+    '''
+    Function to delete the activity rows too old to count any more
+    '''
+    before = datetime.utcfromtimestamp(time.time() - _horizon(engine))
+    TrendingActivity.query.filter(TrendingActivity.created_at < before).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def _load_meta(engine):
+    post_ids = engine.unknown()
+    for start in range(0, len(post_ids), 500):
+        for post_id, category, media in db.session.query(Post.id, Post.post_category, Post.post_type).filter(
+            Post.id.in_(post_ids[start:start + 500])
+        ):
+            engine.describe(post_id, category, media)
+
+
+def seed(engine):
+    '''
+    Function to estimate scores from the like and comment counters of recent posts
+
+    Used when there is no snapshot to start from. Activity is taken to have
+    happened when the post was made, so only posts young enough to still
+    score are read. The counters already hold the activity rows recorded so
+    far, which are not replayed.
+    '''
+    config = current_app.config
+    now = time.time()
+    last_activity = db.session.query(db.func.max(TrendingActivity.id)).scalar() or 0
+    since = datetime.utcfromtimestamp(now - _horizon(engine))
+    rows = db.session.query(
+        Post.id, Post.timestamp, Post.like_count, Post.comment_count, Post.post_category, Post.post_type
+    ).filter(Post.timestamp >= since).yield_per(10000)
+
+    scores = []
+    for post_id, timestamp, likes, comments, category, media in rows:
+        weight = likes * config['TRENDING_LIKE_WEIGHT'] + comments * config['TRENDING_COMMENT_WEIGHT']
+        if weight > 0:
+            age = now - _timestamp(timestamp)
+            scores.append((post_id, weight * math.exp(-age / engine.tau), category, media))
+    engine.load(scores, now, last_activity)
+
+
+def save_snapshot(engine, path):
+    '''
+    Function to write the scores to a JSON file, replacing it atomically
+    '''
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    partial = '{}.{}.part'.format(path, os.getpid())
+    with open(partial, 'w') as handle:
+        json.dump(engine.snapshot(), handle)
+    os.replace(partial, path)
+
+
+def load_snapshot(engine, path):
+    '''
+    Function to load scores written by save_snapshot, False when there is none
+
+    Activity recorded after the snapshot was taken is replayed on the next
+    tick, so the snapshot of any worker will do.
+    '''
+    try:
+        with open(path) as handle:
+            snapshot = json.load(handle)
+        engine.load([tuple(row) for row in snapshot['scores']], snapshot['epoch'], snapshot['last_activity'], snapshot['applied'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+    return True
+
+
+def tick(engine):
+    '''
+    Function to add new activity, describe newly scored posts and rebuild the top lists
+    '''
+    replay(engine)
+    if engine.dirty:
+        _load_meta(engine)
+        engine.refresh()
+
+
+class Ticker(threading.Thread):
+    '''
+    Background thread refreshing the top lists, saving snapshots and pruning old activity
+    '''
+    def __init__(self, app, engine):
+        super().__init__(name='trending', daemon=True)
+        self.app = app
+        self.engine = engine
+        self.pid = os.getpid()
+
+    def run(self):
+        config = self.app.config
+        saved_at = time.monotonic()
+        while True:
+            time.sleep(config['TRENDING_TICK'])
+            try:
+                with self.app.app_context():
+                    tick(self.engine)
+                    if time.monotonic() - saved_at >= config['TRENDING_SNAPSHOT_INTERVAL']:
+                        if config['TRENDING_SNAPSHOT']:
+                            save_snapshot(self.engine, config['TRENDING_SNAPSHOT'])
+                        prune_activity(self.engine)
+                        saved_at = time.monotonic()
+            except Exception:
+                self.app.logger.exception('Refreshing trending posts failed')
+
+
+def load_trending():
+    '''
+    Function to get the application's trending engine, loading it when needed
+
+    Engines start from the last snapshot, or from the post counters without
+    one.
+    '''
+    config = current_app.config
+    engine = current_app.extensions.get('trending')
+    if engine is None:
+        engine = current_app.extensions.setdefault('trending', TrendingEngine(
+            config['TRENDING_HALF_LIFE'], config['TRENDING_SIZE']
+        ))
+    with _start_lock:
+        if not engine.loaded:
+            if not (config['TRENDING_SNAPSHOT'] and load_snapshot(engine, config['TRENDING_SNAPSHOT'])):
+                seed(engine)
+            tick(engine)
+    return engine
+
+
+def get_trending():
+    '''
+    Function to get the loaded trending engine with its ticker running
+
+    Each worker process runs its own ticker, replaying the activity every
+    worker records. With TRENDING_TICK 0 the reads replay it instead.
+    '''
+    config = current_app.config
+    engine = load_trending()
+    if not config['TRENDING_TICK']:
+        tick(engine)
+        return engine
+
+    with _start_lock:
+        ticker = current_app.extensions.get('trending_ticker')
+        # Threads do not survive a fork, so forked workers start their own
+        if ticker is None or ticker.pid != os.getpid():
+            ticker = current_app.extensions['trending_ticker'] = Ticker(current_app._get_current_object(), engine)
+            ticker.start()
+    return engine
+
+
+def record_activity(post_id, likes=0, comments=0):
+    '''
+    Function to add likes and comments, or remove them with negative counts, to a post's score
+
+    The activity is written in the current transaction, and reaches the
+    scores of every worker process once committed.
+    '''
+    config = current_app.config
+    weight = likes * config['TRENDING_LIKE_WEIGHT'] + comments * config['TRENDING_COMMENT_WEIGHT']
+    if weight:
+        db.session.execute(TrendingActivity.__table__.insert().values(
+            post_id=post_id, weight=weight, created_at=datetime.utcnow()
+        ))
+
+
+def record_post(post_id, category, media):
+    engine = current_app.extensions.get('trending')
+    if engine is not None:
+        engine.describe(post_id, category, media)
+
+
+def forget_post(post_id):
+    engine = current_app.extensions.get('trending')
+    if engine is not None:
+        engine.discard(post_id)
@@ -0,0 +1,189 @@
+'''
+Seeded generator of realistic data sets for the benchmarks
+
+Follower counts, post activity, tag use and post popularity all follow
+power laws, so a few profiles and posts get most of the traffic as they do
+in production. The same seed and scale always produce the same rows.
+'''
+import itertools
+import random
+from datetime import datetime, timedelta
+
+# Profiles per named scale. Each profile brings about 45 rows in total
+# across follows, posts, tags, comments and likes
+SCALES = {
+    '10k': 220,
+    '100k': 2200,
+    '1m': 22000,
+    '10m': 220000
+}
+
+WORDS = (
+    'lamu', 'maasai', 'kente', 'nairobi', 'swahili', 'zanzibar', 'timbuktu', 'benin', 'bronze', 'axum',
+    'kilwa', 'ndebele', 'adinkra', 'makonde', 'mombasa', 'kikuyu', 'yoruba', 'sahel', 'savanna', 'dhow',
+    'baobab', 'afrobeat', 'mural', 'portrait', 'archive', 'market', 'coast', 'highlands', 'heritage', 'textile'
+)
+COUNTRIES = ('Kenya', 'Nigeria', 'Ghana', 'Ethiopia', 'Senegal', 'Tanzania', 'Uganda', 'Rwanda', 'Egypt', 'Mali')
+LOCATIONS = ('Nairobi', 'Lagos', 'Accra', 'Addis Ababa', 'Dakar', 'Zanzibar', 'Kampala', 'Kigali', 'Cairo', 'Bamako')
+
+CHUNK = 5000
+
+
+class Popularity:
+    '''
+    Zipf distribution over ids, with ranks shuffled so popular ids are spread out
+    '''
+    def __init__(self, rng, ids, exponent=1.1):
+        self.ids = list(ids)
+        rng.shuffle(self.ids)
+        self.cum_weights = list(itertools.accumulate(1.0 / (rank + 1) ** exponent for rank in range(len(self.ids))))
+
+    def sample(self, rng, count):
+        if not self.ids:
+            return set()
+        count = min(count, len(self.ids))
+        chosen = set()
+        # Redraw a few times rather than exactly, popular ids repeat a lot
+        for _ in range(4):
+            chosen.update(rng.choices(self.ids, cum_weights=self.cum_weights, k=count - len(chosen)))
+            if len(chosen) >= count:
+                break
+        return chosen
+
+
+def _heavy_tail(rng, mean, cap):
+    '''
+    Draws a count from a Pareto distribution with roughly the given mean
+    '''
+    return min(int(mean * 0.5 * rng.paretovariate(2.0)), cap)
+
+
+def generate(profiles, seed=1, start=None):
+    '''
+    Yields (table name, rows) chunks describing a whole data set
+
+    Ids are assigned here, so tables are filled in dependency order and
+    counters and timelines are left to be rebuilt afterwards.
+    '''
+    from app.models import CategoryList, LicensingList, MediaList
+
+    rng = random.Random(seed)
+    start = start or datetime(2020, 1, 1)
+    span = 365 * 24 * 3600
+
+    def chunked(table, rows):
+        while True:
+            chunk = list(itertools.islice(rows, CHUNK))
+            if not chunk:
+                return
+            yield table, chunk
+
+    yield from chunked('profiles', ({
+        'id': id,
+        'username': 'user{}'.format(id),
+        'country': rng.choice(COUNTRIES),
+        'facebook': 'user{}'.format(id) if rng.random() < 0.3 else None,
+        'twitter': 'user{}'.format(id) if rng.random() < 0.3 else None,
+        'google': None,
+        'is_active': rng.random() > 0.02,
+        'is_verified': rng.random() < 0.05,
+        'remember_token': False,
+        'join_date': start + timedelta(seconds=rng.randrange(span)),
+        'follower_count': 0,
+        'following_count': 0
+    } for id in range(1, profiles + 1)))
+
+    # Power law follower graph: a few celebrities are followed by many
+    famous = Popularity(rng, range(1, profiles + 1))
+
+    def follows():
+        for follower_id in range(1, profiles + 1):
+            for followed_id in sorted(famous.sample(rng, _heavy_tail(rng, 8, profiles - 1))):
+                if followed_id != follower_id:
+                    yield {'follower_id': follower_id, 'followed_id': followed_id}
+    yield from chunked('followers', follows())
+
+    categories = [category.value for category in CategoryList]
+    media_types = [media.value for media in MediaList]
+    licensing = [licence.value for licence in LicensingList]
+    post_counts = [_heavy_tail(rng, 4, 500) for _ in range(profiles)]
+    total_posts = sum(post_counts)
+
+    def posts():
+        id = 0
+        for profile_id, count in enumerate(post_counts, 1):
+            for _ in range(count):
+                id += 1
+                yield {
+                    'id': id,
+                    'media': 'https://example.com/media/{}.jpg'.format(id),
+                    'post_name': 'post{}'.format(id),
+                    'post_type': rng.choice(media_types),
+                    'post_location': rng.choice(LOCATIONS),
+                    'post_category': rng.choice(categories),
+                    'post_licensing': rng.choice(licensing),
+                    'timestamp': start + timedelta(seconds=rng.randrange(span)),
+                    'profile_id': profile_id,
+                    'like_count': 0,
+                    'comment_count': 0
+                }
+    yield from chunked('posts', posts())
+
+    vocabulary = list(WORDS) + ['{}{}'.format(rng.choice(WORDS), id) for id in range(max(total_posts // 20, 1))]
+    yield from chunked('posttags', (
+        {'id': id, 'tag_text': text, 'post_count': 0} for id, text in enumerate(vocabulary, 1)
+    ))
+
+    tag_use = Popularity(rng, range(1, len(vocabulary) + 1))
+    yield from chunked('tags', (
+        {'post_id': post_id, 'tag_id': tag_id}
+        for post_id in range(1, total_posts + 1)
+        for tag_id in sorted(tag_use.sample(rng, rng.randint(0, 4)))
+    ))
+
+    hot_posts = Popularity(rng, range(1, total_posts + 1))
+
+    def comments():
+        for post_id in sorted(hot_posts.sample(rng, total_posts // 2)):
+            for _ in range(_heavy_tail(rng, 4, 200)):
+                yield {
+                    'comment': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 12))),
+                    'timestamp': start + timedelta(seconds=rng.randrange(span)),
+                    'post_id': post_id
+                }
+    yield from chunked('comments', comments())
+
+    def likes():
+        for profile_id in range(1, profiles + 1):
+            for post_id in sorted(hot_posts.sample(rng, _heavy_tail(rng, 16, 1000))):
+                yield {'profile_id': profile_id, 'post_id': post_id}
+    yield from chunked('likes', likes())
+
+
+def seed(profiles, seed=1, echo=print):
+    '''
+    Function to fill an empty database with a generated data set
+    '''
+    from app import db
+    from app.importer import rebuild_counters, rebuild_timelines
+
+    tables = db.Model.metadata.tables
+    counts = {}
+    for table, rows in generate(profiles, seed):
+        db.session.execute(tables[table].insert(), rows)
+        db.session.commit()
+        counts[table] = counts.get(table, 0) + len(rows)
+
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        # Ids were given explicitly, so move the sequences past them
+        for table in ('profiles', 'posts', 'posttags'):
+            connection.execute("SELECT setval(pg_get_serial_sequence('{0}', 'id'), MAX(id)) FROM {0}".format(table))
+        db.session.commit()
+
+    rebuild_counters()
+    rebuild_timelines()
+    echo('Seeded {} rows: {}'.format(
+        sum(counts.values()), ', '.join('{} {}'.format(count, table) for table, count in counts.items())
+    ))
+    return counts
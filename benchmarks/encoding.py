@@ -0,0 +1,95 @@
+'''
+Compares response encoders and compression on profile and post list pages
+
+    python -m benchmarks.encoding --page-sizes 20 100 1000
+
+Encoders and codings whose optional package (orjson, msgpack, brotli) is not
+installed are skipped.
+'''
+import argparse
+import gzip
+import json
+import os
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('CLOUDINARY_URL', 'cloudinary://benchmark')
+
+from app import create_app, db
+from app.encoding import brotli, dumps_json, dumps_msgpack, msgpack, orjson
+from app.models import Post, PostSchema, Profile, ProfileSchema
+from app.serializers import compile_dump
+from benchmarks.serializers import seed, timed
+
+
+def encoders():
+    # flask_restful's own output_json is the baseline
+    found = [('json', lambda data: (json.dumps(data) + '\n').encode('utf-8'))]
+    found.append(('json compact', lambda data: json.dumps(data, separators=(',', ':')).encode('utf-8')))
+    if orjson is not None:
+        found.append(('orjson', dumps_json))
+    if msgpack is not None:
+        found.append(('msgpack', dumps_msgpack))
+    return found
+
+
+def codings(config):
+    found = [('gzip', lambda body: gzip.compress(body, compresslevel=config['COMPRESSION_LEVEL']))]
+    if brotli is not None:
+        found.append(('br', lambda body: brotli.compress(body, quality=config['BROTLI_QUALITY'])))
+    return found
+
+
+def run(config, page_sizes, repeat):
+    results = []
+    for model, schema in ((Profile, ProfileSchema(many=True)), (Post, PostSchema(many=True))):
+        dump_one = compile_dump(schema)
+        for page_size in page_sizes:
+            # Shaped like the list pages the resources return
+            page = {
+                'success': True,
+                'data': [dump_one(obj) for obj in model.query.limit(page_size)],
+                'next_cursor': 'MjAyMC0wMS0wMVQwMDowMDowMHwxMDA='
+            }
+            for name, encode in encoders():
+                encode_s, body = timed(lambda: encode(page), repeat)
+                result = {
+                    'schema': type(schema).__name__,
+                    'page_size': page_size,
+                    'encoder': name,
+                    'encode_ms': round(encode_s * 1000, 3),
+                    'bytes': len(body)
+                }
+                for coding, compress in codings(config):
+                    compress_s, compressed = timed(lambda: compress(body), repeat)
+                    result['{}_ms'.format(coding)] = round(compress_s * 1000, 3)
+                    result['{}_bytes'.format(coding)] = len(compressed)
+                results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--page-sizes', type=int, nargs='+', default=[20, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', dest='json_path', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        seed(max(args.page_sizes))
+        results = run(app.config, args.page_sizes, args.repeat)
+
+    for result in results:
+        compressed = '  '.join(
+            '{} {:>8}ms {:>8}B'.format(coding, result['{}_ms'.format(coding)], result['{}_bytes'.format(coding)])
+            for coding, _ in codings(app.config)
+        )
+        print('{schema:<14} {page_size:>5} rows  {encoder:<13} {encode_ms:>8}ms {bytes:>9}B  '.format(**result) + compressed)
+    if args.json_path:
+        with open(args.json_path, 'w') as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+'''
+Timed API scenarios run through the Flask test client on a generated data set
+
+    python -m benchmarks.load --scale 10k --database sqlite:////tmp/huc-bench.db
+    python -m benchmarks.load --scale 1m --database postgresql://localhost/huc_bench \\
+        --output results/1.4.json --compare results/1.3.json
+
+Reports p50/p95/p99 latency, queries per request and throughput for each
+scenario, and can save the results as JSON and compare them with a
+previous run to catch regressions.
+'''
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from .data import SCALES, WORDS
+
+
+def _timeline(rng, context):
+    return 'GET', '/api/v1/timeline/{}'.format(rng.randint(1, context['profiles'])), None
+
+
+def _profile_list(rng, context):
+    return 'GET', '/api/v1/profiles?limit=20', None
+
+
+def _profile(rng, context):
+    return 'GET', '/api/v1/profiles/{}'.format(rng.randint(1, context['profiles'])), None
+
+
+def _search(rng, context):
+    return 'GET', '/api/v1/search/posts?q={}'.format(rng.choice(WORDS)), None
+
+
+def _like(rng, context):
+    return 'POST', '/api/v1/likes', {'operations': [{
+        'profile_id': rng.randint(1, context['profiles']),
+        'post_id': rng.randint(1, context['posts']),
+        'action': rng.choice(('like', 'unlike'))
+    }]}
+
+
+def _follow(rng, context):
+    profile_id = rng.randint(1, context['profiles'])
+    return rng.choice(('POST', 'DELETE')), '/api/v1/follow/{}'.format(profile_id), {
+        'followed_id': rng.randint(1, context['profiles'])
+    }
+
+
+SCENARIOS = {
+    'timeline': _timeline,
+    'profile_list': _profile_list,
+    'profile': _profile,
+    'search': _search,
+    'like': _like,
+    'follow': _follow
+}
+
+
+def percentile(values, fraction):
+    '''
+    Nearest-rank percentile of a sorted list
+    '''
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))]
+
+
+class QueryCounter:
+    '''
+    Counts the statements an engine runs
+    '''
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def run_scenario(client, counter, build, requests, warmup, rng, context):
+    for _ in range(warmup):
+        method, url, body = build(rng, context)
+        client.open(url, method=method, json=body)
+
+    latencies = []
+    queries = errors = 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        method, url, body = build(rng, context)
+        counter.count = 0
+        request_started = time.perf_counter()
+        response = client.open(url, method=method, json=body)
+        latencies.append(time.perf_counter() - request_started)
+        queries += counter.count
+        if response.status_code >= 500:
+            errors += 1
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    milliseconds = lambda value: round(value * 1000, 3)
+    return {
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': milliseconds(percentile(latencies, 0.50)),
+        'p95_ms': milliseconds(percentile(latencies, 0.95)),
+        'p99_ms': milliseconds(percentile(latencies, 0.99)),
+        'mean_ms': milliseconds(sum(latencies) / len(latencies)),
+        'queries_per_request': round(queries / requests, 2),
+        'throughput_rps': round(requests / elapsed, 1)
+    }
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Lists the scenarios that got slower or run more queries than in the baseline
+    '''
+    regressions = []
+    for name, result in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append('{}: p95 {}ms -> {}ms'.format(name, before['p95_ms'], result['p95_ms']))
+        if result['queries_per_request'] > before['queries_per_request']:
+            regressions.append('{}: queries per request {} -> {}'.format(
+                name, before['queries_per_request'], result['queries_per_request']
+            ))
+    return regressions
+
+
+def _revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='sqlite:////tmp/huc-bench.db', help='Database URL, emptied and seeded unless --reuse')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='10k', help='Approximate total number of rows')
+    parser.add_argument('--profiles', type=int, help='Number of profiles, overrides --scale')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reuse', action='store_true', help='Keep the data already in the database')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma separated scenarios to run')
+    parser.add_argument('--requests', type=int, default=500, help='Measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per scenario')
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true', help='Disable the response cache')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed p95 slowdown against --compare')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error('Unknown scenarios: {}'.format(', '.join(sorted(unknown))))
+
+    # The configuration is read from the environment when the app is imported
+    os.environ['DATABASE_URL'] = args.database
+    os.environ.setdefault('CLOUDINARY_URL', 'cloudinary://benchmark')
+    from app import create_app, db
+    from app.models import Post, Profile
+    from .data import seed
+
+    app = create_app('production')
+    if args.no_cache:
+        app.config['CACHE_MAX_ENTRIES'] = 0
+    profiles = args.profiles or SCALES[args.scale]
+
+    with app.app_context():
+        if not args.reuse:
+            db.drop_all()
+            db.create_all()
+            started = time.perf_counter()
+            seed(profiles, args.seed)
+            print('Seeding took {:.1f}s'.format(time.perf_counter() - started))
+        context = {'profiles': Profile.query.count(), 'posts': Post.query.count()}
+        counter = QueryCounter(db.engine)
+        dialect = db.engine.dialect.name
+
+    client = app.test_client()
+    results = {
+        'meta': {
+            'date': datetime.utcnow().isoformat(timespec='seconds'),
+            'revision': _revision(),
+            'database': dialect,
+            'scale': args.scale if not args.profiles else None,
+            'profiles': context['profiles'],
+            'posts': context['posts'],
+            'seed': args.seed,
+            'cache': not args.no_cache,
+            'python': platform.python_version()
+        },
+        'scenarios': {}
+    }
+    print('{:<14} {:>8} {:>9} {:>9} {:>9} {:>9} {:>10}'.format('scenario', 'requests', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'req/s'))
+    for name in scenarios:
+        rng = random.Random('{}:{}'.format(args.seed, name))
+        result = run_scenario(client, counter, SCENARIOS[name], args.requests, args.warmup, rng, context)
+        results['scenarios'][name] = result
+        print('{:<14} {requests:>8} {p50_ms:>9} {p95_ms:>9} {p99_ms:>9} {queries_per_request:>9} {throughput_rps:>10}'.format(name, **result))
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=2)
+
+    if args.compare:
+        with open(args.compare) as handle:
+            regressions = compare(results, json.load(handle), args.tolerance)
+        for regression in regressions:
+            print('Regression in {}'.format(regression))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+'''
+Query plan regression check for the hot request paths
+
+    python -m benchmarks.plans --database sqlite:////tmp/huc-plans.db
+    python -m benchmarks.plans --database postgresql://localhost/huc_plans --scale 100k
+
+Seeds a database, runs each hot path through the Flask test client while
+recording the statements it issues, then EXPLAINs every statement and
+exits with an error when any of them reads a whole table. PostgreSQL is
+run with sequential scans disabled, so a scan left in its plans means no
+index could serve the query.
+'''
+import argparse
+import json
+import os
+import re
+import sys
+
+from .data import SCALES
+
+# SQLite plan details naming a table read from start to end
+_SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+
+# Hot paths as (name, method, url, json body), formatted with ids from the seeded data
+HOT_PATHS = (
+    ('home timeline', 'GET', '/api/v1/timeline/{profile}', None),
+    ('home timeline, next page', 'GET', '/api/v1/timeline/{profile}?after={timeline_cursor}', None),
+    ('profile posts', 'GET', '/api/v1/posts?profile_id={author}', None),
+    ('latest posts', 'GET', '/api/v1/posts', None),
+    ('single post', 'GET', '/api/v1/posts/{post}', None),
+    ('single profile', 'GET', '/api/v1/profiles/{profile}', None),
+    ('post comments', 'GET', '/api/v1/comments?post_id={post}', None),
+    ('tagged posts', 'GET', '/api/v1/tags/{tag}/posts', None),
+    ('follow state', 'GET', '/api/v1/follow/{profile}?ids={author}', None),
+    ('like', 'POST', '/api/v1/likes', {'operations': [{'profile_id': '{profile}', 'post_id': '{post}', 'action': 'like'}]}),
+    ('unlike', 'POST', '/api/v1/likes', {'operations': [{'profile_id': '{profile}', 'post_id': '{post}', 'action': 'unlike'}]}),
+    ('follow', 'POST', '/api/v1/follow/{profile}', {'followed_id': '{author}'}),
+    ('unfollow', 'DELETE', '/api/v1/follow/{profile}', {'followed_id': '{author}'}),
+)
+
+
+def _fill(value, ids):
+    if isinstance(value, str):
+        filled = value.format(**ids)
+        return int(filled) if filled.isdigit() and value.startswith('{') else filled
+    if isinstance(value, list):
+        return [_fill(item, ids) for item in value]
+    if isinstance(value, dict):
+        return {key: _fill(item, ids) for key, item in value.items()}
+    return value
+
+
+def sqlite_scans(connection, statement, parameters):
+    rows = connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+    details = [row[-1] for row in rows]
+    scans = []
+    for detail in details:
+        match = _SQLITE_SCAN.match(detail)
+        if match:
+            scans.append(match.group(1))
+    return scans, details
+
+
+def postgresql_scans(connection, statement, parameters):
+    connection.execute('SET enable_seqscan = off')
+    plan = connection.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    scans = []
+    details = []
+
+    def walk(node, depth):
+        details.append('{}{} {}'.format('  ' * depth, node['Node Type'], node.get('Relation Name', '')).rstrip())
+        if node['Node Type'] == 'Seq Scan':
+            scans.append(node['Relation Name'])
+        for child in node.get('Plans', ()):
+            walk(child, depth + 1)
+
+    walk(plan[0]['Plan'], 0)
+    return scans, details
+
+
+class StatementRecorder:
+    '''
+    Records the statements an engine runs while switched on
+    '''
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.recording = False
+        self.statements = []
+        event.listen(engine, 'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if self.recording:
+            if executemany:
+                parameters = parameters[0]
+            self.statements.append((statement, parameters))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='sqlite:////tmp/huc-plans.db', help='Database URL, emptied and seeded unless --reuse')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='10k')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reuse', action='store_true', help='Keep the data already in the database')
+    parser.add_argument('--verbose', action='store_true', help='Print every plan')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database
+    os.environ.setdefault('CLOUDINARY_URL', 'cloudinary://benchmark')
+    from app import create_app, db
+    from app.graph import get_follower_graph
+    from app.models import Post, PostTag, Profile, TimelineEntry
+    from app.pagination import encode_cursor
+    from .data import seed
+
+    app = create_app('production')
+    # Every read has to reach the database to be checked
+    app.config['CACHE_MAX_ENTRIES'] = 0
+
+    with app.app_context():
+        if not args.reuse:
+            db.drop_all()
+            db.create_all()
+            seed(SCALES[args.scale], args.seed)
+
+        profile = db.session.query(TimelineEntry.profile_id).group_by(TimelineEntry.profile_id).order_by(
+            db.func.count().desc()
+        ).limit(1).scalar()
+        entry = TimelineEntry.query.filter_by(profile_id=profile).order_by(
+            TimelineEntry.timestamp.desc(), TimelineEntry.post_id.desc()
+        ).offset(10).first()
+        post = Post.query.order_by(Post.comment_count.desc()).first()
+        ids = {
+            'profile': profile,
+            'timeline_cursor': encode_cursor(entry.timestamp, entry.post_id),
+            'author': post.profile_id if post.profile_id != profile else Profile.query.filter(Profile.id != profile).first().id,
+            'post': post.id,
+            'tag': PostTag.query.order_by(PostTag.post_count.desc()).first().tag_text
+        }
+        # The follower graph is bulk loaded once per worker, not per request
+        get_follower_graph()
+        engine = db.engine
+        recorder = StatementRecorder(engine)
+        explain = postgresql_scans if engine.dialect.name == 'postgresql' else sqlite_scans
+        tables = set(db.Model.metadata.tables)
+
+    client = app.test_client()
+    failures = 0
+    for name, method, url, body in HOT_PATHS:
+        failed = failures
+        recorder.statements = []
+        recorder.recording = True
+        response = client.open(_fill(url, ids), method=method, json=_fill(body, ids))
+        recorder.recording = False
+        if response.status_code >= 400:
+            print('FAIL  {}: {} {} returned {}'.format(name, method, url, response.status_code))
+            failures += 1
+            continue
+
+        with engine.connect() as connection:
+            for statement, parameters in recorder.statements:
+                if not statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH')):
+                    continue
+                scans, details = explain(connection, statement, parameters)
+                scans = [table for table in scans if table in tables]
+                if scans or args.verbose:
+                    print('{}  {}: {}'.format('FAIL' if scans else 'ok  ', name, ' '.join(statement.split())))
+                    for detail in details:
+                        print('        {}'.format(detail))
+                if scans:
+                    failures += 1
+        if failures == failed:
+            print('ok    {}'.format(name))
+
+    if failures:
+        print('{} statements read whole tables'.format(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
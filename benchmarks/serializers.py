@@ -0,0 +1,108 @@
+'''
+Compares the compiled serializer with marshmallow on large profile and post pages
+
+    python -m benchmarks.serializers --rows 10000 100000
+'''
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('CLOUDINARY_URL', 'cloudinary://benchmark')
+
+from app import create_app, db
+from app.models import Post, PostSchema, Profile, ProfileSchema
+from app.serializers import columns_for, compile_dump
+
+
+def seed(rows):
+    start = datetime(2020, 1, 1)
+    db.session.execute(Profile.__table__.insert(), [{
+        'username': 'user{}'.format(i),
+        'country': 'Kenya',
+        'facebook': 'fb{}'.format(i) if i % 3 else None,
+        'twitter': None,
+        'google': None,
+        'is_active': bool(i % 7),
+        'is_verified': not i % 5,
+        'remember_token': False,
+        'join_date': start + timedelta(minutes=i),
+        'follower_count': i % 1000,
+        'following_count': i % 300
+    } for i in range(rows)])
+    db.session.execute(Post.__table__.insert(), [{
+        'media': 'https://example.com/{}.jpg'.format(i),
+        'post_name': 'post{}'.format(i),
+        'post_type': 'photo',
+        'post_location': 'Nairobi',
+        'post_category': 'africanhistory',
+        'post_licensing': 'creativecommons',
+        'timestamp': start + timedelta(minutes=i),
+        'profile_id': i + 1,
+        'like_count': i % 50,
+        'comment_count': i % 10
+    } for i in range(rows)])
+    db.session.commit()
+
+
+def timed(function, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(rows, repeat):
+    results = []
+    for model, schema in ((Profile, ProfileSchema(many=True)), (Post, PostSchema(many=True))):
+        objects = model.query.limit(rows).all()
+        core_rows = db.session.query(*columns_for(schema, model)).limit(rows).all()
+        dump_one = compile_dump(schema)
+
+        baseline, expected = timed(lambda: schema.dump(objects), repeat)
+        fast, actual = timed(lambda: [dump_one(obj) for obj in objects], repeat)
+        core, from_rows = timed(lambda: [dump_one(row) for row in core_rows], repeat)
+
+        expected = json.dumps(expected)
+        if json.dumps(actual) != expected or json.dumps(from_rows) != expected:
+            raise SystemExit('Compiled output differs from {} for {} rows'.format(type(schema).__name__, rows))
+
+        results.append({
+            'schema': type(schema).__name__,
+            'rows': rows,
+            'marshmallow_s': round(baseline, 4),
+            'compiled_orm_s': round(fast, 4),
+            'compiled_core_s': round(core, 4),
+            'speedup': round(baseline / fast, 1)
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', dest='json_path', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        seed(max(args.rows))
+        results = [result for rows in args.rows for result in run(rows, args.repeat)]
+
+    for result in results:
+        print('{schema:<14} {rows:>7} rows  marshmallow {marshmallow_s:>8}s  compiled {compiled_orm_s:>8}s  '
+              'from core rows {compiled_core_s:>8}s  x{speedup}'.format(**result))
+    if args.json_path:
+        with open(args.json_path, 'w') as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == '__main__':
+    main()
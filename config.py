@@ -1,4 +1,7 @@
-from decouple import config
+import multiprocessing
+import os
+import tempfile
+from decouple import config, Csv
 
 class Config:
     '''
@@ -6,25 +9,179 @@ class Config:
     '''
     SQLALCHEMY_DATABASE_URI = config('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Comma separated read replica URLs. Reads of GET requests are spread over
+    # them until the request writes; everything else uses DATABASE_URL
+    DATABASE_REPLICA_URLS = config('DATABASE_REPLICA_URLS', default='', cast=Csv())
+    SQLALCHEMY_BINDS = {
+        'replica{}'.format(index): url for index, url in enumerate(DATABASE_REPLICA_URLS)
+    }
+
+    # Connection pool of the primary and of each replica. Ignored for SQLite
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': config('DB_POOL_SIZE', default=5, cast=int),
+        'max_overflow': config('DB_MAX_OVERFLOW', default=10, cast=int),
+        'pool_timeout': config('DB_POOL_TIMEOUT', default=30, cast=int),
+        'pool_recycle': config('DB_POOL_RECYCLE', default=1800, cast=int),
+        'pool_pre_ping': config('DB_POOL_PRE_PING', default=True, cast=bool)
+    }
     CLOUDINARY_URL = config('CLOUDINARY_URL')
 
+    # Pagination
+    PAGE_SIZE = config('PAGE_SIZE', default=20, cast=int)
+    MAX_PAGE_SIZE = config('MAX_PAGE_SIZE', default=100, cast=int)
+
+    # Most comments a feed or timeline may embed under each post with ?comments=
+    MAX_COMMENT_PREVIEWS = config('MAX_COMMENT_PREVIEWS', default=10, cast=int)
+
+    # Dump through schemas compiled into plain functions instead of marshmallow
+    FAST_SERIALIZATION = config('FAST_SERIALIZATION', default=True, cast=bool)
+
+    # Compression of API responses of at least COMPRESSION_MIN_SIZE bytes,
+    # with brotli when it is installed and the client accepts it, else gzip
+    COMPRESSION = config('COMPRESSION', default=True, cast=bool)
+    COMPRESSION_MIN_SIZE = config('COMPRESSION_MIN_SIZE', default=1024, cast=int)
+    COMPRESSION_LEVEL = config('COMPRESSION_LEVEL', default=6, cast=int)
+    BROTLI_QUALITY = config('BROTLI_QUALITY', default=5, cast=int)
+
+    # Rows fetched and flushed per batch by streamed NDJSON exports
+    STREAM_BATCH_SIZE = config('STREAM_BATCH_SIZE', default=1000, cast=int)
+
+    # Home timeline: posts from profiles with at least this many followers are
+    # merged in at read time instead of being pushed to every follower
+    TIMELINE_FANOUT_LIMIT = config('TIMELINE_FANOUT_LIMIT', default=10000, cast=int)
+    TIMELINE_BACKFILL_SIZE = config('TIMELINE_BACKFILL_SIZE', default=200, cast=int)
+
+    # Seconds before the in-memory follower graph is reloaded from the database
+    FOLLOW_GRAPH_REFRESH = config('FOLLOW_GRAPH_REFRESH', default=300, cast=int)
+
+    # Search engine backend and seconds before its indexes are rebuilt from
+    # the database (0 only ever builds them once)
+    SEARCH_BACKEND = config('SEARCH_BACKEND', default='app.search.MemoryBackend')
+    SEARCH_REFRESH = config('SEARCH_REFRESH', default=600, cast=int)
+
+    # Completions returned per type by /autocomplete by default and at most,
+    # and seconds before the prefix indexes are rebuilt from the database
+    # (0 only ever builds them once)
+    AUTOCOMPLETE_LIMIT = config('AUTOCOMPLETE_LIMIT', default=5, cast=int)
+    AUTOCOMPLETE_MAX_LIMIT = config('AUTOCOMPLETE_MAX_LIMIT', default=10, cast=int)
+    AUTOCOMPLETE_REFRESH = config('AUTOCOMPLETE_REFRESH', default=600, cast=int)
+
+    # Seconds the interned tag text -> id cache is kept before being dropped
+    TAG_CACHE_TTL = config('TAG_CACHE_TTL', default=600, cast=int)
+
+    # Read-through response cache. CACHE_URL is only used by shared backends
+    # such as app.cache.RedisCache
+    CACHE_BACKEND = config('CACHE_BACKEND', default='app.cache.LRUCache')
+    CACHE_URL = config('CACHE_URL', default=None)
+    CACHE_TTL = config('CACHE_TTL', default=30, cast=int)
+    CACHE_MAX_ENTRIES = config('CACHE_MAX_ENTRIES', default=10000, cast=int)
+
+    # Largest number of like/unlike operations accepted in one bulk request
+    MAX_BULK_LIKES = config('MAX_BULK_LIKES', default=5000, cast=int)
+
+    # Profiles changed per UPDATE and transaction by bulk moderation
+    MODERATION_CHUNK_SIZE = config('MODERATION_CHUNK_SIZE', default=500, cast=int)
+
+    # Requests running one statement at least this many times are logged as
+    # probable N+1 queries. SERVER_TIMING adds DB time and query counts to
+    # every response in a Server-Timing header
+    N_PLUS_ONE_THRESHOLD = config('N_PLUS_ONE_THRESHOLD', default=5, cast=int)
+    SERVER_TIMING = config('SERVER_TIMING', default=False, cast=bool)
+
+    # Request metrics are counted by each worker process. Without
+    # METRICS_DIR /metrics reports the answering worker's, labelled with its
+    # pid; with it, workers write theirs there every METRICS_FLUSH_INTERVAL
+    # seconds and /metrics reports their sum. The server clears it on start
+    METRICS_DIR = config('METRICS_DIR', default='')
+    METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=5, cast=int)
+
+    # Media pipeline. Uploads are received into the spool in chunks and
+    # stored by MEDIA_WORKERS background threads (0 processes them inline).
+    # MEDIA_ROOT and MEDIA_URL are only used by app.media.LocalStorage
+    MEDIA_STORAGE = config('MEDIA_STORAGE', default='app.media.CloudinaryStorage')
+    MEDIA_SPOOL_DIR = config('MEDIA_SPOOL_DIR', default=os.path.join(tempfile.gettempdir(), 'huc-spool'))
+    MEDIA_ROOT = config('MEDIA_ROOT', default='media')
+    MEDIA_URL = config('MEDIA_URL', default=None)
+    MEDIA_WORKERS = config('MEDIA_WORKERS', default=2, cast=int)
+    MEDIA_CHUNK_SIZE = config('MEDIA_CHUNK_SIZE', default=1024 * 1024, cast=int)
+    MEDIA_MAX_UPLOAD = config('MEDIA_MAX_UPLOAD', default=500 * 1024 * 1024, cast=int)
+    MEDIA_VARIANTS = config('MEDIA_VARIANTS', default='thumbnail:320,medium:1080')
+
+    # Batch endpoint. Most sub-requests accepted in one batch, and threads
+    # running the reads of parallel batches (0 always runs them in order)
+    BATCH_MAX_REQUESTS = config('BATCH_MAX_REQUESTS', default=20, cast=int)
+    BATCH_WORKERS = config('BATCH_WORKERS', default=4, cast=int)
+
+    # Background deletion of profiles and posts. Dependent rows are removed
+    # DELETION_BATCH_SIZE keys at a time with DELETION_PAUSE seconds between
+    # batches, by DELETION_WORKERS threads (0 deletes inline)
+    DELETION_WORKERS = config('DELETION_WORKERS', default=1, cast=int)
+    DELETION_BATCH_SIZE = config('DELETION_BATCH_SIZE', default=500, cast=int)
+    DELETION_PAUSE = config('DELETION_PAUSE', default=0.1, cast=float)
+
+    # Trending posts. Each like or comment adds its weight to a post's score,
+    # which halves every TRENDING_HALF_LIFE seconds. Every worker reads new
+    # likes and comments from the database and ranks the best TRENDING_SIZE
+    # posts of each category and media type again every TRENDING_TICK
+    # seconds (0 ranks them on read). The scores are saved to
+    # TRENDING_SNAPSHOT, and activity too old to count deleted, every
+    # TRENDING_SNAPSHOT_INTERVAL seconds
+    TRENDING_HALF_LIFE = config('TRENDING_HALF_LIFE', default=6 * 3600, cast=int)
+    TRENDING_LIKE_WEIGHT = config('TRENDING_LIKE_WEIGHT', default=1.0, cast=float)
+    TRENDING_COMMENT_WEIGHT = config('TRENDING_COMMENT_WEIGHT', default=3.0, cast=float)
+    TRENDING_SIZE = config('TRENDING_SIZE', default=500, cast=int)
+    TRENDING_TICK = config('TRENDING_TICK', default=10, cast=int)
+    TRENDING_SNAPSHOT = config('TRENDING_SNAPSHOT', default=os.path.join(tempfile.gettempdir(), 'huc-trending.json'))
+    TRENDING_SNAPSHOT_INTERVAL = config('TRENDING_SNAPSHOT_INTERVAL', default=300, cast=int)
+
+    # Production server run by manage.py serve and gunicorn.conf.py. Workers
+    # are forked from a preloaded app and recycled after SERVER_MAX_REQUESTS
+    # requests, spread by up to SERVER_MAX_REQUESTS_JITTER so they do not all
+    # restart together
+    SERVER_BIND = config('SERVER_BIND', default='0.0.0.0:{}'.format(config('PORT', default=8000)))
+    SERVER_WORKERS = config('SERVER_WORKERS', default=multiprocessing.cpu_count() * 2 + 1, cast=int)
+    SERVER_THREADS = config('SERVER_THREADS', default=1, cast=int)
+    SERVER_MAX_REQUESTS = config('SERVER_MAX_REQUESTS', default=1000, cast=int)
+    SERVER_MAX_REQUESTS_JITTER = config('SERVER_MAX_REQUESTS_JITTER', default=100, cast=int)
+    SERVER_TIMEOUT = config('SERVER_TIMEOUT', default=30, cast=int)
+    SERVER_GRACEFUL_TIMEOUT = config('SERVER_GRACEFUL_TIMEOUT', default=30, cast=int)
+    SERVER_PIDFILE = config('SERVER_PIDFILE', default=None)
+
 class ProdConfig(Config):
     '''
     Class for Production configurations
     '''
     DEBUG=False
+    SQLALCHEMY_ENGINE_OPTIONS = dict(
+        Config.SQLALCHEMY_ENGINE_OPTIONS,
+        pool_size=config('DB_POOL_SIZE', default=10, cast=int),
+        max_overflow=config('DB_MAX_OVERFLOW', default=20, cast=int)
+    )
 
 class TestConfig(Config):
     '''
     Class for testing configurations
     '''
-    pass
+    MEDIA_STORAGE = config('MEDIA_STORAGE', default='app.media.LocalStorage')
+    MEDIA_WORKERS = config('MEDIA_WORKERS', default=0, cast=int)
+    BATCH_WORKERS = config('BATCH_WORKERS', default=0, cast=int)
+    TRENDING_TICK = config('TRENDING_TICK', default=0, cast=int)
+    DELETION_WORKERS = config('DELETION_WORKERS', default=0, cast=int)
+    DELETION_PAUSE = config('DELETION_PAUSE', default=0, cast=float)
+    TRENDING_SNAPSHOT = config('TRENDING_SNAPSHOT', default='')
 
 class DevConfig(Config):
     '''
     Class for development configurations
     '''
     DEBUG=True
+    SERVER_TIMING = config('SERVER_TIMING', default=True, cast=bool)
+    SQLALCHEMY_ENGINE_OPTIONS = dict(
+        Config.SQLALCHEMY_ENGINE_OPTIONS,
+        pool_size=config('DB_POOL_SIZE', default=2, cast=int),
+        max_overflow=config('DB_MAX_OVERFLOW', default=5, cast=int)
+    )
 
 config_options = {
     'production': ProdConfig,
@@ -0,0 +1,54 @@
+'''
+Gunicorn settings of the production server
+
+    python3 manage.py serve
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is loaded once and forked into the workers. Send the master HUP to
+gracefully replace the workers, or USR2 then QUIT to the old master to
+start new code without dropping connections.
+'''
+from config import ProdConfig
+
+bind = ProdConfig.SERVER_BIND
+workers = ProdConfig.SERVER_WORKERS
+threads = ProdConfig.SERVER_THREADS
+preload_app = True
+max_requests = ProdConfig.SERVER_MAX_REQUESTS
+max_requests_jitter = ProdConfig.SERVER_MAX_REQUESTS_JITTER
+timeout = ProdConfig.SERVER_TIMEOUT
+graceful_timeout = ProdConfig.SERVER_GRACEFUL_TIMEOUT
+pidfile = ProdConfig.SERVER_PIDFILE
+accesslog = '-'
+
+
+def on_starting(server):
+    if ProdConfig.METRICS_DIR:
+        from app.instrumentation import clear_metrics
+        clear_metrics(ProdConfig.METRICS_DIR)
+
+
+def when_ready(server):
+    # Caches built here are shared by every worker, connections are not
+    from app.server import dispose_engines, warm_up
+    app = server.app.wsgi()
+    warm_up(app)
+    dispose_engines(app)
+
+
+def post_fork(server, worker):
+    from app.server import dispose_engines
+    dispose_engines(server.app.wsgi())
+
+
+def worker_exit(server, worker):
+    # Requests counted since the last flush still count once the worker is gone
+    metrics = worker.app.wsgi().extensions['metrics']
+    if metrics.directory:
+        metrics.flush()
+
+
+def post_worker_init(worker):
+    # Open the connections the worker's threads need before taking requests
+    from app.server import warm_up
+    warm_up(worker.app.wsgi(), connections=worker.cfg.threads)
@@ -1,5 +1,5 @@
 from app import create_app, db
-from flask_script import Manager, Server
+from flask_script import Command, Manager, Option, Server
 from flask_migrate import Migrate, MigrateCommand
 from app.models import *
 
@@ -9,12 +9,80 @@ app = create_app('development')
 manager = Manager(app)
 migrate = Migrate(app, db)
 
+class Import(Command):
+    '''
+    Bulk load profiles, posts, tags, comments, likes or follows from NDJSON or CSV files
+    '''
+    option_list = (
+        Option('entity', choices=('profiles', 'posts', 'tags', 'comments', 'likes', 'follows')),
+        Option('paths', nargs='+'),
+        Option('-f', '--format', dest='fmt', choices=('ndjson', 'csv'), default=None),
+        Option('-b', '--batch-size', dest='batch_size', type=int, default=5000),
+        Option('--restart', dest='restart', action='store_true', help='Ignore checkpoints and load files from the start'),
+        Option('--finalize', dest='finalize', action='store_true', help='Recount counters and rebuild timelines afterwards')
+    )
+
+    def run(self, entity, paths, fmt, batch_size, restart, finalize):
+        from app.importer import Importer, rebuild_counters, rebuild_timelines
+
+        importer = Importer(batch_size=batch_size, resume=not restart)
+        for path in paths:
+            try:
+                importer.run(entity, path, fmt)
+            except Exception as e:
+                print('Import of {} failed: {}'.format(path, e))
+                print('Run the same command again to resume after the last committed batch')
+                raise SystemExit(1)
+
+        if finalize:
+            rebuild_counters()
+            rebuild_timelines()
+            print('Counters and timelines rebuilt')
+
+class Media(Command):
+    '''
+    Queue again the spooled uploads of posts whose media was never stored
+    '''
+    def run(self):
+        from app.media import requeue_pending
+
+        print('{} uploads queued'.format(requeue_pending()))
+
+class Deletions(Command):
+    '''
+    Queue again the profile and post deletions a restart or an error left unfinished
+    '''
+    def run(self):
+        from app.deletion import requeue_deletions
+
+        print('{} deletions queued'.format(requeue_deletions()))
+
+class Serve(Command):
+    '''
+    Run the production app under gunicorn with preforked workers
+    '''
+    option_list = (
+        Option('-b', '--bind', dest='bind', default=None),
+        Option('-w', '--workers', dest='workers', type=int, default=None),
+        Option('-t', '--threads', dest='threads', type=int, default=None),
+        Option('-c', '--config', dest='config_file', default='gunicorn.conf.py')
+    )
+
+    def run(self, bind, workers, threads, config_file):
+        from app.server import serve
+
+        serve(config_file, bind=bind, workers=workers, threads=threads)
+
 manager.add_command('runserver', Server)
 manager.add_command('db', MigrateCommand)
+manager.add_command('import', Import)
+manager.add_command('media', Media)
+manager.add_command('deletions', Deletions)
+manager.add_command('serve', Serve)
 
 @manager.shell
 def make_shell_context():
-    return dict(app=app, db=db, Profile=Profile, Post=Post, Comment=Comment, Like=Like, Follow=Follow)
+    return dict(app=app, db=db, Profile=Profile, Post=Post, Comment=Comment, Like=Like, PostTag=PostTag)
 
 if __name__ == '__main__':
-    manager.run()
\ No newline at end of file
+    manager.run()
@@ -0,0 +1,49 @@
+import itertools
+import os
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('CLOUDINARY_URL', 'cloudinary://test')
+
+import pytest
+from app import create_app, db
+from app.models import Post, Profile
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_profile(app):
+    def make(username, **fields):
+        profile = Profile(username, 'kenya', None, None, None, True, False, False)
+        for name, value in fields.items():
+            setattr(profile, name, value)
+        profile.save_profile()
+        return profile
+    return make
+
+
+@pytest.fixture
+def make_post(app):
+    names = itertools.count()
+
+    def make(profile, post_name=None, **fields):
+        post_name = post_name or 'post {}'.format(next(names))
+        post = Post('media', post_name, 'photo', 'Nairobi', 'africanhistory', 'cc', profile.id)
+        for name, value in fields.items():
+            setattr(post, name, value)
+        post.save_post()
+        return post
+    return make
@@ -0,0 +1,801 @@
+import json
+import os
+import pytest
+from flask import request
+from app import create_app, db
+from app.media import LocalStorage, MediaPipeline
+from app.models import Post, PostSchema, Profile
+
+PROFILE = {
+    'username': 'amani', 'country': 'kenya', 'facebook': '', 'twitter': '', 'google': '',
+    'is_active': True, 'is_verified': False, 'remember_token': False
+}
+
+
+def collect(client, url, limit):
+    names, cursor, pages = [], None, 0
+    while True:
+        query = '{}?limit={}'.format(url, limit) + ('&after={}'.format(cursor) if cursor else '')
+        body = client.get(query).get_json()
+        names += [row.get('post_name') or row.get('username') for row in body['data']]
+        pages += 1
+        cursor = body['next_cursor']
+        if cursor is None:
+            return names, pages
+
+
+def test_post_pages_follow_the_cursor(client, make_profile, make_post):
+    author = make_profile('author')
+    for i in range(7):
+        make_post(author, 'post {}'.format(i))
+
+    names, pages = collect(client, '/api/v1/posts', 3)
+
+    assert names == ['post {}'.format(i) for i in reversed(range(7))]
+    assert pages == 3
+
+
+def test_cursor_is_stable_under_new_posts(client, make_profile, make_post):
+    author = make_profile('author')
+    for i in range(4):
+        make_post(author, 'post {}'.format(i))
+    first = client.get('/api/v1/posts?limit=2').get_json()
+
+    make_post(author, 'newer')
+    rest = client.get('/api/v1/posts?limit=10&after={}'.format(first['next_cursor'])).get_json()
+
+    assert [row['post_name'] for row in rest['data']] == ['post 1', 'post 0']
+
+
+def test_profile_pages_follow_the_cursor(client, make_profile):
+    for i in range(5):
+        make_profile('user{}'.format(i))
+
+    names, pages = collect(client, '/api/v1/profiles', 2)
+
+    assert sorted(names) == ['user{}'.format(i) for i in range(5)]
+    assert len(set(names)) == 5
+    assert pages == 3
+
+
+def test_invalid_cursor_is_rejected(client):
+    response = client.get('/api/v1/posts?after=not-a-cursor')
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Invalid cursor'
+
+
+def test_profile_is_created_and_updated(client):
+    response = client.post('/api/v1/profiles', json=PROFILE)
+    assert response.status_code == 201
+
+    profile_id = Profile.query.filter_by(username='amani').one().id
+    response = client.put('/api/v1/profiles', json={'id': profile_id, 'username': 'amani_k', 'is_verified': True})
+    assert response.status_code == 200
+    assert response.get_json()['data']['username'] == 'amani_k'
+    db.session.expire_all()
+    profile = Profile.query.get(profile_id)
+    assert (profile.username, profile.country, profile.is_verified) == ('amani_k', 'kenya', True)
+
+
+def test_invalid_profile_data_is_a_bad_request(client, make_profile):
+    response = client.post('/api/v1/profiles', json=dict(PROFILE, unknown=1))
+    assert response.status_code == 400
+    assert 'unknown' in response.get_json()['error']
+
+    profile = make_profile('zawadi')
+    response = client.put('/api/v1/profiles', json={'id': profile.id, 'unknown': 1})
+    assert response.status_code == 400
+    assert 'unknown' in response.get_json()['error']
+
+    assert client.put('/api/v1/profiles', json={'username': 'x'}).status_code == 400
+    assert client.put('/api/v1/profiles', json={'id': 999, 'username': 'x'}).status_code == 404
+
+
+def test_bulk_likes_endpoint(client, app, make_profile, make_post):
+    author = make_profile('author')
+    post = make_post(author)
+
+    response = client.post('/api/v1/likes', json={'operations': [{'profile_id': author.id, 'post_id': post.id}]})
+    assert response.status_code == 200
+    assert response.get_json()['data'] == {'liked': 1, 'unliked': 0, 'unchanged': 0}
+    assert client.get('/api/v1/posts/{}'.format(post.id)).get_json()['data']['like_count'] == 1
+
+    assert client.post('/api/v1/likes', json={'operations': []}).status_code == 400
+    unknown = {'operations': [{'profile_id': author.id, 'post_id': 999}]}
+    assert client.post('/api/v1/likes', json=unknown).status_code == 422
+    app.config['MAX_BULK_LIKES'] = 1
+    too_many = {'operations': [{'profile_id': author.id, 'post_id': post.id}] * 2}
+    assert client.post('/api/v1/likes', json=too_many).status_code == 413
+
+
+class PosterStorage(LocalStorage):
+    def posters(self, key, content_type, sizes):
+        return [(name, self.base_url + key + '.' + name, size, size, 100) for name, size in sizes]
+
+
+@pytest.fixture
+def media(app, tmp_path):
+    app.config['MEDIA_ROOT'] = str(tmp_path / 'media')
+    app.config['MEDIA_SPOOL_DIR'] = str(tmp_path / 'spool')
+    app.config['MEDIA_STORAGE'] = 'tests.test_api.PosterStorage'
+    return app
+
+
+def upload(client, body, content_type):
+    upload_id = client.post('/api/v1/uploads', json={'size': len(body), 'content_type': content_type}).get_json()['data']['id']
+    headers = {'Content-Range': 'bytes 0-{}/{}'.format(len(body) - 1, len(body))}
+    assert client.put('/api/v1/uploads/' + upload_id, data=body, headers=headers).status_code == 200
+    return upload_id
+
+
+def post_data(profile, **fields):
+    return dict({
+        'post_name': 'clip', 'post_type': 'video', 'post_location': 'Nairobi', 'post_category': 'africanhistory',
+        'post_licensing': 'cc', 'profile_id': profile.id
+    }, **fields)
+
+
+def test_upload_range_must_match_the_upload_size(client, media):
+    upload_id = client.post('/api/v1/uploads', json={'size': 10}).get_json()['data']['id']
+
+    response = client.put('/api/v1/uploads/' + upload_id, data=b'abcde', headers={'Content-Range': 'bytes 0-4/12'})
+    assert response.status_code == 400
+
+    response = client.put('/api/v1/uploads/' + upload_id, data=b'abcde', headers={'Content-Range': 'bytes 0-4/10'})
+    assert response.get_json()['data']['offset'] == 5
+    response = client.put('/api/v1/uploads/' + upload_id, data=b'fghij', headers={'Content-Range': 'bytes 5-9/*'})
+    assert response.get_json()['data']['complete']
+
+
+def test_upload_is_attached_to_one_post(client, media, make_profile):
+    profile = make_profile('author')
+    upload_id = upload(client, b'0' * 16, 'video/mp4')
+    # Keep the upload spooled as if a worker had not processed it yet
+    media.extensions['media_pipeline'] = pipeline = MediaPipeline(media)
+    pipeline.submit = lambda post_id, upload_id: None
+
+    assert client.post('/api/v1/posts', json=post_data(profile, upload_id=upload_id)).status_code == 202
+    response = client.post('/api/v1/posts', json=post_data(profile, upload_id=upload_id))
+    assert response.status_code == 409
+    assert Post.query.count() == 1
+
+
+
+def test_concurrent_claims_of_an_upload_conflict(client, media, make_profile, monkeypatch):
+    from app.api.resources import Post as post_resource
+    profile = make_profile('author')
+    upload_id = upload(client, b'0' * 16, 'video/mp4')
+    media.extensions['media_pipeline'] = pipeline = MediaPipeline(media)
+    pipeline.submit = lambda post_id, upload_id: None
+
+    # Another request attaches the upload after this one checked it
+    load = post_resource.post_schema.load
+
+    def claimed_meanwhile(data):
+        rival = Post('media', 'rival', 'video', 'Nairobi', 'africanhistory', 'cc', profile.id)
+        rival.media_upload = upload_id
+        rival.save_post()
+        return load(data)
+    monkeypatch.setattr(post_resource.post_schema, 'load', claimed_meanwhile)
+
+    response = client.post('/api/v1/posts', json=post_data(profile, upload_id=upload_id))
+    assert response.status_code == 409
+    assert [post.post_name for post in Post.query] == ['rival']
+
+def test_video_uploads_get_posters(client, media, make_profile):
+    profile = make_profile('author')
+    upload_id = upload(client, b'0' * 16, 'video/mp4')
+
+    assert client.post('/api/v1/posts', json=post_data(profile, upload_id=upload_id)).status_code == 202
+    post_id = Post.query.one().id
+
+    variants = client.get('/api/v1/posts/{}/media'.format(post_id)).get_json()['data']['variants']
+    assert sorted(variant['name'] for variant in variants) == ['medium', 'thumbnail']
+    assert Post.query.get(post_id).media_status == 'ready'
+
+
+def test_unchanged_post_is_not_modified(client, make_profile, make_post):
+    post = make_post(make_profile('author'))
+    url = '/api/v1/posts/{}'.format(post.id)
+    response = client.get(url)
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert not response.data
+
+    # Other fields are another representation with its own tag
+    assert client.get(url + '?fields=post_name', headers={'If-None-Match': etag}).status_code == 200
+
+    post.post_name = 'renamed'
+    post.save_post()
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_pages_revalidate_on_their_rows(client, make_profile, make_post):
+    author = make_profile('author')
+    make_post(author, 'first')
+    response = client.get('/api/v1/posts?limit=5')
+    etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+
+    assert client.get('/api/v1/posts?limit=5', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/api/v1/posts?limit=5', headers={'If-Modified-Since': last_modified}).status_code == 304
+
+    make_post(author, 'second')
+    assert client.get('/api/v1/posts?limit=5', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_profile_not_modified(client, make_profile):
+    profile = make_profile('amani')
+    url = '/api/v1/profiles/{}'.format(profile.id)
+    etag = client.get(url).headers['ETag']
+
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+    profile.country = 'uganda'
+    profile.save_profile()
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 200
+
+
+@pytest.fixture
+def replicated(tmp_path):
+    # A replica that never catches up shows which database each read used
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(tmp_path / 'primary.db')
+    app.config['SQLALCHEMY_BINDS'] = {'replica0': 'sqlite:///{}'.format(tmp_path / 'replica.db')}
+    app.config['BATCH_WORKERS'] = 2
+    with app.app_context():
+        db.create_all()
+        db.Model.metadata.create_all(db.get_engine(app, bind='replica0'))
+        yield app
+        db.session.remove()
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_batch_reads_see_earlier_writes(replicated, parallel):
+    client = replicated.test_client()
+    response = client.post('/api/v1/batch', json={'parallel': parallel, 'requests': [
+        {'path': '/api/v1/profiles/1'},
+        {'method': 'POST', 'path': '/api/v1/profiles', 'body': PROFILE},
+        {'path': '/api/v1/profiles/1'},
+        {'path': '/api/v1/profiles?limit=5'},
+        {'path': '/api/v1/profiles/1'}
+    ]})
+
+    results = response.get_json()['data']
+    assert [result['status'] for result in results] == [404, 201, 200, 200, 200]
+    assert results[2]['body']['data']['username'] == 'amani'
+    assert [row['username'] for row in results[3]['body']['data']] == ['amani']
+    # Identical reads between two writes run once
+    assert results[4] == results[2]
+
+
+
+def test_reads_use_a_replica_until_the_request_writes(replicated):
+    def count():
+        return Profile.query.count()
+
+    # Outside a request everything uses the primary
+    db.session.add(Profile('amani', 'kenya', '', '', '', True, False, False))
+    db.session.commit()
+    assert count() == 1
+    db.session.remove()
+
+    for method, expected in (('GET', 0), ('HEAD', 0), ('POST', 1), ('DELETE', 1)):
+        with replicated.test_request_context('/', method=method):
+            assert count() == expected
+            # Raw SQL may write, so it always goes to the primary
+            assert db.session.execute('SELECT count(*) FROM profiles').scalar() == 1
+        db.session.remove()
+
+    with replicated.test_request_context('/'):
+        assert count() == 0
+        Profile.query.update({Profile.country: 'tanzania'}, synchronize_session=False)
+        assert count() == 1
+        assert db.session.query(Profile.country).scalar() == 'tanzania'
+    db.session.rollback()
+    db.session.remove()
+
+    with replicated.test_request_context('/'):
+        assert count() == 0
+        db.session.add(Profile('zawadi', 'kenya', '', '', '', True, False, False))
+        db.session.flush()
+        assert count() == 2
+    db.session.rollback()
+    db.session.remove()
+
+
+def test_queue_pool_reports_checkout_waits(tmp_path):
+    from sqlalchemy import create_engine
+    from app.database import TimedQueuePool
+    engine = create_engine('sqlite:///{}'.format(tmp_path / 'pool.db'), poolclass=TimedQueuePool,
+                           pool_size=1, max_overflow=0, pool_timeout=0.05)
+    connection = engine.connect()
+    stats = engine.pool.stats()
+    assert (stats['checkouts'], stats['checked_out'], stats['saturation'], stats['timeouts']) == (1, 1, 1.0, 0)
+
+    with pytest.raises(Exception):
+        engine.connect()
+    connection.close()
+    stats = engine.pool.stats()
+    assert (stats['checkouts'], stats['checked_out'], stats['saturation'], stats['timeouts']) == (2, 0, 0.0, 1)
+    assert stats['wait_max'] >= 0.05 and stats['wait_total'] >= stats['wait_max']
+    engine.dispose()
+
+def flags(column):
+    return {profile.username: getattr(profile, column) for profile in Profile.query}
+
+
+def test_moderation_selects_ids_or_usernames_within_the_filter(client, make_profile):
+    amani, zawadi = make_profile('amani'), make_profile('zawadi')
+    make_profile('baraka', country='uganda')
+    make_profile('imani')
+
+    response = client.post('/api/v1/verify', json={
+        'ids': [amani.id], 'usernames': ['zawadi', 'baraka'], 'filter': {'country': 'kenya'}
+    })
+    assert response.get_json()['data'] == {'matched': 2, 'updated': 2}
+    db.session.expire_all()
+    assert flags('is_verified') == {'amani': True, 'zawadi': True, 'baraka': False, 'imani': False}
+
+    response = client.delete('/api/v1/activate', json={'filter': {'is_verified': True}})
+    assert response.get_json()['data'] == {'matched': 2, 'updated': 2}
+    db.session.expire_all()
+    assert flags('is_active') == {'amani': False, 'zawadi': False, 'baraka': True, 'imani': True}
+
+    # Selecting again changes nothing
+    response = client.delete('/api/v1/activate', json={'ids': [amani.id, zawadi.id]})
+    assert response.get_json()['data'] == {'matched': 2, 'updated': 0}
+
+
+
+def test_moderation_pages_through_the_selection(app, client, make_profile):
+    app.config['MODERATION_CHUNK_SIZE'] = 2
+    names = ['p{}'.format(i) for i in range(7)]
+    for name in names:
+        make_profile(name, is_verified=name in ('p1', 'p4'))
+
+    response = client.post('/api/v1/verify', json={'filter': {'country': 'kenya'}})
+    assert response.get_json()['data'] == {'matched': 7, 'updated': 5}
+    db.session.expire_all()
+    assert flags('is_verified') == {name: True for name in names}
+
+@pytest.mark.parametrize('body', [
+    {},
+    {'ids': '12'},
+    {'ids': [True]},
+    {'usernames': 'amani'},
+    {'filter': {'is_active': 'false'}},
+    {'filter': {'is_verified': 0}},
+    {'filter': {'joined_after': 'yesterday'}},
+    {'filter': {'age': 3}}
+])
+def test_moderation_rejects_malformed_selections(client, make_profile, body):
+    make_profile('amani')
+    response = client.delete('/api/v1/activate', json=body)
+    assert response.status_code == 422
+    db.session.expire_all()
+    assert flags('is_active') == {'amani': True}
+
+
+def test_json_fallback_matches_orjson(monkeypatch):
+    from datetime import date, datetime, timezone
+    from uuid import UUID
+    from app import encoding
+    data = {
+        'at': datetime(2020, 11, 2, 10, 27, 41, 930582), 'utc': datetime(2020, 11, 2, tzinfo=timezone.utc),
+        'day': date(2020, 11, 2), 'id': UUID(int=5), 'name': 'Nyeri ñ', 'score': 1.5, 'ids': [1, 2]
+    }
+    expected = encoding.dumps_json(data)
+
+    monkeypatch.setattr(encoding, 'orjson', None)
+    assert encoding.dumps_json(data) == expected
+    assert expected.startswith(b'{"at":"2020-11-02T10:27:41.930582",')
+
+
+def test_large_responses_are_compressed(client, app, make_profile, make_post):
+    import gzip
+    import json
+    app.config['COMPRESSION_MIN_SIZE'] = 100
+    author = make_profile('author')
+    for i in range(5):
+        make_post(author, 'post {}'.format(i))
+
+    response = client.get('/api/v1/posts', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert len(json.loads(gzip.decompress(response.data))['data']) == 5
+
+    assert 'Content-Encoding' not in client.get('/api/v1/posts', headers={'Accept-Encoding': 'identity'}).headers
+
+    # Bodies under the threshold are not worth compressing, but still vary
+    app.config['COMPRESSION_MIN_SIZE'] = 10000
+    response = client.get('/api/v1/posts', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert len(response.get_json()['data']) == 5
+
+
+def test_responses_use_the_representation_asked_for(client, make_profile):
+    from app import encoding
+    make_profile('author')
+
+    response = client.get('/api/v1/profiles?fields=username', headers={'Accept': encoding.MSGPACK_MIMETYPE})
+    assert 'Accept' in response.headers['Vary']
+    if encoding.msgpack is None:
+        # Without msgpack installed clients get the default JSON
+        assert response.mimetype == 'application/json'
+        body = response.get_json()
+    else:
+        assert response.mimetype == encoding.MSGPACK_MIMETYPE
+        body = encoding.msgpack.unpackb(response.data, raw=False)
+    assert body['data'] == [{'username': 'author'}]
+
+
+def test_autocomplete_ranks_by_popularity(client, make_profile, make_post):
+    from app.tags import attach_tags
+    names = ['kamau', 'kariuki', 'kanini']
+    profiles = {name: make_profile(name) for name in names}
+    # kariuki has two followers, kanini one
+    profiles['kamau'].follow(profiles['kariuki'])
+    profiles['kanini'].follow(profiles['kariuki'])
+    profiles['kamau'].follow(profiles['kanini'])
+    db.session.commit()
+    posts = [make_post(profiles['kamau'], post_location=location) for location in ('Kakamega', 'Kericho', 'Kakamega')]
+    attach_tags([post.id for post in posts], ['kanga'])
+    attach_tags([posts[0].id], ['kaya'])
+
+    data = client.get('/api/v1/autocomplete?q=Ka&limit=2').get_json()['data']
+    assert [row['username'] for row in data['profiles']] == ['kariuki', 'kanini']
+    assert [(row['tag_text'], row['post_count']) for row in data['tags']] == [('kanga', 3), ('kaya', 1)]
+    assert data['locations'] == [{'post_location': 'Kakamega', 'post_count': 2}]
+
+    # Indexes follow changes once loaded
+    profiles['kanini'].unfollow(profiles['kariuki'])
+    profiles['kanini'].follow(profiles['kamau'])
+    profiles['kariuki'].follow(profiles['kamau'])
+    db.session.commit()
+    data = client.get('/api/v1/autocomplete?q=ka&types=profiles').get_json()['data']
+    assert list(data) == ['profiles']
+    # Equal follower counts are listed by username
+    assert [(row['username'], row['follower_count']) for row in data['profiles']] == [
+        ('kamau', 2), ('kanini', 1), ('kariuki', 1)
+    ]
+
+    assert client.get('/api/v1/autocomplete?q=').status_code == 400
+    assert client.get('/api/v1/autocomplete?q=ka&types=places').status_code == 400
+
+
+def test_follow_counts_and_suggestions(client, make_profile):
+    profiles = {name: make_profile(name) for name in ('amani', 'baraka', 'chege', 'dalia', 'eshe')}
+    ids = {name: profile.id for name, profile in profiles.items()}
+
+    # Loaded before the follows below, which are applied to it as they happen
+    assert client.get('/api/v1/follow/{}'.format(ids['amani'])).get_json()['data'] == {
+        'follower_count': 0, 'following_count': 0
+    }
+    for follower, followed in (('amani', 'baraka'), ('amani', 'chege'), ('baraka', 'dalia'),
+                               ('chege', 'dalia'), ('chege', 'eshe'), ('baraka', 'amani')):
+        response = client.post('/api/v1/follow/{}'.format(ids[follower]), json={'followed_id': ids[followed]})
+        assert response.status_code == 200
+
+    response = client.get('/api/v1/follow/{}?ids={},{}'.format(ids['amani'], ids['baraka'], ids['dalia']))
+    assert response.get_json()['data'] == {
+        'follower_count': 1,
+        'following_count': 2,
+        'is_following': {str(ids['baraka']): True, str(ids['dalia']): False}
+    }
+
+    # dalia is followed by two of amani's follows, eshe by one
+    response = client.get('/api/v1/follow/{}/suggestions'.format(ids['amani']))
+    assert response.get_json()['data'] == [
+        {'profile_id': ids['dalia'], 'mutual_count': 2}, {'profile_id': ids['eshe'], 'mutual_count': 1}
+    ]
+    response = client.get('/api/v1/follow/{}/suggestions?limit=1'.format(ids['amani']))
+    assert [row['profile_id'] for row in response.get_json()['data']] == [ids['dalia']]
+
+    client.delete('/api/v1/follow/{}'.format(ids['chege']), json={'followed_id': ids['eshe']})
+    response = client.get('/api/v1/follow/{}/suggestions'.format(ids['amani']))
+    assert [row['profile_id'] for row in response.get_json()['data']] == [ids['dalia']]
+    assert client.get('/api/v1/follow/{}/mutual'.format(ids['amani'])).get_json()['data'] == [ids['baraka']]
+
+
+@pytest.mark.parametrize('path', ['/api/v1/follow/{}', '/api/v1/follow/{}/mutual', '/api/v1/follow/{}/suggestions'])
+def test_follow_state_of_unknown_profiles_is_not_found(client, make_profile, path):
+    hidden = make_profile('hidden', pending_deletion=True)
+    for profile_id in (hidden.id, hidden.id + 1):
+        assert client.get(path.format(profile_id)).status_code == 404
+
+
+def test_search_pages_follow_the_offset_cursor(client, make_profile, make_post):
+    author = make_profile('author')
+    make_post(author, 'Lamu dhow')
+    # Loaded with the first post, later posts are indexed as they are saved
+    assert [post['post_name'] for post in client.get('/api/v1/search/posts?q=dhow').get_json()['data']] == [
+        'Lamu dhow'
+    ]
+    for name in ('Dhow race', 'Dhow builders', 'Old dhows', 'Market'):
+        make_post(author, name)
+
+    pages, after = [], None
+    while True:
+        query = '/api/v1/search/posts?q=dhow&limit=2' + ('&after={}'.format(after) if after else '')
+        body = client.get(query).get_json()
+        pages.append([post['post_name'] for post in body['data']])
+        after = body['next_cursor']
+        if after is None:
+            break
+
+    full = [post['post_name'] for post in client.get('/api/v1/search/posts?q=dhow&limit=10').get_json()['data']]
+    assert [name for page in pages for name in page] == full
+    assert [len(page) for page in pages] == [2, 2]
+    # Exact matches rank above the prefix match
+    assert sorted(full[:3]) == ['Dhow builders', 'Dhow race', 'Lamu dhow'] and full[3] == 'Old dhows'
+
+    assert client.get('/api/v1/search/posts?q=dhow&after=not-a-cursor').status_code == 400
+    assert client.get('/api/v1/search/posts?q=').status_code == 400
+
+
+def test_tagging_keeps_post_counts(client, make_profile, make_post):
+    from app.models import PostTag
+    author = make_profile('author')
+    posts = [make_post(author) for _ in range(3)]
+    ids = [post.id for post in posts]
+
+    def counts():
+        db.session.expire_all()
+        return {tag.tag_text: tag.post_count for tag in PostTag.query}
+
+    assert client.post('/api/v1/tags', json={'post_ids': ids[:2], 'tags': ['#Lamu', 'dhow']}).status_code == 200
+    # Posts already tagged are not counted twice
+    assert client.post('/api/v1/tags', json={'post_ids': ids, 'tags': ['lamu', 'Lamu ']}).status_code == 200
+    assert counts() == {'lamu': 3, 'dhow': 2}
+
+    assert client.delete('/api/v1/tags', json={'post_ids': ids[1:], 'tags': ['LAMU', 'dhow', 'unknown']}).status_code == 200
+    assert counts() == {'lamu': 1, 'dhow': 1}
+    tagged = client.get('/api/v1/tags/lamu/posts').get_json()['data']
+    assert [post['post_name'] for post in tagged] == [posts[0].post_name]
+
+
+@pytest.mark.parametrize('body', [
+    {'post_ids': [1], 'tags': 'sunset'},
+    {'post_ids': [1], 'tags': ['sunset', 7]},
+    {'post_ids': [1], 'tags': {'sunset': True}},
+    {'post_ids': '1', 'tags': ['sunset']},
+    {'post_ids': [1, 'one'], 'tags': ['sunset']},
+    {'post_ids': [2], 'tags': ['sunset']}
+])
+def test_malformed_tagging_is_unprocessable(client, make_profile, make_post, body):
+    make_post(make_profile('author'))
+    assert client.post('/api/v1/tags', json=body).status_code == 422
+    assert client.delete('/api/v1/tags', json=body).status_code == 422
+
+
+def test_cached_posts_embed_the_current_author(client, make_profile, make_post):
+    author = make_profile('author')
+    make_post(author)
+
+    def authors():
+        body = client.get('/api/v1/posts?include=author').get_json()
+        return [(post['author']['username'], post['author']['is_verified']) for post in body['data']]
+
+    assert authors() == [('author', False)]
+    response = client.put('/api/v1/profiles', json={'id': author.id, 'username': 'renamed'})
+    assert response.status_code == 200
+    assert authors() == [('renamed', False)]
+    Profile.query.get(author.id).verify_profile()
+    assert authors() == [('renamed', True)]
+
+
+def test_requests_are_timed_and_repeated_statements_flagged(app, client, caplog):
+    app.config['SERVER_TIMING'] = True
+    threshold = app.config['N_PLUS_ONE_THRESHOLD']
+
+    def repeat():
+        for _ in range(int(request.args['times'])):
+            db.session.execute('SELECT 1')
+        return 'ok'
+
+    def fail():
+        raise RuntimeError('failed')
+    app.add_url_rule('/repeat', 'repeat', repeat)
+    app.add_url_rule('/fail', 'fail', fail)
+
+    timings = client.get('/repeat?times={}'.format(threshold)).headers.getlist('Server-Timing')
+    assert timings[0].startswith('db;dur=') and timings[0].endswith(';desc="{} queries"'.format(threshold))
+    assert timings[1].startswith('app;dur=')
+    assert 'Probable N+1 query on GET /repeat, run {} times: SELECT 1'.format(threshold) in caplog.text
+    client.get('/repeat?times={}'.format(threshold - 1))
+
+    # Unhandled exceptions are counted whether or not they propagate
+    assert client.get('/fail').status_code == 500
+    app.config['PROPAGATE_EXCEPTIONS'] = True
+    with pytest.raises(RuntimeError):
+        client.get('/fail')
+
+    metrics = client.get('/api/v1/metrics').get_data(as_text=True)
+    labels = 'endpoint="{}",method="GET",{}pid="%d"' % os.getpid()
+    assert 'huc_n_plus_one_total{%s} 1' % labels.format('/repeat', '') in metrics
+    assert 'huc_db_queries_total{%s} %d' % (labels.format('/repeat', ''), 2 * threshold - 1) in metrics
+    assert 'huc_requests_total{%s} 2' % labels.format('/repeat', 'status="200",') in metrics
+    assert 'huc_requests_total{%s} 2' % labels.format('/fail', 'status="500",') in metrics
+    assert 'huc_request_duration_seconds_count{%s} 2' % labels.format('/fail', '') in metrics
+
+
+def test_workers_sharing_a_metrics_directory_report_their_sum(tmp_path, monkeypatch):
+    from app import instrumentation
+    from app.instrumentation import Metrics, clear_metrics
+    workers = {1: Metrics(str(tmp_path)), 2: Metrics(str(tmp_path))}
+    for pid, duration in ((1, 0.001), (2, 0.3), (2, 0.003)):
+        monkeypatch.setattr(instrumentation.os, 'getpid', lambda: pid)
+        workers[pid].observe('/api/v1/posts', 'GET', 200, duration, 2, 0.001, False)
+        workers[pid].flush()
+
+    monkeypatch.setattr(instrumentation.os, 'getpid', lambda: 1)
+    metrics = workers[1].render([('huc_cache_entries', 'Entries', 'gauge', [({}, 3)])])
+    assert 'huc_requests_total{endpoint="/api/v1/posts",method="GET",status="200"} 3' in metrics
+    assert 'huc_db_queries_total{endpoint="/api/v1/posts",method="GET"} 6' in metrics
+    assert 'huc_request_duration_seconds_bucket{endpoint="/api/v1/posts",method="GET",le="0.005"} 2' in metrics
+    assert 'huc_request_duration_seconds_bucket{endpoint="/api/v1/posts",method="GET",le="+Inf"} 3' in metrics
+    # Gauges describe the worker answering
+    assert 'huc_cache_entries{pid="1"} 3' in metrics
+
+    clear_metrics(str(tmp_path))
+    assert 'huc_requests_total{endpoint="/api/v1/posts",method="GET",status="200"} 1' in workers[1].render()
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_lists_stream_as_ndjson(app, client, make_profile, make_post):
+    app.config['STREAM_BATCH_SIZE'] = 2
+    authors = [make_profile('amani'), make_profile('zawadi')]
+    names = [make_post(authors[i % 2]).post_name for i in range(5)]
+    make_post(authors[0], pending_deletion=True)
+    accept = {'Accept': 'application/x-ndjson'}
+
+    response = client.get('/api/v1/posts', headers=accept)
+    assert (response.mimetype, response.headers['X-Accel-Buffering']) == ('application/x-ndjson', 'no')
+    rows = ndjson(response)
+    assert [row['post_name'] for row in rows] == names
+    assert set(rows[0]) == set(PostSchema().dump_fields)
+
+    response = client.get('/api/v1/posts?fields=post_name,like_count&profile_id={}'.format(authors[1].id), headers=accept)
+    assert ndjson(response) == [{'post_name': names[1], 'like_count': 0}, {'post_name': names[3], 'like_count': 0}]
+    assert client.get('/api/v1/posts?fields=password', headers=accept).status_code == 400
+
+    response = client.get('/api/v1/profiles?fields=username', headers=accept)
+    assert ndjson(response) == [{'username': 'amani'}, {'username': 'zawadi'}]
+    # JSON is still preferred when both are acceptable
+    response = client.get('/api/v1/profiles', headers={'Accept': 'application/json, application/x-ndjson'})
+    assert response.mimetype == 'application/json'
+
+
+def test_comments_page_per_post(client, make_profile, make_post):
+    author = make_profile('author')
+    post, other = make_post(author), make_post(author)
+    for i in range(5):
+        client.post('/api/v1/posts/{}/comments'.format(post.id), json={'comment': 'comment {}'.format(i)})
+    client.post('/api/v1/comments', json={'comment': 'elsewhere', 'post_id': other.id})
+
+    comments, cursor = [], None
+    while True:
+        url = '/api/v1/posts/{}/comments?limit=2'.format(post.id) + ('&after={}'.format(cursor) if cursor else '')
+        body = client.get(url).get_json()
+        comments += [row['comment'] for row in body['data']]
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+    assert comments == ['comment {}'.format(i) for i in reversed(range(5))]
+
+    assert client.get('/api/v1/posts/999/comments').status_code == 404
+    assert client.post('/api/v1/posts/999/comments', json={'comment': 'lost'}).status_code == 404
+    assert client.get('/api/v1/posts/{}/comments?after=junk'.format(post.id)).status_code == 400
+
+
+def test_comment_previews_take_one_query_for_the_page(client, make_profile, make_post):
+    from sqlalchemy import event
+    from app.comments import latest_comments
+    author = make_profile('author')
+    posts = [make_post(author) for _ in range(4)]
+    for post, count in zip(posts, (0, 1, 3, 5)):
+        for i in range(count):
+            client.post('/api/v1/posts/{}/comments'.format(post.id), json={'comment': 'c{}'.format(i)})
+
+    post_ids, names = [post.id for post in posts], [post.post_name for post in posts]
+    statements = []
+
+    def record(connection, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        latest = latest_comments(post_ids, 2)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    assert len(statements) == 1
+    assert post_ids[0] not in latest
+    assert [comment['comment'] for comment in latest[post_ids[3]][0]] == ['c4', 'c3']
+    assert latest[post_ids[3]][1] == 5
+    assert latest[post_ids[1]][1] == 1
+
+    body = client.get('/api/v1/posts?comments=2').get_json()
+    previews = {row['post_name']: (len(row['comments']), row['comment_count']) for row in body['data']}
+    assert previews == dict(zip(names, [(0, 0), (1, 1), (2, 3), (2, 5)]))
+    assert 'comments' not in client.get('/api/v1/posts').get_json()['data'][0]
+
+
+def test_sparse_fieldsets_narrow_the_output_and_the_query(client, make_profile, make_post):
+    from sqlalchemy import event
+    from app.tags import attach_tags
+    author = make_profile('author')
+    post = make_post(author, 'dhow')
+    attach_tags([post.id], ['swahili', 'coast'])
+    post_id = post.id
+
+    statements = []
+
+    def record(connection, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        body = client.get('/api/v1/posts?fields=post_name,like_count').get_json()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    assert body['data'] == [{'post_name': 'dhow', 'like_count': 0}]
+    page_query = next(statement for statement in statements if 'FROM posts' in statement)
+    assert 'posts.post_name' in page_query and 'posts.media' not in page_query
+
+    body = client.get('/api/v1/posts?fields=post_name&include=tags,author').get_json()
+    [row] = body['data']
+    assert set(row) == {'post_name', 'tags', 'author'}
+    assert sorted(row['tags']) == ['coast', 'swahili']
+    assert row['author']['username'] == 'author'
+
+    body = client.get('/api/v1/posts/{}?fields=post_type'.format(post_id)).get_json()
+    assert body['data'] == {'post_type': 'photo'}
+    body = client.get('/api/v1/profiles?fields=username,follower_count').get_json()
+    assert body['data'] == [{'username': 'author', 'follower_count': 0}]
+
+    for url in ('/api/v1/posts?fields=secret', '/api/v1/posts?include=likes', '/api/v1/profiles?fields=password'):
+        response = client.get(url)
+        assert response.status_code == 400
+        assert response.get_json()['success'] is False
+
+
+def test_warm_up_builds_the_caches_and_opens_connections(tmp_path, make_profile, make_post):
+    from app.autocomplete import indexes as autocomplete_indexes
+    from app.database import TimedQueuePool
+    from app.search import indexes
+    from app.server import dispose_engines, warm_up
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(tmp_path / 'warm.db')
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'poolclass': TimedQueuePool}
+    with app.app_context():
+        db.create_all()
+        make_post(make_profile('author'), 'dhow')
+        db.session.remove()
+        dispose_engines(app)
+        pool = db.engine.pool
+        assert pool.checkedin() == 0
+
+        warm_up(app, connections=3)
+        # The index builds may hold one more while the connections are opened
+        assert pool.checkedin() >= 3
+        assert pool.checkedout() == 0
+        assert app.extensions['follower_graph'].current is not None
+        assert set(app.extensions['search']) == set(indexes)
+        assert all(refresher.current is not None for refresher in app.extensions['search'].values())
+        assert set(app.extensions['autocomplete']) == set(autocomplete_indexes)
+        assert app.extensions['trending'].loaded
+
+        dispose_engines(app)
+        assert db.engine.pool is not pool
+        assert db.engine.pool.checkedin() == 0
+        assert Profile.query.count() == 1
+        db.session.remove()
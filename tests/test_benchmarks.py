@@ -0,0 +1,76 @@
+import os
+import subprocess
+import sys
+from collections import Counter
+from app import db
+from app.models import Like, Post, PostTag, Profile, TimelineEntry
+from benchmarks.data import generate, seed
+
+
+def rows_of(profiles, seed):
+    tables = {}
+    for table, rows in generate(profiles, seed):
+        tables.setdefault(table, []).extend(rows)
+    return tables
+
+
+def test_data_sets_are_reproducible_and_consistent():
+    first = rows_of(200, 7)
+    assert first == rows_of(200, 7)
+    assert first['posts'] != rows_of(200, 8)['posts']
+
+    profile_ids = {row['id'] for row in first['profiles']}
+    post_ids = {row['id'] for row in first['posts']}
+    tag_ids = {row['id'] for row in first['posttags']}
+    assert len(profile_ids) == 200
+    assert {row['profile_id'] for row in first['posts']} <= profile_ids
+    assert {row['post_id'] for row in first['comments']} <= post_ids
+    assert {row['post_id'] for row in first['tags']} <= post_ids
+    assert {row['tag_id'] for row in first['tags']} <= tag_ids
+    for table, pair in (('followers', ('follower_id', 'followed_id')), ('likes', ('profile_id', 'post_id')),
+                        ('tags', ('post_id', 'tag_id'))):
+        keys = [tuple(row[column] for column in pair) for row in first[table]]
+        assert len(keys) == len(set(keys)), table
+    assert all(row['follower_id'] != row['followed_id'] for row in first['followers'])
+
+    # A few profiles are followed by most of the others
+    followers = Counter(row['followed_id'] for row in first['followers'])
+    top = sum(count for _, count in followers.most_common(10))
+    assert top > 0.3 * len(first['followers'])
+
+
+def test_seeding_fills_counters_and_timelines(app):
+    counts = seed(30, seed=3, echo=lambda message: None)
+    assert counts['profiles'] == Profile.query.count() == 30
+    assert counts['posts'] == Post.query.count()
+
+    profile = Profile.query.order_by(Profile.follower_count.desc()).first()
+    assert profile.follower_count == len(profile.followers.all()) > 0
+    post = Post.query.order_by(Post.like_count.desc()).first()
+    assert post.like_count == Like.query.filter_by(post_id=post.id).count() > 0
+    assert sum(tag.post_count for tag in PostTag.query) == counts['tags']
+    assert db.session.query(TimelineEntry).count() > 0
+
+
+def test_plan_check_flags_whole_table_reads(app):
+    from benchmarks.plans import _fill, sqlite_scans
+    assert _fill({'operations': [{'profile_id': '{profile}', 'name': 'p{profile}'}]}, {'profile': 12}) == {
+        'operations': [{'profile_id': 12, 'name': 'p12'}]
+    }
+    assert _fill('/api/v1/posts?profile_id={author}', {'author': 3}) == '/api/v1/posts?profile_id=3'
+
+    with db.engine.connect() as connection:
+        scans, _ = sqlite_scans(connection, 'SELECT * FROM posts WHERE profile_id = ? ORDER BY timestamp DESC', (1,))
+        assert scans == []
+        scans, _ = sqlite_scans(connection, 'SELECT * FROM posts WHERE post_licensing = ?', ('cc',))
+        assert scans == ['posts']
+
+
+def test_hot_paths_use_indexes(tmp_path):
+    result = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.plans', '--database', 'sqlite:///{}'.format(tmp_path / 'plans.db')],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=dict(os.environ, CLOUDINARY_URL='cloudinary://test'), capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert 'FAIL' not in result.stdout
@@ -0,0 +1,703 @@
+import json
+import os
+import pytest
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+from marshmallow import Schema, fields
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import (
+    Comment, CommentSchema, DeletionJob, DeletionJobSchema, DeletionStatus, Like, MediaVariant, MediaVariantSchema,
+    Post, PostSchema, PostTag, PostTagSchema, Profile, ProfileSchema, TimelineEntry
+)
+from app.pagination import decode_cursor
+from app.serializers import columns_for
+
+
+def names(posts):
+    return [post.post_name for post in posts]
+
+
+def entry_owners(post):
+    return sorted(id for id, in db.session.query(TimelineEntry.profile_id).filter_by(post_id=post.id))
+
+
+def test_posts_fan_out_to_followers(app, make_profile, make_post):
+    author, reader = make_profile('author'), make_profile('reader')
+    reader.follow(author)
+    db.session.commit()
+
+    post = make_post(author, 'hello')
+
+    assert post.fanned_out
+    assert entry_owners(post) == sorted([author.id, reader.id])
+    assert names(reader.timeline(10)[0]) == ['hello']
+
+
+def test_celebrity_posts_are_merged_at_read_time(app, make_profile, make_post):
+    app.config['TIMELINE_FANOUT_LIMIT'] = 2
+    celebrity, friend = make_profile('celebrity'), make_profile('friend')
+    reader, other = make_profile('reader'), make_profile('other')
+    reader.follow(celebrity)
+    other.follow(celebrity)
+    reader.follow(friend)
+    db.session.commit()
+
+    make_post(friend, 'first')
+    post = make_post(celebrity, 'second')
+    make_post(friend, 'third')
+
+    assert not post.fanned_out
+    assert entry_owners(post) == [celebrity.id]
+    assert names(reader.timeline(10)[0]) == ['third', 'second', 'first']
+    # Pages of the merged timeline neither skip nor repeat posts
+    page, cursor = reader.timeline(2)
+    rest, end = reader.timeline(2, decode_cursor(cursor))
+    assert names(page) + names(rest) == ['third', 'second', 'first']
+    assert end is None
+
+
+def test_posts_survive_crossing_the_fan_out_limit(app, make_profile, make_post):
+    app.config['TIMELINE_FANOUT_LIMIT'] = 2
+    author, reader, other = make_profile('author'), make_profile('reader'), make_profile('other')
+    reader.follow(author)
+    db.session.commit()
+    make_post(author, 'fanned')
+
+    # Becoming a celebrity keeps the fanned out post in the timeline, once
+    other.follow(author)
+    db.session.commit()
+    make_post(author, 'merged')
+    assert names(reader.timeline(10)[0]) == ['merged', 'fanned']
+
+    # Dropping back under the limit keeps the merged post in the timeline
+    other.unfollow(author)
+    db.session.commit()
+    make_post(author, 'fanned again')
+    assert names(reader.timeline(10)[0]) == ['fanned again', 'merged', 'fanned']
+
+
+def test_following_backfills_fanned_out_posts_only(app, make_profile, make_post):
+    app.config['TIMELINE_FANOUT_LIMIT'] = 2
+    author, reader, other = make_profile('author'), make_profile('reader'), make_profile('other')
+    make_post(author, 'fanned')
+    other.follow(author)
+    reader.follow(author)
+    db.session.commit()
+    merged = make_post(author, 'merged')
+
+    follower = make_profile('follower')
+    follower.follow(author)
+    db.session.commit()
+
+    assert follower.id not in entry_owners(merged)
+    assert names(follower.timeline(10)[0]) == ['merged', 'fanned']
+    assert Post.query.filter_by(fanned_out=False).count() == 1
+
+
+def counts(*posts):
+    return [db.session.query(Post.like_count).filter_by(id=post.id).scalar() for post in posts]
+
+
+def test_bulk_likes_keep_counters_exact(app, make_profile, make_post):
+    from app.likes import apply_likes
+    author, fan = make_profile('author'), make_profile('fan')
+    first, second = make_post(author, 'first'), make_post(author, 'second')
+
+    result = apply_likes([
+        {'profile_id': author.id, 'post_id': first.id},
+        {'profile_id': fan.id, 'post_id': first.id},
+        {'profile_id': fan.id, 'post_id': second.id},
+        # Repeated pairs collapse to their last operation
+        {'profile_id': fan.id, 'post_id': second.id, 'action': 'unlike'},
+        {'profile_id': fan.id, 'post_id': second.id}
+    ])
+    assert result == {'liked': 3, 'unliked': 0, 'unchanged': 0}
+    assert counts(first, second) == [2, 1]
+
+    # Liking again and unliking what was never liked change nothing
+    result = apply_likes([
+        {'profile_id': fan.id, 'post_id': first.id},
+        {'profile_id': author.id, 'post_id': second.id, 'action': 'unlike'},
+        {'profile_id': fan.id, 'post_id': second.id, 'action': 'unlike'}
+    ])
+    assert result == {'liked': 0, 'unliked': 1, 'unchanged': 2}
+    assert counts(first, second) == [2, 0]
+    assert Like.query.count() == 2
+
+
+def test_bulk_likes_are_all_or_nothing(app, make_profile, make_post):
+    from app.likes import InvalidLikeOperation, apply_likes
+    author = make_profile('author')
+    post = make_post(author)
+
+    with pytest.raises(InvalidLikeOperation):
+        apply_likes([{'profile_id': author.id, 'post_id': post.id}, {'profile_id': author.id, 'post_id': 999}])
+    with pytest.raises(InvalidLikeOperation):
+        apply_likes([{'profile_id': author.id, 'post_id': post.id, 'action': 'love'}])
+
+    assert counts(post) == [0]
+    assert Like.query.count() == 0
+
+
+def test_follow_counters(app, make_profile):
+    first, second = make_profile('first'), make_profile('second')
+    first.follow(second)
+    first.follow(second)
+    db.session.commit()
+    assert [(p.follower_count, p.following_count) for p in Profile.query.order_by(Profile.id)] == [(0, 1), (1, 0)]
+
+    first.unfollow(second)
+    first.unfollow(second)
+    db.session.commit()
+    assert [(p.follower_count, p.following_count) for p in Profile.query.order_by(Profile.id)] == [(0, 0), (0, 0)]
+
+
+def test_trending_scores_halve_every_half_life():
+    from app.trending import TrendingEngine
+    engine = TrendingEngine(half_life=3600, size=10)
+    engine.load([], 0, 0)
+    engine.record(1, 4.0, now=1000)
+    engine.record(2, 3.0, now=1000 + 3600)
+
+    engine.refresh(now=1000 + 3600)
+    assert engine.top() == [(2, pytest.approx(3.0)), (1, pytest.approx(2.0))]
+
+    # Decay keeps the order of untouched scores
+    engine.refresh(now=1000 + 3 * 3600)
+    assert engine.top() == [(2, pytest.approx(0.75)), (1, pytest.approx(0.5))]
+
+    # Scores decayed under min_score are dropped
+    engine.refresh(now=1000 + 12 * 3600)
+    assert engine.top() == []
+
+
+def test_trending_replay_applies_late_rows_once():
+    from app.trending import TrendingEngine
+    engine = TrendingEngine(half_life=3600, size=10)
+    engine.load([], 0, 0)
+
+    engine.replay([(1, 10, 1.0, 0), (3, 10, 1.0, 50)], settled=10)
+    assert engine.last_activity == 1
+    # Row 2 commits late, rows 1 and 3 are read again
+    engine.replay([(2, 11, 1.0, 40), (3, 10, 1.0, 50)], settled=100)
+    engine.replay([(2, 11, 1.0, 40), (3, 10, 1.0, 50)], settled=100)
+
+    assert engine.last_activity == 3
+    engine.refresh(now=0)
+    assert dict(engine.top()) == {10: pytest.approx(2.0, rel=0.01), 11: pytest.approx(1.0, rel=0.01)}
+
+
+def test_trending_workers_rank_the_same_activity(app, make_profile, make_post, tmp_path):
+    from app.likes import apply_likes
+    from app.trending import TrendingEngine, load_snapshot, save_snapshot, seed, tick
+    author = make_profile('author')
+    fans = [make_profile('fan{}'.format(i)) for i in range(3)]
+    first, second = make_post(author, 'first'), make_post(author, 'second')
+    workers = [TrendingEngine(3600, 10), TrendingEngine(3600, 10)]
+    for engine in workers:
+        seed(engine)
+
+    # Each worker handles some of the likes
+    apply_likes([{'profile_id': fan.id, 'post_id': second.id} for fan in fans])
+    Comment('nice', first.id).save_comment()
+    for engine in workers:
+        tick(engine)
+
+    expected = [(first.id, pytest.approx(3.0, rel=0.01)), (second.id, pytest.approx(3.0, rel=0.01))]
+    assert [sorted(engine.top()) for engine in workers] == [expected, expected]
+    assert [[id for id, _ in engine.top('media', 'photo')] for engine in workers] == [[first.id, second.id]] * 2
+
+    # A restarted worker picks up the activity after any worker's snapshot
+    path = str(tmp_path / 'trending.json')
+    save_snapshot(workers[0], path)
+    fans[0].unlike_post(second)
+    restarted = TrendingEngine(3600, 10)
+    assert load_snapshot(restarted, path)
+    tick(restarted)
+    tick(workers[1])
+    assert [id for id, _ in restarted.top()] == [id for id, _ in workers[1].top()]
+    assert dict(restarted.top())[second.id] == pytest.approx(2.0, rel=0.01)
+
+
+
+def deletion_world(make_profile, make_post):
+    from app.tags import attach_tags
+    doomed, friend = make_profile('doomed'), make_profile('friend')
+    doomed.follow(friend)
+    friend.follow(doomed)
+    db.session.commit()
+    posts = [make_post(doomed, 'doomed {}'.format(i)) for i in range(3)]
+    kept = make_post(friend, 'kept')
+    doomed.like_post(kept)
+    friend.like_post(posts[0])
+    Comment('on doomed', posts[0].id).save_comment()
+    Comment('on kept', kept.id).save_comment()
+    attach_tags([post.id for post in posts] + [kept.id], ['culture'])
+    return doomed, doomed.id, friend.id, kept.id
+
+
+def assert_deleted(doomed_id, friend_id, kept_id):
+    db.session.expire_all()
+    assert Profile.query.get(doomed_id) is None
+    assert Post.query.filter_by(profile_id=doomed_id).count() == 0
+    assert [comment.comment for comment in Comment.query] == ['on kept']
+    assert Like.query.count() == 0
+    assert TimelineEntry.query.filter(
+        (TimelineEntry.profile_id == doomed_id) | (TimelineEntry.author_id == doomed_id)
+    ).count() == 0
+    friend = Profile.query.get(friend_id)
+    assert (friend.follower_count, friend.following_count) == (0, 0)
+    assert Post.query.get(kept_id).like_count == 0
+    assert PostTag.query.filter_by(tag_text='culture').one().post_count == 1
+
+
+def test_deleting_a_profile_removes_its_rows_and_fixes_counters(app, make_profile, make_post):
+    app.config['DELETION_BATCH_SIZE'] = 2
+    doomed, *ids = deletion_world(make_profile, make_post)
+
+    job_id = doomed.delete_profile().id
+
+    assert_deleted(*ids)
+    job = DeletionJob.query.get(job_id)
+    assert (job.status, job.step, job.error) == ('done', 'profile', None)
+    assert job.rows_deleted > 0
+
+
+def test_deletion_hides_rows_at_once(app, client, make_profile, make_post):
+    doomed, doomed_id, _, _ = deletion_world(make_profile, make_post)
+    # Leave the job queued
+    app.extensions['deletion_worker'] = type('Idle', (), {'submit': lambda self, job_id: None})()
+
+    doomed.delete_profile()
+
+    assert client.get('/api/v1/profiles/{}'.format(doomed_id)).status_code == 404
+    assert [row['post_name'] for row in client.get('/api/v1/posts').get_json()['data']] == ['kept']
+    assert [row['comment'] for row in client.get('/api/v1/comments').get_json()['data']] == ['on kept']
+    post_id = Post.query.filter_by(profile_id=doomed_id).first().id
+    assert client.get('/api/v1/comments?post_id={}'.format(post_id)).get_json()['data'] == []
+    assert client.get('/api/v1/posts/{}/comments'.format(post_id)).status_code == 404
+
+    # Nor can the profile post again
+    response = client.post('/api/v1/posts', json={
+        'media': 'media', 'post_name': 'late', 'post_type': 'photo', 'post_location': 'Nairobi', 'post_category': 'africanhistory',
+        'post_licensing': 'cc', 'profile_id': doomed_id
+    })
+    assert response.status_code == 404
+    assert Post.query.filter_by(post_name='late').first() is None
+
+
+def test_interrupted_deletion_resumes_where_it_stopped(app, make_profile, make_post, monkeypatch):
+    from app import deletion
+    app.config['DELETION_BATCH_SIZE'] = 1
+    doomed, *ids = deletion_world(make_profile, make_post)
+    delete_batch = deletion.delete_batch
+    batches = []
+
+    def counted(table, *args, **kwargs):
+        batches.append(table.name)
+        return delete_batch(table, *args, **kwargs)
+
+    def failing(table, *args, **kwargs):
+        if table.name == 'comments':
+            raise RuntimeError('connection lost')
+        return delete_batch(table, *args, **kwargs)
+
+    monkeypatch.setattr(deletion, 'delete_batch', failing)
+    job_id = doomed.delete_profile().id
+    job = DeletionJob.query.get(job_id)
+    assert (job.status, job.step, job.error) == ('failed', 'likes', 'connection lost')
+    done_before = job.rows_deleted
+
+    # Steps already done are not run again
+    monkeypatch.setattr(deletion, 'delete_batch', counted)
+    deletion.run_job(job_id)
+
+    assert batches[0] == 'likes'
+    job = DeletionJob.query.get(job_id)
+    assert (job.status, job.error) == ('done', None)
+    assert job.rows_deleted > done_before
+    assert_deleted(*ids)
+
+
+def test_deletion_steps_remove_children_first():
+    from app.deletion import step_names
+    assert step_names('profile') == [
+        'home timeline', 'timeline entries', 'likes given', 'following', 'followers',
+        'media variants', 'tags', 'likes', 'comments', 'posts', 'profile'
+    ]
+    assert step_names('post') == ['timeline entries', 'media variants', 'tags', 'likes', 'comments', 'posts']
+
+
+def test_deleting_a_post_keeps_its_author(app, make_profile, make_post):
+    doomed = deletion_world(make_profile, make_post)[0]
+    post = Post.query.filter_by(post_name='doomed 0').one()
+    post_id, doomed_id = post.id, doomed.id
+
+    job_id = post.delete_post().id
+
+    db.session.expire_all()
+    assert DeletionJob.query.get(job_id).status == 'done'
+    assert Post.query.get(post_id) is None
+    assert Comment.query.filter_by(post_id=post_id).count() == 0
+    assert Like.query.filter_by(post_id=post_id).count() == 0
+    assert Profile.query.get(doomed_id) is not None
+    assert Post.query.filter_by(profile_id=doomed_id).count() == 2
+    assert PostTag.query.filter_by(tag_text='culture').one().post_count == 3
+
+
+def test_prefix_index_ranks_the_most_popular_matches(monkeypatch):
+    from app import autocomplete
+    from app.autocomplete import PrefixIndex
+    # Memoized best lists are used above this many matches
+    monkeypatch.setattr(autocomplete, 'SCAN_LIMIT', 2)
+    entries = [(i, 'name{}'.format(i), i % 7) for i in range(50)] + [(100, 'Nairobi-Town', 3), (101, 'Nakuru', 9)]
+    index = PrefixIndex(entries, keep=5, drop_empty=True)
+
+    def brute(prefix, limit):
+        matches = [entry for entry in entries if entry[1].lower().replace('-', ' ').startswith(prefix)]
+        return sorted(matches, key=lambda entry: (-entry[2], autocomplete.normalize(entry[1]), entry[0]))[:limit]
+
+    assert index.complete('NA', 3) == [(101, 'Nakuru', 9), (13, 'name13', 6), (20, 'name20', 6)]
+    assert index.complete('nairobi t', 5) == [(100, 'Nairobi-Town', 3)]
+    assert index.complete('name1', 5) == brute('name1', 5)
+
+    # Updates keep the memoized lists exact
+    index.adjust(13, 10)
+    index.set(6, 'name6', 0)
+    index.remove(101)
+    index.adjust(200, 8, 'Nanyuki')
+    entries = [entry for entry in entries if entry[0] not in (6, 13, 101)] + [(13, 'name13', 16), (200, 'Nanyuki', 8)]
+    assert index.complete('na', 5) == brute('na', 5)
+    assert index.complete('n', 5) == brute('n', 5)
+    assert index.complete('  ', 5) == []
+
+
+def test_refresh_keeps_edits_made_while_rebuilding(app):
+    import threading
+    from app.graph import FollowerGraph
+    from app.refresh import Refresher
+    started, release, builds = threading.Event(), threading.Event(), []
+
+    def build():
+        # Rows read before the edits below were made
+        builds.append(FollowerGraph())
+        if len(builds) > 1:
+            started.set()
+            release.wait(5)
+        builds[-1].load([(1, 2), (1, 3)])
+        return builds[-1]
+
+    refresher = Refresher(app, build, 60)
+    first = refresher.get()
+    refresher.built_at -= 120
+
+    # One stale get() rebuilds in the background, the rest keep the old graph
+    assert refresher.get() is first
+    assert started.wait(5)
+    assert refresher.get() is first
+    refresher.apply(lambda graph: graph.remove(1, 2))
+    refresher.apply(lambda graph: graph.add(2, 1))
+    assert first.following(1) == [3]
+    release.set()
+
+    with refresher._building:
+        assert len(builds) == 2
+    graph = refresher.get()
+    assert graph is builds[1]
+    assert (graph.following(1), graph.following(2), graph.followers(1)) == ([3], [1], [2])
+
+
+def test_search_ranks_by_field_weight_and_match_quality():
+    from app.search import MemoryBackend
+    backend = MemoryBackend({'post_name': 3.0, 'post_location': 1.5})
+    backend.index(1, {'post_name': 'Market day', 'post_location': 'Mombasa'})
+    backend.index(2, {'post_name': 'Mombasa beach', 'post_location': 'Lamu'})
+    backend.index(3, {'post_name': 'Sun', 'post_location': 'Lamu'})
+    backend.index(4, {'post_name': 'Sunset', 'post_location': 'Lamu'})
+    backend.index(5, {'post_name': 'Sundown', 'post_location': 'Lamu'})
+
+    def ids(query, limit=10, offset=0):
+        return [doc_id for doc_id, _ in backend.search(query, limit, offset)]
+
+    # Names outweigh locations, exact terms outweigh prefixes
+    assert ids('mombasa') == [2, 1]
+    assert ids('SUN') == [3, 4, 5]
+    # Typos within one edit, accents and every query term having to match
+    assert ids('mombsa') == [2, 1]
+    assert ids('Mómbasa markt') == [1]
+    assert ids('sunset zanzibar') == []
+    assert ids('an') == ids('') == []
+
+    # Pages are slices of one ranking, equal scores ordered by id
+    assert [ids('sun lamu', 1, offset) for offset in range(4)] == [[3], [4], [5], []]
+
+    backend.index(2, {'post_name': 'Beach', 'post_location': 'Lamu'})
+    backend.remove(4)
+    assert ids('mombasa') == [1]
+    assert ids('sun') == [3, 5]
+
+
+def test_response_cache_hits_invalidates_and_evicts():
+    from app.cache import MISSING, LRUCache, ResponseCache
+    cache = ResponseCache(LRUCache(max_entries=3), ttl=None)
+    loads = []
+
+    def loader(value):
+        return lambda: loads.append(value) or value
+
+    assert cache.entity('post', 1, loader('one')) == 'one'
+    assert cache.entity('post', 1, loader('changed')) == 'one'
+    assert cache.page('post', {'limit': 2}, loader(['one'])) == ['one']
+    assert cache.page('post', {'limit': 2}, loader(['changed'])) == ['one']
+    assert loads == ['one', ['one']]
+
+    # A write drops the entity and, through the generation, every page
+    cache.invalidate('post', 1)
+    assert cache.entity('post', 1, loader('two')) == 'two'
+    assert cache.page('post', {'limit': 2}, loader(['two'])) == ['two']
+    assert cache.page('profile', {'limit': 2}, loader(['profile'])) == ['profile']
+
+    # The least recently used entry goes first, the stale page already went
+    backend = cache.backend
+    assert backend.get('post:1') == 'two'
+    backend.set('post:2', 'three', None)
+    assert backend.get('post:1') == 'two'
+    assert [backend.get(key) is MISSING for key in ('post:page:1:{"limit": 2}', 'profile:page:0:{"limit": 2}')] == [
+        True, False
+    ]
+    stats = cache.stats()
+    assert (stats['evictions'], stats['entries'], stats['max_entries']) == (2, 3, 3)
+    assert stats['hits'] >= 4
+
+
+class MixedSchema(Schema):
+    name = fields.String()
+    count = fields.Integer()
+    ratio = fields.Float()
+    price = fields.Decimal(as_string=True, allow_none=True)
+    when = fields.DateTime(data_key='createdAt', allow_none=True)
+    owner = fields.Nested(ProfileSchema, allow_none=True)
+    owners = fields.Nested(ProfileSchema, many=True)
+    tag = fields.Pluck(PostTagSchema, 'tag_text', attribute='first_tag', allow_none=True)
+    extra = fields.Raw()
+
+
+class InferredSchema(Schema):
+    class Meta:
+        fields = ('status', 'amount', 'at', 'flag')
+
+
+def serializer_objects(make_profile, make_post):
+    from app.tags import attach_tags
+    profile = make_profile('amani')
+    post = make_post(profile)
+    attach_tags([post.id], ['Lamu'])
+    tag = PostTag.query.one()
+    comment = Comment('Karibu', post.id)
+    comment.save_comment()
+    variant = MediaVariant(post_id=post.id, name='thumb', url='/thumb.jpg', width=320, height=None, size=None)
+    job = make_profile('doomed').delete_profile()
+    now = datetime(2020, 11, 9, 16, 12, 5, 418327)
+    return {
+        ProfileSchema: [profile, Profile('bare', None, None, None, None, False, False, None)],
+        PostSchema: [
+            post, Post('media', 'draft', None, None, None, None, None),
+            db.session.query(*columns_for(PostSchema(), Post)).filter(Post.id == post.id).one()
+        ],
+        MediaVariantSchema: [variant],
+        PostTagSchema: [tag, PostTag('unsaved')],
+        CommentSchema: [comment],
+        DeletionJobSchema: [job, DeletionJob('post', 7)],
+        MixedSchema: [
+            SimpleNamespace(name=5, count=True, ratio=2, price=Decimal('1.50'), when=now,
+                            owner=profile, owners=[profile], first_tag=tag, extra=Decimal('2')),
+            SimpleNamespace(name='', count=0, ratio=None, price=None, when=None,
+                            owner=None, owners=[], first_tag=None, extra=None)
+        ],
+        InferredSchema: [
+            SimpleNamespace(status=DeletionStatus.done, amount=Decimal('0.1'), at=now, flag=None),
+            SimpleNamespace(status='done', amount=1.5, at=now.date(), flag=True)
+        ]
+    }
+
+
+@pytest.mark.parametrize('schema', [
+    ProfileSchema(), PostSchema(), PostSchema(only=('post_name', 'updated_at')), MediaVariantSchema(),
+    PostTagSchema(), CommentSchema(), DeletionJobSchema(), MixedSchema(), InferredSchema()
+], ids=lambda schema: '{}{}'.format(type(schema).__name__, '-only' if schema.only else ''))
+def test_compiled_dumps_match_marshmallow(app, make_profile, make_post, schema, monkeypatch):
+    from app.serializers import compile_dump
+    dump_one = compile_dump(schema)
+    for obj in serializer_objects(make_profile, make_post)[type(schema)]:
+        expected = schema.dump(obj)
+        # Objects carrying every field never fall back to schema.dump()
+        with monkeypatch.context() as patch:
+            patch.setattr(schema, 'dump', lambda *args, **kwargs: pytest.fail('fell back to schema.dump'))
+            assert repr(dump_one(obj)) == repr(expected)
+
+    # Anything else does, with the same result
+    partial = SimpleNamespace(post_name='partial', name='partial', status='done')
+    assert repr(dump_one(partial)) == repr(schema.dump(partial))
+
+
+def test_cursors_round_trip_and_reject_garbage():
+    from app.pagination import (
+        InvalidCursor, _encode, decode_offset_cursor, encode_cursor, encode_offset_cursor
+    )
+    key = (datetime(2020, 11, 9, 16, 12, 5, 418327), 42)
+    assert decode_cursor(encode_cursor(*key)) == key
+    assert decode_cursor(encode_cursor(key[0].replace(microsecond=0), 7)) == (key[0].replace(microsecond=0), 7)
+    assert decode_offset_cursor(encode_offset_cursor(30)) == 30
+
+    for cursor in ('', 'not-a-cursor', _encode(['yesterday', 1]), _encode([key[0].isoformat()]),
+                   _encode([key[0].isoformat(), 'x']), _encode({'offset': 3})):
+        with pytest.raises(InvalidCursor):
+            decode_cursor(cursor)
+    for cursor in ('', _encode({'offset': -1}), _encode({'page': 1}), _encode([1, 2])):
+        with pytest.raises(InvalidCursor):
+            decode_offset_cursor(cursor)
+
+
+def test_pages_break_timestamp_ties_by_id(app, make_profile, make_post):
+    from app.pagination import paginate
+    author = make_profile('author')
+    posts = [make_post(author) for _ in range(5)]
+    same = datetime(2020, 11, 9, 16, 12, 5)
+    Post.query.update({Post.timestamp: same}, synchronize_session=False)
+    newest = make_post(author)
+    db.session.commit()
+
+    names, after = [], None
+    while True:
+        page, cursor = paginate(Post.query, Post.timestamp, Post.id, 2, after)
+        names += [post.post_name for post in page]
+        if cursor is None:
+            break
+        after = decode_cursor(cursor)
+
+    # Newest first, then the posts sharing a timestamp by descending id
+    assert names == [newest.post_name] + [post.post_name for post in reversed(posts)]
+
+
+def write_records(path, records):
+    path.write_text(''.join(json.dumps(record) + '\n' for record in records))
+    return str(path)
+
+
+def test_import_loads_csv_and_ndjson_by_natural_key(app, tmp_path):
+    from app.importer import Importer, _KeyCache
+    (tmp_path / 'profiles.csv').write_text(
+        'username,country,is_verified,join_date\n'
+        'amani,kenya,yes,2020-01-02T03:04:05Z\n'
+        'zawadi,tanzania,0,\n'
+        'baraka,uganda,true,\n'
+    )
+    importer = Importer(batch_size=2, echo=lambda message: None)
+    assert importer.run('profiles', str(tmp_path / 'profiles.csv')) == 3
+    assert {profile.username: profile.is_verified for profile in Profile.query} == {
+        'amani': True, 'zawadi': False, 'baraka': True
+    }
+    assert Profile.query.filter_by(username='amani').one().join_date == datetime(2020, 1, 2, 3, 4, 5)
+
+    posts = write_records(tmp_path / 'posts.jsonl', [
+        {'username': 'amani', 'post_name': 'dhow', 'post_location': 'Lamu'},
+        {'username': 'zawadi', 'post_name': 'kilimanjaro', 'post_location': 'Moshi', 'post_type': 'video'}
+    ])
+    assert importer.run('posts', posts) == 2
+    assert {post.post_name: post.post_profile.username for post in Post.query} == {
+        'dhow': 'amani', 'kilimanjaro': 'zawadi'
+    }
+
+    # The cache stays bounded and still resolves every key asked for
+    cache = _KeyCache(Profile.username, Profile.id, size=2)
+    ids = {profile.username: profile.id for profile in Profile.query}
+    assert cache.resolve(['amani', 'zawadi', 'baraka', 'nobody']) == dict(ids, nobody=None)
+    assert len(cache._ids) == 2
+    assert cache.resolve(['baraka', 'amani']) == {'baraka': ids['baraka'], 'amani': ids['amani']}
+
+
+def test_import_resumes_after_the_last_committed_batch(app, tmp_path):
+    from app.importer import Importer, InvalidRecord
+    write_records(tmp_path / 'profiles.ndjson', [{'username': name, 'country': 'kenya'} for name in ('amani', 'zawadi')])
+    importer = Importer(batch_size=2, echo=lambda message: None)
+    importer.run('profiles', str(tmp_path / 'profiles.ndjson'))
+
+    records = [{'username': 'amani', 'post_name': 'post {}'.format(i), 'post_location': 'Lamu'} for i in range(5)]
+    records[3]['username'] = 'nobody'
+    path = write_records(tmp_path / 'posts.ndjson', records)
+    with pytest.raises(InvalidRecord):
+        importer.run('posts', path)
+    # The failed batch rolled back, the one before it stayed
+    assert sorted(post.post_name for post in Post.query) == ['post 0', 'post 1']
+
+    records[3]['username'] = 'zawadi'
+    write_records(tmp_path / 'posts.ndjson', records)
+    assert importer.run('posts', path) == 3
+    assert Post.query.count() == 5
+    assert Importer(batch_size=2, echo=lambda message: None).run('posts', path) == 0
+
+    # Restarting loads the file again from its first record
+    with pytest.raises(IntegrityError):
+        Importer(batch_size=2, resume=False, echo=lambda message: None).run('posts', path)
+
+
+def test_import_command_finalizes_counters_and_timelines(app, tmp_path, capsys):
+    from manage import Import
+    files = {
+        'profiles': [{'username': name, 'country': 'kenya'} for name in ('amani', 'zawadi', 'baraka')],
+        'posts': [{'username': 'amani', 'post_name': name, 'post_location': 'Lamu'} for name in ('dhow', 'fort')],
+        'tags': [{'post_name': 'dhow', 'tag_text': '#Lamu'}, {'post_name': 'fort', 'tag_text': 'lamu'}],
+        'comments': [{'post_name': 'dhow', 'comment': 'Karibu'}],
+        'likes': [{'username': 'zawadi', 'post_name': 'dhow'}, {'username': 'baraka', 'post_name': 'dhow'}],
+        'follows': [{'follower': 'zawadi', 'followed': 'amani'}, {'follower': 'baraka', 'followed': 'amani'}]
+    }
+    for entity, records in files.items():
+        Import().run(entity, [write_records(tmp_path / (entity + '.ndjson'), records)], None, 1000, False,
+                     entity == 'follows')
+    assert 'Counters and timelines rebuilt' in capsys.readouterr().out
+
+    db.session.expire_all()
+    amani, zawadi = (Profile.query.filter_by(username=name).one() for name in ('amani', 'zawadi'))
+    dhow = Post.query.filter_by(post_name='dhow').one()
+    assert (amani.follower_count, zawadi.following_count) == (2, 1)
+    assert (dhow.like_count, dhow.comment_count) == (2, 1)
+    assert PostTag.query.filter_by(tag_text='lamu').one().post_count == 2
+    assert [post.post_name for post in zawadi.timeline(10)[0]] == ['fort', 'dhow']
+
+    with pytest.raises(SystemExit):
+        Import().run('likes', [write_records(tmp_path / 'bad.ndjson', [{'username': 'x', 'post_name': 'dhow'}])],
+                     None, 1000, False, False)
+    assert 'Run the same command again to resume' in capsys.readouterr().out
+
+
+def test_index_migration_dedupes_follows_and_round_trips(tmp_path):
+    import sqlite3
+    import subprocess
+    import sys
+    path = tmp_path / 'migrated.db'
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, DATABASE_URL='sqlite:///{}'.format(path), CLOUDINARY_URL='cloudinary://test')
+
+    def migrate(*args):
+        result = subprocess.run([sys.executable, 'manage.py', 'db'] + list(args), cwd=root, env=env,
+                                capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+
+    def indexes(connection):
+        return {name for name, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+    migrate('upgrade', 'a4c8e2f61d07')
+    with sqlite3.connect(str(path)) as connection:
+        connection.executemany('INSERT INTO followers (follower_id, followed_id) VALUES (?, ?)',
+                               [(1, 2), (1, 2), (2, 1), (None, 1)])
+    migrate('upgrade', 'e93b7f05a6c2')
+    with sqlite3.connect(str(path)) as connection:
+        assert sorted(connection.execute('SELECT follower_id, followed_id FROM followers')) == [(1, 2), (2, 1)]
+        assert {'ix_followers_followed', 'ix_posts_profile_timestamp', 'ix_likes_post_id'} <= indexes(connection)
+
+    migrate('upgrade')
+    migrate('downgrade', 'a4c8e2f61d07')
+    with sqlite3.connect(str(path)) as connection:
+        assert 'ix_followers_followed' not in indexes(connection)